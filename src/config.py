@@ -3,4 +3,124 @@ SSID = "ssid"
 PASSWORD = "password"
 
 # Devices to listen to
-TARGET = "0.0.0.0"
\ No newline at end of file
+TARGET = "0.0.0.0"
+
+# Ping monitor (Pico W): (label, IPv4 address) pairs, pinged every
+# PING_PERIOD_MS over one non-blocking raw socket. A reply later than
+# PING_TIMEOUT_MS counts as lost; min/avg/max/loss cover the last
+# PING_HISTORY results per target. The first two are shown on the ping page.
+# While requests are in flight replies are checked every PING_POLL_MS (the
+# RTT resolution).
+PING_TARGETS = (("target", TARGET),)
+PING_PERIOD_MS = 5000
+PING_TIMEOUT_MS = 2000
+PING_HISTORY = 60
+PING_POLL_MS = 10
+
+# Prometheus metrics endpoint (Pico W): GET /metrics on METRICS_PORT (0 turns
+# it off). Up to METRICS_MAX_CLIENTS scrapers are served at once, each
+# dropped if not done within METRICS_TIMEOUT_MS. The response is rendered
+# into a METRICS_BUFFER_BYTES buffer at most every METRICS_REFRESH_MS and
+# shared by concurrent scrapes; sockets are polled every METRICS_POLL_MS.
+METRICS_PORT = 9100
+METRICS_MAX_CLIENTS = 4
+METRICS_BUFFER_BYTES = 4096
+METRICS_REFRESH_MS = 1000
+METRICS_TIMEOUT_MS = 5000
+METRICS_POLL_MS = 50
+
+# MQTT publisher (Pico W): commits are queued and published to MQTT_TOPIC on
+# the broker at MQTT_BROKER (an IPv4 address; "" turns it off), MQTT_BATCH
+# readings per message, or fewer once the oldest has waited MQTT_BATCH_MS.
+# While Wi-Fi or the broker is down up to MQTT_QUEUE_RECORDS readings are
+# kept (9 bytes each; the oldest are dropped first). After a reconnect the
+# backlog drains one message per MQTT_DRAIN_MS. Failed connects back off from
+# MQTT_BACKOFF_MIN_MS to MQTT_BACKOFF_MAX_MS.
+MQTT_BROKER = ""
+MQTT_PORT = 1883
+MQTT_CLIENT_ID = "pulspi"
+MQTT_TOPIC = "pulspi/readings"
+MQTT_USER = None
+MQTT_PASSWORD = None
+MQTT_KEEPALIVE_S = 60
+MQTT_BATCH = 10
+MQTT_BATCH_MS = 30000
+MQTT_QUEUE_RECORDS = 512
+MQTT_DRAIN_MS = 250
+MQTT_CONNECT_TIMEOUT_MS = 5000
+MQTT_BACKOFF_MIN_MS = 2000
+MQTT_BACKOFF_MAX_MS = 300000
+MQTT_POLL_MS = 100
+
+# Task periods (milliseconds). Each subsystem runs as its own task and can be
+# tuned independently.
+CLI_PERIOD_MS = 50        # serial command polling (command latency)
+SENSOR_PERIOD_MS = 1000   # sensor/override commits; DHT11 itself is rate-limited to 2s
+DISPLAY_POLL_MS = 250    # longest wait before a committed change shows on the LCD
+PAGE_PERIOD_MS = 5000     # how long each display page stays up
+NET_PERIOD_MS = 10000     # Wi-Fi link check
+
+# Debug: measure the heap bytes each rendered frame allocates (shown by
+# "perf"). Garbage collection is held off around every render while on.
+MEASURE_RENDER_ALLOC = False
+
+# Wi-Fi bring-up (Pico W) runs in the background: an attempt that is not up
+# within WIFI_CONNECT_TIMEOUT_MS is retried after a backoff doubling from
+# WIFI_BACKOFF_MIN_MS to WIFI_BACKOFF_MAX_MS. While connecting the link is
+# checked every WIFI_POLL_MS.
+WIFI_CONNECT_TIMEOUT_MS = 15000
+WIFI_BACKOFF_MIN_MS = 2000
+WIFI_BACKOFF_MAX_MS = 300000
+WIFI_POLL_MS = 250
+
+# Serial command input. Bytes are read as they arrive (never waiting for a
+# newline) into a CLI_LINE_BYTES line buffer; longer lines are dropped. Each
+# cli tick reads at most CLI_READ_BYTES and runs at most
+# CLI_COMMANDS_PER_TICK commands, so a scripted burst cannot starve the
+# display or sensor tasks; the rest waits for the next tick.
+CLI_LINE_BYTES = 160
+CLI_READ_BYTES = 256
+CLI_COMMANDS_PER_TICK = 8
+
+# Binary telemetry stream over USB serial (the "stream" command): seconds
+# between frames at boot; 0 = off until enabled from the CLI.
+STREAM_PERIOD_S = 0
+
+# History ring buffer: one averaged sample per interval, 6 bytes each.
+# 1500 samples at 60s covers 25 hours in ~9 KB.
+HISTORY_INTERVAL_S = 60
+HISTORY_CAPACITY = 1500
+
+# Rolling min/max windows (seconds), kept alongside the since-boot min/max.
+# Each window is tracked in MINMAX_WINDOW_BUCKETS buckets (~3 KB per window);
+# its edge moves in steps of window / buckets (30 s for 1h, 12 min for 24h).
+MINMAX_WINDOWS_S = (3600, 86400)
+MINMAX_WINDOW_BUCKETS = 120
+SUMMARY_WINDOW_S = 86400  # min/max window on page 1; 0 = since boot
+
+# Rollups: (bucket seconds, buckets) per level, finest first. Each bucket
+# holds min/max/sum/count in 24 bytes; these cover 2 hours by minute, 8 days
+# by hour and ~3 months by day in ~10 KB.
+ROLLUP_LEVELS = ((60, 120), (3600, 192), (86400, 92))
+
+# Telemetry log on flash (see telemetry_log.py). A reading is logged when it
+# changes, or every LOG_HEARTBEAT_S otherwise. Records are delta-encoded
+# (~2 bytes each) and written a page at a time; 16 segments of 16 KB cap the
+# log at 256 KB.
+LOG_DIR = "log"
+LOG_HEARTBEAT_S = 60
+LOG_PAGE_BYTES = 256
+LOG_SEGMENT_BYTES = 16384
+LOG_SEGMENTS = 16
+LOG_FLUSH_S = 600         # longest a record waits in RAM before a partial-page write
+LOG_PERIOD_MS = 1000      # log flush check
+
+# State snapshots, each saved (when changed) to one of two files in turn and
+# restored at boot. The compact state (min/max, overrides and the data time,
+# a few hundred bytes) is saved every SNAPSHOT_PERIOD_S. History, rollups and
+# windows (~37 KB with the settings above) are saved every
+# SNAPSHOT_DATA_PERIOD_S and on "snapshot save", to spare the flash.
+SNAPSHOT_FILES = ("state_a.bin", "state_b.bin")
+SNAPSHOT_PERIOD_S = 300
+SNAPSHOT_DATA_FILES = ("data_a.bin", "data_b.bin")
+SNAPSHOT_DATA_PERIOD_S = 21600
@@ -0,0 +1,495 @@
+from array import array
+
+# Fixed-point scale for stored readings (0.1 degree / 0.1 %RH resolution)
+SCALE = 10
+
+# Marks a missing value in the int16 sample arrays
+MISSING = -32768
+
+# Largest gap between consecutive samples that the uint16 delta can hold
+MAX_DELTA_S = 65535
+
+INF = float("inf")
+
+
+def is_finite(value):
+    # False for nan and +/-inf, which have no fixed-point form
+    return value == value and value not in (INF, -INF)
+
+
+def to_fixed(value):
+    # Converts a reading to int16 fixed point, or MISSING for None (and
+    # for nan/inf, so a bad value can't raise in a task)
+    if value is None or not is_finite(value):
+        return MISSING
+    fixed = round(value * SCALE)
+    if fixed > 32767:
+        return 32767
+    if fixed < -32767:
+        return -32767
+    return fixed
+
+
+class History:
+
+    # Fixed-memory ring buffer of temperature/humidity samples.
+    #
+    # Commits arrive every second or two, far more often than history needs,
+    # so add() averages them over interval_s and appends one sample per
+    # interval. Samples are stored as int16 fixed point (value * SCALE) in
+    # array('h'). Timestamps are stored as the seconds since the previous
+    # sample in array('H'), and only the newest sample's absolute time is
+    # kept. The whole store is allocated once: 6 bytes per sample.
+    #
+    # A gap longer than MAX_DELTA_S (~18 h) is clamped, which shifts the
+    # times of older samples slightly later.
+
+    # State saved and restored by snapshot.py; restored only if the
+    # SNAPSHOT_KEY fields match the current configuration
+    SNAPSHOT_KEY = ("capacity", "interval_s")
+    SNAPSHOT_FIELDS = ("_head", "_count", "_newest_s", "_bucket",
+                       "_temp_sum", "_temp_n", "_hum_sum", "_hum_n")
+    SNAPSHOT_BUFFERS = ("_temp", "_hum", "_delta")
+
+    def __init__(self, capacity, interval_s=60):
+        self.capacity = capacity
+        self.interval_s = interval_s
+        self._temp = array('h', [MISSING] * capacity)
+        self._hum = array('h', [MISSING] * capacity)
+        self._delta = array('H', [0] * capacity)
+        self._head = 0       # index the next sample goes to
+        self._count = 0
+        self._newest_s = 0   # absolute time of the newest sample
+        # Interval being averaged
+        self._bucket = None
+        self._temp_sum = 0
+        self._temp_n = 0
+        self._hum_sum = 0
+        self._hum_n = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, t_s, temp, hum):
+        # Feeds one committed reading. Appends the previous interval's
+        # average once t_s moves into a new interval. O(1).
+        bucket = t_s // self.interval_s
+        if bucket != self._bucket:
+            self.flush()
+            self._bucket = bucket
+        if temp is not None:
+            self._temp_sum += to_fixed(temp)
+            self._temp_n += 1
+        if hum is not None:
+            self._hum_sum += to_fixed(hum)
+            self._hum_n += 1
+
+    def flush(self):
+        # Appends the interval being averaged, if it holds any readings
+        if self._bucket is None or not (self._temp_n or self._hum_n):
+            return
+        temp = self._temp_sum // self._temp_n if self._temp_n else MISSING
+        hum = self._hum_sum // self._hum_n if self._hum_n else MISSING
+        self.append(self._bucket * self.interval_s, temp, hum)
+        self._temp_sum = self._temp_n = 0
+        self._hum_sum = self._hum_n = 0
+
+    def append(self, t_s, temp_fixed, hum_fixed):
+        # Appends one sample (fixed-point values), overwriting the oldest
+        # once full. O(1).
+        delta = t_s - self._newest_s if self._count else 0
+        if delta < 0:
+            delta = 0
+        elif delta > MAX_DELTA_S:
+            delta = MAX_DELTA_S
+        i = self._head
+        self._temp[i] = temp_fixed
+        self._hum[i] = hum_fixed
+        self._delta[i] = delta
+        self._newest_s = t_s
+        self._head = (i + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+        self._bucket = None
+        self._temp_sum = self._temp_n = 0
+        self._hum_sum = self._hum_n = 0
+
+    def window(self, seconds, now_s=None):
+        # Yields (t_s, temp_fixed, hum_fixed) newest first, for samples no
+        # older than seconds before now_s (default: the newest sample).
+        # Read-only; values are fixed point and may be MISSING.
+        if not self._count:
+            return
+        if now_s is None:
+            now_s = self._newest_s
+        oldest_s = now_s - seconds
+        t = self._newest_s
+        i = (self._head - 1) % self.capacity
+        for _ in range(self._count):
+            if t < oldest_s:
+                return
+            yield t, self._temp[i], self._hum[i]
+            t -= self._delta[i]
+            i = (i - 1) % self.capacity
+
+
+class _ExtremeDeque:
+
+    # Monotonic deque over (time, value) pairs in fixed arrays. For a max
+    # deque the values strictly decrease from front to back, so the front is
+    # always the window maximum (and the reverse for a min deque). Each value
+    # is pushed and popped at most once: amortized O(1) per push.
+
+    SNAPSHOT_KEY = ("_capacity", "_is_max")
+    SNAPSHOT_FIELDS = ("_front", "_count")
+    SNAPSHOT_BUFFERS = ("_vals", "_times")
+
+    def __init__(self, capacity, is_max):
+        self._vals = array('h', [0] * capacity)
+        self._times = array('l', [0] * capacity)
+        self._capacity = capacity
+        self._front = 0
+        self._count = 0
+        self._is_max = is_max
+
+    def clear(self):
+        self._front = 0
+        self._count = 0
+
+    def push(self, t_s, value):
+        vals = self._vals
+        capacity = self._capacity
+        # Drop entries from the back that the new value dominates
+        while self._count:
+            back = (self._front + self._count - 1) % capacity
+            if (vals[back] <= value) if self._is_max else (vals[back] >= value):
+                self._count -= 1
+            else:
+                break
+        if self._count == capacity:
+            self._front = (self._front + 1) % capacity
+            self._count -= 1
+        i = (self._front + self._count) % capacity
+        vals[i] = value
+        self._times[i] = t_s
+        self._count += 1
+
+    def expire(self, oldest_s):
+        # Drops entries older than oldest_s from the front
+        while self._count and self._times[self._front] < oldest_s:
+            self._front = (self._front + 1) % self._capacity
+            self._count -= 1
+
+    def front(self):
+        if not self._count:
+            return None
+        return self._vals[self._front]
+
+
+def _pick(a, b, is_max):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if is_max:
+        return a if a >= b else b
+    return a if a <= b else b
+
+
+class WindowMinMax:
+
+    # Rolling-window min/max of temperature and humidity (e.g. last hour).
+    #
+    # Readings are folded into buckets of window_s // buckets seconds. When a
+    # bucket closes, its extremes go into four monotonic deques, and buckets
+    # that slid out of the window are expired from their fronts. Queries
+    # combine the deque fronts with the open bucket, so each commit costs
+    # amortized O(1) and nothing ever rescans history. Memory is fixed at
+    # about 24 bytes per bucket. The window edge moves in whole buckets.
+    #
+    # Values are fixed point (see to_fixed), or None when nothing is in range.
+
+    SNAPSHOT_KEY = ("window_s", "bucket_s")
+    SNAPSHOT_FIELDS = ("_bucket", "_open_temp_min", "_open_temp_max",
+                       "_open_hum_min", "_open_hum_max")
+    SNAPSHOT_CHILDREN = ("_temp_min", "_temp_max", "_hum_min", "_hum_max")
+
+    def __init__(self, window_s, buckets=120):
+        self.window_s = window_s
+        self.bucket_s = max(1, window_s // buckets)
+        capacity = buckets + 2
+        self._temp_min = _ExtremeDeque(capacity, False)
+        self._temp_max = _ExtremeDeque(capacity, True)
+        self._hum_min = _ExtremeDeque(capacity, False)
+        self._hum_max = _ExtremeDeque(capacity, True)
+        self._bucket = None
+        self._seen = [None, None, None, None]  # extremes as of the last add()
+        self._reset_open()
+
+    def _reset_open(self):
+        self._open_temp_min = None
+        self._open_temp_max = None
+        self._open_hum_min = None
+        self._open_hum_max = None
+
+    def clear(self):
+        self._temp_min.clear()
+        self._temp_max.clear()
+        self._hum_min.clear()
+        self._hum_max.clear()
+        self._bucket = None
+        for i in range(4):
+            self._seen[i] = None
+        self._reset_open()
+
+    def add(self, t_s, temp, hum):
+        # Feeds one committed reading. Returns True if the window's min/max
+        # changed.
+        bucket = t_s // self.bucket_s
+        if bucket != self._bucket:
+            self._close_bucket()
+            self._bucket = bucket
+        self._expire(t_s)
+        if temp is not None:
+            temp = to_fixed(temp)
+            self._open_temp_min = _pick(self._open_temp_min, temp, False)
+            self._open_temp_max = _pick(self._open_temp_max, temp, True)
+        if hum is not None:
+            hum = to_fixed(hum)
+            self._open_hum_min = _pick(self._open_hum_min, hum, False)
+            self._open_hum_max = _pick(self._open_hum_max, hum, True)
+        return self._extremes_changed()
+
+    def _extremes_changed(self):
+        # Compares the extremes with those seen last time, value by value,
+        # so a commit builds no tuples
+        seen = self._seen
+        changed = False
+        value = _pick(self._temp_min.front(), self._open_temp_min, False)
+        if value != seen[0]:
+            seen[0] = value
+            changed = True
+        value = _pick(self._temp_max.front(), self._open_temp_max, True)
+        if value != seen[1]:
+            seen[1] = value
+            changed = True
+        value = _pick(self._hum_min.front(), self._open_hum_min, False)
+        if value != seen[2]:
+            seen[2] = value
+            changed = True
+        value = _pick(self._hum_max.front(), self._open_hum_max, True)
+        if value != seen[3]:
+            seen[3] = value
+            changed = True
+        return changed
+
+    def _close_bucket(self):
+        if self._bucket is None:
+            return
+        t_s = self._bucket * self.bucket_s
+        if self._open_temp_min is not None:
+            self._temp_min.push(t_s, self._open_temp_min)
+            self._temp_max.push(t_s, self._open_temp_max)
+        if self._open_hum_min is not None:
+            self._hum_min.push(t_s, self._open_hum_min)
+            self._hum_max.push(t_s, self._open_hum_max)
+        self._reset_open()
+
+    def _expire(self, now_s):
+        # A closed bucket stays while any part of it is inside the window
+        oldest_s = now_s - self.window_s - self.bucket_s + 1
+        self._temp_min.expire(oldest_s)
+        self._temp_max.expire(oldest_s)
+        self._hum_min.expire(oldest_s)
+        self._hum_max.expire(oldest_s)
+
+    def temp_range(self, now_s=None):
+        # (min, max) temperature in the window ending at now_s
+        if now_s is not None:
+            self._refresh(now_s)
+        return (_pick(self._temp_min.front(), self._open_temp_min, False),
+                _pick(self._temp_max.front(), self._open_temp_max, True))
+
+    def hum_range(self, now_s=None):
+        # (min, max) humidity in the window ending at now_s
+        if now_s is not None:
+            self._refresh(now_s)
+        return (_pick(self._hum_min.front(), self._open_hum_min, False),
+                _pick(self._hum_max.front(), self._open_hum_max, True))
+
+    def snapshot(self):
+        # (temp_min, temp_max, hum_min, hum_max) as of the last commit
+        return self.temp_range() + self.hum_range()
+
+    def _refresh(self, now_s):
+        # Ages the window forward for queries made between commits
+        if self._bucket is not None and now_s // self.bucket_s != self._bucket:
+            self._close_bucket()
+            self._bucket = now_s // self.bucket_s
+        self._expire(now_s)
+
+
+class _RollupLevel:
+
+    # Ring of fixed-period buckets holding min/max/sum/count per metric
+    # (0 = temperature, 1 = humidity), interleaved at slot * 2 + metric.
+    # The bucket at _head is open; when time moves past it, it closes and is
+    # merged into the parent level's open bucket.
+
+    SNAPSHOT_KEY = ("period_s", "capacity")
+    SNAPSHOT_FIELDS = ("_head", "_filled", "_bucket")
+    SNAPSHOT_BUFFERS = ("_min", "_max", "_sum", "_n")
+
+    def __init__(self, period_s, capacity):
+        self.period_s = period_s
+        self.capacity = capacity
+        self.parent = None
+        self._min = array('h', [0] * (capacity * 2))
+        self._max = array('h', [0] * (capacity * 2))
+        self._sum = array('l', [0] * (capacity * 2))
+        self._n = array('l', [0] * (capacity * 2))
+        self.clear()
+
+    def clear(self):
+        self._head = 0
+        self._filled = 0      # buckets holding data or gaps, including the open one
+        self._bucket = None   # bucket number (t_s // period_s) of the open bucket
+        self._reset(0)
+
+    def _reset(self, slot):
+        for i in (slot * 2, slot * 2 + 1):
+            self._min[i] = 32767
+            self._max[i] = -32767
+            self._sum[i] = 0
+            self._n[i] = 0
+
+    def advance(self, bucket):
+        # Moves the open bucket forward, closing the current one
+        if self._bucket is None:
+            self._bucket = bucket
+            self._filled = 1
+            return
+        if bucket <= self._bucket:
+            return
+        if self.parent is not None and (self._n[self._head * 2] or self._n[self._head * 2 + 1]):
+            self.parent.merge(self._bucket * self.period_s, self, self._head)
+        steps = bucket - self._bucket
+        if steps > self.capacity:
+            steps = self.capacity
+        for _ in range(steps):
+            self._head = (self._head + 1) % self.capacity
+            self._reset(self._head)
+        self._filled = min(self._filled + steps, self.capacity)
+        self._bucket = bucket
+
+    def add(self, metric, value):
+        # Folds one fixed-point value into the open bucket
+        i = self._head * 2 + metric
+        if value < self._min[i]:
+            self._min[i] = value
+        if value > self._max[i]:
+            self._max[i] = value
+        self._sum[i] += value
+        self._n[i] += 1
+
+    def merge(self, t_s, child, slot):
+        # Folds a closed child bucket (starting at t_s) into this level
+        self.advance(t_s // self.period_s)
+        for metric in (0, 1):
+            src = slot * 2 + metric
+            if not child._n[src]:
+                continue
+            i = self._head * 2 + metric
+            if child._min[src] < self._min[i]:
+                self._min[i] = child._min[src]
+            if child._max[src] > self._max[i]:
+                self._max[i] = child._max[src]
+            self._sum[i] += child._sum[src]
+            self._n[i] += child._n[src]
+
+    def accumulate(self, out, start_s, buckets=None):
+        # Folds the newest buckets that end after start_s (at most buckets of
+        # them) into out = [t_min, t_max, t_sum, t_n, h_min, h_max, h_sum, h_n]
+        if self._bucket is None:
+            return
+        if buckets is None or buckets > self._filled:
+            buckets = self._filled
+        for age in range(buckets):
+            if (self._bucket - age + 1) * self.period_s <= start_s:
+                return
+            slot = (self._head - age) % self.capacity
+            for metric in (0, 1):
+                i = slot * 2 + metric
+                n = self._n[i]
+                if not n:
+                    continue
+                o = metric * 4
+                if out[o] is None or self._min[i] < out[o]:
+                    out[o] = self._min[i]
+                if out[o + 1] is None or self._max[i] > out[o + 1]:
+                    out[o + 1] = self._max[i]
+                out[o + 2] += self._sum[i]
+                out[o + 3] += n
+
+
+class Rollups:
+
+    # Multi-resolution min/max/sum/count of temperature and humidity, e.g.
+    # per minute, per hour and per day.
+    #
+    # Each reading updates only the finest level's open bucket. When a
+    # bucket closes it is merged into the next level's open bucket, and so on
+    # up the cascade, so a commit costs O(1) (amortized) and old buckets
+    # age out of each ring on their own. Storage is fixed arrays: 24 bytes per
+    # bucket.
+    #
+    # query(seconds) reads the finest level that covers the whole span, plus
+    # the still-open buckets below it, so it costs O(buckets), not
+    # O(samples). Spans resolve to whole buckets of that level. Values are
+    # fixed point (see to_fixed).
+
+    SNAPSHOT_CHILDREN = ("levels",)
+
+    def __init__(self, levels):
+        # levels: ((period_s, capacity), ...) from finest to coarsest
+        self.levels = [_RollupLevel(period_s, capacity) for period_s, capacity in levels]
+        for child, parent in zip(self.levels, self.levels[1:]):
+            child.parent = parent
+
+    def clear(self):
+        for level in self.levels:
+            level.clear()
+
+    def add(self, t_s, temp, hum):
+        # Feeds one committed reading
+        level = self.levels[0]
+        level.advance(t_s // level.period_s)
+        if temp is not None:
+            level.add(0, to_fixed(temp))
+        if hum is not None:
+            level.add(1, to_fixed(hum))
+
+    def level_for(self, seconds):
+        # Finest level whose ring spans seconds (the coarsest if none does)
+        for level in self.levels:
+            if level.period_s * (level.capacity - 1) >= seconds:
+                return level
+        return self.levels[-1]
+
+    def query(self, seconds, now_s):
+        # [t_min, t_max, t_sum, t_n, h_min, h_max, h_sum, h_n] over the last
+        # seconds before now_s; min/max are None when there is no data
+        out = [None, None, 0, 0, None, None, 0, 0]
+        target = self.level_for(seconds)
+        start_s = now_s - seconds
+        target.accumulate(out, start_s)
+        for level in self.levels:
+            if level is target:
+                break
+            # Open buckets below the target have not been merged up yet
+            level.accumulate(out, start_s, 1)
+        return out
@@ -43,6 +43,12 @@ class LcdApi:
     LCD_RW_WRITE        = 0
     LCD_RW_READ         = 1
 
+    # flush() merges two changed runs on a line when at most this many
+    # unchanged cells separate them. Resending one unchanged cell costs the
+    # same as the address command it saves, and keeps the run in a single
+    # transaction.
+    FLUSH_MAX_GAP       = 1
+
     def __init__(self, num_lines, num_columns):
         self.num_lines = num_lines
         if self.num_lines > 4:
@@ -54,6 +60,15 @@ class LcdApi:
         self.cursor_y = 0
         self.implied_newline = False
         self.backlight = True
+        # Characters for the current line are collected here and sent as one
+        # run, since a run can never extend past the end of a line.
+        self._run = bytearray(self.num_columns)
+        # Shadow DDRAM: _shadow mirrors what is on the glass, _frame is the
+        # next frame being composed. flush() only sends cells that differ.
+        size = self.num_lines * self.num_columns
+        self._frame = bytearray(b' ' * size)
+        self._shadow = bytearray(b' ' * size)
+        self._shadow_valid = False
         self.display_off()
         self.backlight_on()
         self.clear()
@@ -67,6 +82,11 @@ class LcdApi:
         self.hal_write_command(self.LCD_HOME)
         self.cursor_x = 0
         self.cursor_y = 0
+        # A cleared LCD holds spaces in every cell
+        shadow = self._shadow
+        for i in range(len(shadow)):
+            shadow[i] = 0x20
+        self._shadow_valid = True
 
     def show_cursor(self):
         # Causes the cursor to be made visible
@@ -126,29 +146,134 @@ class LcdApi:
     def putchar(self, char):
         # Writes the indicated character to the LCD at the current cursor
         # position, and advances the cursor by one position.
-        if char == '\n':
-            if self.implied_newline:
-                # self.implied_newline means we advanced due to a wraparound,
-                # so if we get a newline right after that we ignore it.
-                pass
-            else:
-                self.cursor_x = self.num_columns
-        else:
-            self.hal_write_data(ord(char))
-            self.cursor_x += 1
-        if self.cursor_x >= self.num_columns:
-            self.cursor_x = 0
-            self.cursor_y += 1
-            self.implied_newline = (char != '\n')
-        if self.cursor_y >= self.num_lines:
-            self.cursor_y = 0
-        self.move_to(self.cursor_x, self.cursor_y)
+        self.putstr(char)
 
     def putstr(self, string):
         # Write the indicated string to the LCD at the current cursor
         # position and advances the cursor position appropriately.
+        #
+        # The LCD advances its own address after each character (entry mode
+        # LCD_ENTRY_INC), so the cursor is tracked here in software and an
+        # address command is only sent when a line wraps. Characters between
+        # wraps are handed to the hal as a single run.
+        run = self._run
+        count = 0
         for char in string:
-            self.putchar(char)
+            if char == '\n':
+                if self.implied_newline:
+                    # self.implied_newline means we advanced due to a wraparound,
+                    # so if we get a newline right after that we ignore it.
+                    pass
+                else:
+                    self.cursor_x = self.num_columns
+            else:
+                byte = ord(char) & 0xff
+                run[count] = byte
+                count += 1
+                if self.cursor_x < self.num_columns and self.cursor_y < self.num_lines:
+                    self._shadow[self.cursor_y * self.num_columns + self.cursor_x] = byte
+                self.cursor_x += 1
+            if self.cursor_x >= self.num_columns:
+                if count:
+                    self.hal_write_data_buf(run, count)
+                    count = 0
+                self.cursor_x = 0
+                self.cursor_y += 1
+                self.implied_newline = (char != '\n')
+                if self.cursor_y >= self.num_lines:
+                    self.cursor_y = 0
+                # The LCD's address does not follow line boundaries, so move
+                # explicitly to the start of the next line.
+                self.move_to(self.cursor_x, self.cursor_y)
+        if count:
+            self.hal_write_data_buf(run, count)
+
+    def frame_write(self, cursor_x, cursor_y, text):
+        # Writes text (a str or bytes-like object) into the frame being
+        # composed, starting at the indicated position and clipped to the end
+        # of the line. Nothing is sent to the LCD until flush() is called.
+        if cursor_y >= self.num_lines or cursor_x >= self.num_columns:
+            return
+        frame = self._frame
+        i = cursor_y * self.num_columns + cursor_x
+        end = (cursor_y + 1) * self.num_columns
+        if isinstance(text, str):
+            for char in text:
+                if i >= end:
+                    break
+                frame[i] = ord(char) & 0xff
+                i += 1
+        else:
+            # Indexed loop: iterating the buffer itself would allocate an iterator
+            for k in range(len(text)):
+                if i >= end:
+                    break
+                frame[i] = text[k]
+                i += 1
+
+    def frame_fill(self, char=' '):
+        # Fills the frame being composed with a single character.
+        frame = self._frame
+        byte = ord(char) & 0xff
+        for i in range(len(frame)):
+            frame[i] = byte
+
+    def invalidate(self):
+        # Forgets what is on the glass, so the next flush() rewrites every
+        # cell. Useful if the LCD may have been disturbed (e.g. a power glitch).
+        self._shadow_valid = False
+
+    def flush(self):
+        # Makes the LCD show the composed frame. Only cells that differ from
+        # the shadow copy are sent, as runs per line, and an address command
+        # is only issued when the cursor is not already at the start of a run.
+        cols = self.num_columns
+        frame = self._frame
+        shadow = self._shadow
+        run = self._run
+        full = not self._shadow_valid
+        for y in range(self.num_lines):
+            base = y * cols
+            x = 0
+            while x < cols:
+                if not full and frame[base + x] == shadow[base + x]:
+                    x += 1
+                    continue
+                # Grow the run until more than FLUSH_MAX_GAP unchanged cells follow
+                start = x
+                end = x + 1
+                j = x + 1
+                while j < cols:
+                    if full or frame[base + j] != shadow[base + j]:
+                        end = j + 1
+                    elif j - end >= self.FLUSH_MAX_GAP:
+                        break
+                    j += 1
+                if self.cursor_x != start or self.cursor_y != y:
+                    self.move_to(start, y)
+                count = 0
+                for i in range(base + start, base + end):
+                    run[count] = frame[i]
+                    count += 1
+                try:
+                    self.hal_write_data_buf(run, count)
+                except OSError:
+                    # Unknown how much reached the glass: rewrite it all next time
+                    self.invalidate()
+                    raise
+                # Only now are these cells known to be on the glass
+                for i in range(base + start, base + end):
+                    shadow[i] = frame[i]
+                # The LCD auto-incremented past the run
+                self.cursor_x = end
+                if end >= cols:
+                    # Past the last column the address is off-screen; wrap
+                    # like putstr() does
+                    self.cursor_x = 0
+                    self.cursor_y = (y + 1) % self.num_lines
+                    self.move_to(self.cursor_x, self.cursor_y)
+                x = end
+        self._shadow_valid = True
 
     def custom_char(self, location, charmap):
         # Write a character to one of the 8 CGRAM locations, available
@@ -181,6 +306,13 @@ class LcdApi:
         # It is expected that a derived HAL class will implement this function.
         raise NotImplementedError
 
+    def hal_write_data_buf(self, buf, count):
+        # Write the first count bytes of buf to the LCD as data. The LCD
+        # auto-increments its address after each byte (LCD_ENTRY_INC).
+        # A derived HAL class may override this to batch the transfer.
+        for i in range(count):
+            self.hal_write_data(buf[i])
+
     def hal_sleep_us(self, usecs):
         # Sleep for some time (given in microseconds)
         time.sleep_us(usecs)
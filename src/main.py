@@ -1,19 +1,30 @@
-import os
 import utime
-import network
-import socket
-import machine
 import config
 try:
-    import uping
-    NET_AVAILABLE = True
+    import network
+    NET_AVAILABLE = hasattr(network, "WLAN")
 except ImportError:
-    uping = None
+    network = None
     NET_AVAILABLE = False
 from machine import Pin, I2C
 from pico_i2c_lcd import I2cLcd
+from history import History, Rollups, WindowMinMax, MISSING, SCALE, to_fixed, is_finite
+from telemetry_log import TelemetryLog, SOURCES, source_code
+from telemetry_stream import FRAME_SIZE, pack_frame
+from snapshot import SnapshotStore
+from wifi import WifiLink, UP, CONNECTING
+from ping_monitor import PingMonitor
+from metrics_server import MetricsServer
+from mqtt_publisher import MqttPublisher
+from state import State, BITS, ALL_BITS
 import dht
+import gc
+import json
 import sys
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 
 # Non-blocking stdin support (not present on every MicroPython build)
 try:
@@ -36,87 +47,100 @@ i2c = I2C(0, sda=I2C_SDA, scl=I2C_SCL, freq=400000)
 lcd = I2cLcd(i2c, I2C_ADDR, 2, 16)
 print("Display Ready")
 
-# Flicker-free line writer (pads/overwrites, no clears per frame)
-_last_l0 = None
-_last_l1 = None
-
-def lcd_write_line(row, text):
-    global _last_l0, _last_l1
-    text = (text + " " * 16)[:16]  # pad/trim to 16 cols
-
-    if row == 0:
-        if text == _last_l0:
-            return
-        _last_l0 = text
-    else:
-        if text == _last_l1:
-            return
-        _last_l1 = text
-
-    lcd.move_to(0, row)
-    lcd.putstr(text)
-
+# Flicker-free frames (no clears per frame)
+# Rows are composed into the LCD's shadow framebuffer (row_finish()); lcd.flush()
+# then sends only the cells that changed since the last frame.
 def lcd_new_page():
     # Don't clear here; clearing causes visible wipe during slow operations.
-    global _last_l0, _last_l1
-    _last_l0 = None
-    _last_l1 = None
+    # Start the new page from a blank frame so nothing leaks from the old one.
+    lcd.frame_fill()
 
 
 # Network Setup (optional)
+# The link is brought up in the background by the net task (see wifi.py), so
+# boot never waits for an access point.
 if NET_AVAILABLE:
     wlan = network.WLAN(network.STA_IF)
     wlan.active(True)
-    wlan.connect(config.SSID, config.PASSWORD)
+    WIFI = WifiLink(wlan, config.SSID, config.PASSWORD, config.WIFI_CONNECT_TIMEOUT_MS,
+                    config.WIFI_BACKOFF_MIN_MS, config.WIFI_BACKOFF_MAX_MS,
+                    config.WIFI_POLL_MS, config.NET_PERIOD_MS)
     print("Network Setup Loaded")
-
-    # Wait for connection (but do not block forever)
-    print("Initializing Network")
-    for _ in range(10):  # ~10 seconds max, then continue without net
-        if wlan.isconnected():
-            break
-        utime.sleep(1)
-
-    if wlan.isconnected():
-        print(f"Network Connected: {wlan.ifconfig()[0]}")
-    else:
-        print("Network not connected - continuing without network features")
 else:
     print("Network features unavalible. Skipping...")
 
 ##############################################################################################################
 ##############################################################################################################
 
-# Overrides / test harness
-OVERRIDE_TEMP = None
-OVERRIDE_HUM = None
-
-# Uptime override is an OFFSET (seconds), so it keeps counting
-OVERRIDE_UPTIME_OFFSET_S = 0
-
-# Min/Max stats (since boot)
-MIN_TEMP = None
-MAX_TEMP = None
-MIN_HUM  = None
-MAX_HUM  = None
+# Device state (see state.py)
+# Readings, overrides and min/max live in one object. Writers mark the
+# fields they change; STATE.publish() (after each CLI poll and each commit)
+# notifies the consumers subscribed to those fields.
+STATE = State()
 
 def update_min_max(temp, hum):
-    global MIN_TEMP, MAX_TEMP, MIN_HUM, MAX_HUM
+    # Returns True if any min/max value changed
+    changed = False
 
     if temp is not None:
-        if MIN_TEMP is None or temp < MIN_TEMP:
-            MIN_TEMP = temp
-        if MAX_TEMP is None or temp > MAX_TEMP:
-            MAX_TEMP = temp
+        if STATE.min_temp is None or temp < STATE.min_temp:
+            changed |= STATE.set("min_temp", temp)
+        if STATE.max_temp is None or temp > STATE.max_temp:
+            changed |= STATE.set("max_temp", temp)
 
     if hum is not None:
-        if MIN_HUM is None or hum < MIN_HUM:
-            MIN_HUM = hum
-        if MAX_HUM is None or hum > MAX_HUM:
-            MAX_HUM = hum
+        if STATE.min_hum is None or hum < STATE.min_hum:
+            changed |= STATE.set("min_hum", hum)
+        if STATE.max_hum is None or hum > STATE.max_hum:
+            changed |= STATE.set("max_hum", hum)
+
+    return changed
+
+# Rolling-window min/max (e.g. last hour / last day), fed by every commit.
+# Since-boot extremes freeze once the unit has seen a hot afternoon; these
+# keep tracking recent conditions.
+MINMAX_WINDOWS = tuple(WindowMinMax(s, config.MINMAX_WINDOW_BUCKETS) for s in config.MINMAX_WINDOWS_S)
+
+# Window shown on page 1 (None = since boot) and its last committed
+# (temp_min, temp_max, hum_min, hum_max), fixed point
+SUMMARY_WINDOW = None
+for _window in MINMAX_WINDOWS:
+    if _window.window_s == config.SUMMARY_WINDOW_S:
+        SUMMARY_WINDOW = _window
+
+# Render invalidation
+# The display subscribes to the fields its pages show and collects their
+# bits in RENDER_DIRTY, so it only re-renders a page when one of its inputs
+# changed.
+DIRTY_READING = BITS["last_temp"] | BITS["last_hum"]
+if SUMMARY_WINDOW is None:
+    DIRTY_MINMAX = BITS["min_temp"] | BITS["max_temp"] | BITS["min_hum"] | BITS["max_hum"]
+else:
+    DIRTY_MINMAX = BITS["summary_minmax"]
+DIRTY_UPTIME = BITS["uptime_offset_s"]
+DIRTY_PING = BITS["ping_results"]
+RENDER_DIRTY = ALL_BITS
+
+def mark_render_dirty(bits):
+    global RENDER_DIRTY
+    RENDER_DIRTY |= bits
 
-def fmt_mm(v):
-    return "--" if v is None else f"{int(v):02d}"
+STATE.subscribe(DIRTY_READING | DIRTY_MINMAX | DIRTY_UPTIME | DIRTY_PING, mark_render_dirty)
+
+def parse_duration(s):
+    # "90s", "30m", "24h", "7d" -> seconds; a bare number is minutes
+    s = s.strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if s and s[-1] in units:
+        return int(s[:-1]) * units[s[-1]]
+    return int(s) * 60
+
+def fmt_window(seconds):
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    if seconds % 60 == 0:
+        return f"{seconds // 60}m"
+    return f"{seconds}s"
 
 def parse_uptime_str(s):
     """
@@ -153,44 +177,133 @@ def parse_uptime_str(s):
 
     return days * 86400 + h * 3600 + m * 60 + sec
 
+# Help text: (usage, description) rows, printed as a table, or in JSON mode
+# emitted as one "help" line
+HELP_TIME = (
+    ("time H:MM:SS", "(e.g. 5:07:09)"),
+    ("time H:MM", "(seconds = 00)"),
+    ("time Xd HH:MM", "(e.g. 3d 04:17)"),
+    ("time Xd HH:MM:SS", ""),
+)
+HELP_COMMANDS = (
+    ("temp <n>", "Override temperature (C)"),
+    ("hum <n>", "Override humidity (%)"),
+    ("time <str>", "Override uptime"),
+    ("clear", "Clear all overrides"),
+    ("temp clear", "Clear temp override"),
+    ("hum clear", "Clear humidity override"),
+    ("time clear", "Clear uptime override"),
+    ("minmax", "Show min/max since boot and per window"),
+    ("minmax clear", "Reset min/max stats"),
+    ("status", "Print current state"),
+    ("sensor", "Show last data source"),
+    ("history [min]", "Show recorded samples (default 10 min)"),
+    ("avg|min|max <dur>", "Aggregate over the last 30m / 24h / 7d ..."),
+    ("log", "Show telemetry log stats"),
+    ("log flush", "Write buffered log records now"),
+    ("log read [min]", "Show logged records this boot (default 10 min)"),
+    ("snapshot", "Show state snapshot stats"),
+    ("snapshot save", "Save a state snapshot now"),
+    ("perf", "Show task timing and render stats"),
+    ("net", "Show Wi-Fi state and link counters"),
+    ("ping", "Show RTT min/avg/max and loss per ping target"),
+    ("mqtt", "Show MQTT connection, queue and publish counters"),
+    ("format text|json", "Response format (json: one JSON line each)"),
+    ("format json commits", "Also print each committed reading as JSON"),
+    ("stream <dur>|commits|off", "Binary telemetry frames (tools/read_stream.py)"),
+    ("help", "Show this help"),
+    ("help time", "Show uptime formats"),
+)
+HELP_EXAMPLES = (
+    "hum 50 temp 30",
+    "temp 30; hum 50; time 3d 04:17",
+)
+
+def print_help_rows(rows):
+    for usage, text in rows:
+        if not text:
+            print(f"  {usage}")
+        elif len(usage) < 18:
+            print(f"  {usage:<18}{text}")
+        else:
+            print(f"  {usage}  {text}")
+
 def print_help(topic=None):
     if topic == "time":
+        if JSON_MODE:
+            emit_json("help", {"topic": "time", "formats": [usage for usage, text in HELP_TIME]})
+            return
         print("Time formats:")
-        print("  time H:MM:SS      (e.g. 5:07:09)")
-        print("  time H:MM         (seconds = 00)")
-        print("  time Xd HH:MM     (e.g. 3d 04:17)")
-        print("  time Xd HH:MM:SS")
+        print_help_rows(HELP_TIME)
         return
 
+    if JSON_MODE:
+        emit_json("help", {"commands": [{"usage": usage, "text": text} for usage, text in HELP_COMMANDS],
+                           "examples": list(HELP_EXAMPLES)})
+        return
     print("Commands:")
-    print("  temp <n>          Override temperature (C)")
-    print("  hum <n>           Override humidity (%)")
-    print("  time <str>        Override uptime")
-    print("  clear             Clear all overrides")
-    print("  temp clear        Clear temp override")
-    print("  hum clear         Clear humidity override")
-    print("  time clear        Clear uptime override")
-    print("  minmax clear      Reset min/max stats")
-    print("  status            Print current state")
-    print("  sensor            Show last data source")
-    print("  help              Show this help")
-    print("  help time         Show uptime formats")
+    print_help_rows(HELP_COMMANDS)
     print("")
     print("Multi-command:")
-    print("  hum 50 temp 30")
-    print("  temp 30; hum 50; time 3d 04:17")
+    for example in HELP_EXAMPLES:
+        print(f"  {example}")
 
 ##############################################################################################################
 ##############################################################################################################
 
+# Monotonic clock
+# utime.ticks_ms() wraps every 2**30 ms (~12.4 days), so plain subtraction
+# breaks on long-running units. The clock below extends it into a count of
+# milliseconds since boot that never wraps. Every timing path uses it.
+# It must be read at least once per half wrap (~6.2 days); the tasks read it
+# many times a second.
+#
+# Whole seconds and the millisecond remainder are kept apart so the seconds
+# count stays a small int (no heap allocation) for decades of uptime.
+_clock_ticks = utime.ticks_ms()
+_clock_s = 0
+_clock_rem_ms = 0
+
+def _clock_update():
+    global _clock_ticks, _clock_s, _clock_rem_ms
+    now = utime.ticks_ms()
+    delta = utime.ticks_diff(now, _clock_ticks)
+    _clock_ticks = now
+    if delta > 0:
+        rem = _clock_rem_ms + delta
+        _clock_s += rem // 1000
+        _clock_rem_ms = rem % 1000
+
+def monotonic_ms():
+    # Milliseconds since boot
+    _clock_update()
+    return _clock_s * 1000 + _clock_rem_ms
+
+def monotonic_s():
+    # Whole seconds since boot
+    _clock_update()
+    return _clock_s
+
+# Data time: seconds of recorded time, carried across reboots by the state
+# snapshot (downtime is not counted). History, rollups and min/max windows
+# are keyed on it so restored data stays in order with new readings.
+DATA_TIME_BASE_S = 0
+
+def data_s():
+    return monotonic_s() + DATA_TIME_BASE_S
+
 # Uptime
-start_time = utime.ticks_ms()
+UPTIME_DAYS_AFTER_H = 72  # from here on uptime shows "Xd HH:MM" (no seconds)
 
-def get_uptime():
-    elapsed_s = (utime.ticks_ms() - start_time) // 1000
-    total_seconds = elapsed_s + OVERRIDE_UPTIME_OFFSET_S
+def uptime_seconds():
+    # Seconds of uptime as displayed (including the override offset)
+    total_seconds = monotonic_s() + STATE.uptime_offset_s
     if total_seconds < 0:
         total_seconds = 0
+    return total_seconds
+
+def get_uptime():
+    total_seconds = uptime_seconds()
 
     days = total_seconds // 86400
     rem = total_seconds % 86400
@@ -203,33 +316,81 @@ def get_uptime():
 
     total_hours = total_seconds // 3600
 
-    if total_hours >= 72:
+    if total_hours >= UPTIME_DAYS_AFTER_H:
         return f"{days}d {hours:02}:{minutes:02}"
     else:
         return f"{total_hours}:{minutes:02}:{seconds:02}"
 
+def uptime_next_change_ms():
+    # Monotonic time (ms) at which get_uptime() will next return a
+    # different string: the next second, or the next minute once seconds
+    # are no longer shown.
+    now_s = monotonic_s()
+    total_seconds = now_s + STATE.uptime_offset_s
+    if total_seconds < 0:
+        step = 1 - total_seconds  # shows 0:00:00 until the offset is used up
+    elif total_seconds >= UPTIME_DAYS_AFTER_H * 3600:
+        step = 60 - total_seconds % 60
+    else:
+        step = 1
+    return (now_s + step) * 1000
+
 ##############################################################################################################
 ##############################################################################################################
 
-# Ping (kept for debug / future use; not displayed on screen 1 now)
-def ping(ip=config.TARGET):
-    if NET_AVAILABLE:
-        if not wlan.isconnected():
-            return ""
-
-        try:
-            response = uping.ping(ip)
-            if isinstance(response, tuple):
-                ping_time = response[1]
-                print(f"Ping to {ip}: Online, time={ping_time} ms")
-                return f"Online, {ping_time} ms"
-            elif response is not None:
-                print(f"Ping to {ip}: Online, time={response} ms")
-                return f"Online, {response} ms"
-        except Exception as e:
-            print(f"Ping to {ip}: Offline")
-            return ""
-    return ""
+# Ping monitor (see ping_monitor.py)
+# Pings every PING_TARGETS address in the background while the link is up;
+# RTT and loss show on the ping page and through the "ping" command.
+PINGS = PingMonitor(config.PING_TARGETS, config.PING_PERIOD_MS, config.PING_TIMEOUT_MS,
+                    config.PING_HISTORY, config.PING_POLL_MS)
+
+# Metrics endpoint (see metrics_server.py)
+# Serves GET /metrics for Prometheus-style scrapers while the link is up. The
+# exposition is rendered on demand, at most every METRICS_REFRESH_MS.
+def render_metrics(out):
+    out.metric("pulspi_temperature_celsius", "gauge")
+    out.sample("pulspi_temperature_celsius", STATE.last_temp)
+    out.metric("pulspi_humidity_percent", "gauge")
+    out.sample("pulspi_humidity_percent", STATE.last_hum)
+    out.metric("pulspi_temperature_min_celsius", "gauge")
+    out.sample("pulspi_temperature_min_celsius", STATE.min_temp)
+    out.metric("pulspi_temperature_max_celsius", "gauge")
+    out.sample("pulspi_temperature_max_celsius", STATE.max_temp)
+    out.metric("pulspi_humidity_min_percent", "gauge")
+    out.sample("pulspi_humidity_min_percent", STATE.min_hum)
+    out.metric("pulspi_humidity_max_percent", "gauge")
+    out.sample("pulspi_humidity_max_percent", STATE.max_hum)
+    out.metric("pulspi_sensor_source", "gauge")
+    for source in SOURCES:
+        out.sample("pulspi_sensor_source", STATE.sensor_source == source, "source", source)
+    out.metric("pulspi_uptime_seconds", "counter")
+    out.sample("pulspi_uptime_seconds", monotonic_s() + STATE.uptime_offset_s)
+    out.metric("pulspi_task_runs_total", "counter")
+    for name in TASK_STATS:
+        out.sample("pulspi_task_runs_total", TASK_STATS[name][0], "task", name)
+    out.metric("pulspi_task_late_total", "counter")
+    for name in TASK_STATS:
+        out.sample("pulspi_task_late_total", TASK_STATS[name][1], "task", name)
+    out.metric("pulspi_task_errors_total", "counter")
+    for name in TASK_STATS:
+        out.sample("pulspi_task_errors_total", TASK_STATS[name][2], "task", name)
+    out.metric("pulspi_task_worst_run_us", "gauge")
+    for name in TASK_STATS:
+        out.sample("pulspi_task_worst_run_us", TASK_STATS[name][3], "task", name)
+    out.metric("pulspi_renders_total", "counter")
+    out.sample("pulspi_renders_total", RENDER_COUNT)
+    out.metric("pulspi_i2c_writes_total", "counter")
+    out.sample("pulspi_i2c_writes_total", lcd.i2c_writes)
+    out.metric("pulspi_i2c_bytes_total", "counter")
+    out.sample("pulspi_i2c_bytes_total", lcd.i2c_bytes)
+    out.metric("pulspi_cli_commands_total", "counter")
+    out.sample("pulspi_cli_commands_total", CLI_COMMANDS)
+    out.metric("pulspi_metrics_scrapes_total", "counter")
+    out.sample("pulspi_metrics_scrapes_total", METRICS.scrapes)
+
+METRICS = MetricsServer(config.METRICS_PORT, render_metrics, config.METRICS_MAX_CLIENTS,
+                        config.METRICS_BUFFER_BYTES, config.METRICS_REFRESH_MS,
+                        config.METRICS_TIMEOUT_MS, config.METRICS_POLL_MS)
 
 ##############################################################################################################
 ##############################################################################################################
@@ -237,33 +398,96 @@ def ping(ip=config.TARGET):
 # DHT11
 sensor = dht.DHT11(Pin(22))
 
-# Cached sensor values (prevents UI freezing)
-LAST_TEMP = None
-LAST_HUM = None
-LAST_READ_MS = 0
+# The last committed reading is cached in STATE (prevents UI freezing)
 DHT_MIN_INTERVAL_MS = 2000  # DHT11 needs ~2s between valid reads
 
-# Debug: tracks whether last committed reading came from real sensor or overrides
-SENSOR_SOURCE = "unknown"  # "sensor" | "override" | "unknown"
+# History of committed readings, averaged to one sample per interval
+HISTORY = History(config.HISTORY_CAPACITY, config.HISTORY_INTERVAL_S)
+
+# Minute/hour/day rollups of committed readings for avg/min/max queries
+ROLLUPS = Rollups(config.ROLLUP_LEVELS)
+
+# Persistent telemetry log (survives reboots; see telemetry_log.py)
+LOG = TelemetryLog(config.LOG_DIR, config.LOG_PAGE_BYTES, config.LOG_SEGMENT_BYTES, config.LOG_SEGMENTS)
+_log_last = None      # (temp_fixed, hum_fixed, source) last logged
+_log_last_s = 0
+
+def log_reading(now_s, temp, hum, source):
+    # Logs a reading when it changed, or as a heartbeat every LOG_HEARTBEAT_S
+    global _log_last, _log_last_s
+    entry = (to_fixed(temp), to_fixed(hum), source)
+    if entry == _log_last and now_s - _log_last_s < config.LOG_HEARTBEAT_S:
+        return
+    LOG.append(now_s, entry[0], entry[1], source)
+    _log_last = entry
+    _log_last_s = now_s
+
+# State snapshots (see snapshot.py)
+# STATE's persisted fields are saved to flash every SNAPSHOT_PERIOD_S, with
+# the data time, so they change every period and a reboot always continues
+# the data clock from a recent save. The data stores are large and change on
+# every commit, so they are saved only every SNAPSHOT_DATA_PERIOD_S (and on
+# "snapshot save"). Both are restored here at boot, before the first reading
+# or render.
+def snapshot_globals():
+    values = STATE.values()
+    values["data_s"] = data_s()
+    return values
+
+SNAPSHOTS = SnapshotStore(config.SNAPSHOT_FILES, [], snapshot_globals, STATE.restore)
+DATA_SNAPSHOTS = SnapshotStore(
+    config.SNAPSHOT_DATA_FILES,
+    [("history", HISTORY), ("rollups", ROLLUPS)] + [(f"minmax_{w.window_s}", w) for w in MINMAX_WINDOWS],
+    None,
+    None,
+)
+
+def restore_snapshot(store):
+    # Returns the restored copy's data time, or None
+    try:
+        restored_s = store.restore()
+    except Exception as e:
+        # A snapshot that cannot be loaded must not stop the boot
+        print(f"[SNAP] Restore failed: {repr(e)}")
+        return None
+    if restored_s is not None:
+        print(f"[SNAP] Restored {store.restored[0]} (seq {store.restored[1]})")
+    return restored_s
+
+_restored_s = None
+for _restored in (restore_snapshot(DATA_SNAPSHOTS), restore_snapshot(SNAPSHOTS)):
+    if _restored is not None and (_restored_s is None or _restored > _restored_s):
+        _restored_s = _restored
+if _restored_s is not None:
+    DATA_TIME_BASE_S = _restored_s + 1
+    if SUMMARY_WINDOW is not None:
+        STATE.set("summary_minmax", SUMMARY_WINDOW.snapshot())
+
+def fmt_fixed(v):
+    return "--" if v is None or v == MISSING else f"{v / SCALE:.1f}"
 
 def commit_reading(temp, hum, now_ms, source):
-    global LAST_TEMP, LAST_HUM, LAST_READ_MS, SENSOR_SOURCE
-    LAST_TEMP = temp
-    LAST_HUM = hum
-    LAST_READ_MS = now_ms
-    SENSOR_SOURCE = source
+    STATE.set("last_temp", temp)
+    STATE.set("last_hum", hum)
+    STATE.set("last_read_ms", now_ms)
+    STATE.set("sensor_source", source)
+    now_s = now_ms // 1000 + DATA_TIME_BASE_S
     update_min_max(temp, hum)
+    for window in MINMAX_WINDOWS:
+        if window.add(now_s, temp, hum) and window is SUMMARY_WINDOW:
+            STATE.set("summary_minmax", window.snapshot())
+    HISTORY.add(now_s, temp, hum)
+    ROLLUPS.add(now_s, temp, hum)
+    log_reading(now_ms // 1000, temp, hum, source)
+    STATE.publish()
 
 def get_temp_and_humidity():
-    global OVERRIDE_TEMP, OVERRIDE_HUM
-    global LAST_TEMP, LAST_HUM, LAST_READ_MS
-
-    now = utime.ticks_ms()
+    now = monotonic_ms()
 
     # Overrides behave exactly like real sensor updates
-    if OVERRIDE_TEMP is not None or OVERRIDE_HUM is not None:
-        temp = OVERRIDE_TEMP if OVERRIDE_TEMP is not None else LAST_TEMP
-        hum  = OVERRIDE_HUM  if OVERRIDE_HUM  is not None else LAST_HUM
+    if STATE.override_temp is not None or STATE.override_hum is not None:
+        temp = STATE.override_temp if STATE.override_temp is not None else STATE.last_temp
+        hum  = STATE.override_hum  if STATE.override_hum  is not None else STATE.last_hum
 
         # Keep display from showing None if one side was never read yet
         if temp is None:
@@ -275,9 +499,9 @@ def get_temp_and_humidity():
         return temp, hum
 
     # Too soon to poll DHT again; return cached values immediately (no blocking)
-    if (LAST_TEMP is not None and LAST_HUM is not None and
-        utime.ticks_diff(now, LAST_READ_MS) < DHT_MIN_INTERVAL_MS):
-        return LAST_TEMP, LAST_HUM
+    if (STATE.last_temp is not None and STATE.last_hum is not None and
+        now - STATE.last_read_ms < DHT_MIN_INTERVAL_MS):
+        return STATE.last_temp, STATE.last_hum
 
     try:
         sensor.measure()  # fast; no sleep
@@ -286,189 +510,970 @@ def get_temp_and_humidity():
 
         commit_reading(temp, hum, now, "sensor")
 
-        temp_f = temp * (9/5) + 32.0
-        print('Temperature: %3.1f C' % temp)
-        print('Temperature: %3.1f F' % temp_f)
-        print('Humidity: %3.1f %%' % hum)
+        if not JSON_MODE and not stream_active():
+            temp_f = temp * (9/5) + 32.0
+            print('Temperature: %3.1f C' % temp)
+            print('Temperature: %3.1f F' % temp_f)
+            print('Humidity: %3.1f %%' % hum)
         return temp, hum
     except OSError:
-        return LAST_TEMP, LAST_HUM  # fallback to last-known-good if available
+        return STATE.last_temp, STATE.last_hum  # fallback to last-known-good if available
 
 ##############################################################################################################
 ##############################################################################################################
 
-def poll_command():
-    global OVERRIDE_TEMP, OVERRIDE_HUM, OVERRIDE_UPTIME_OFFSET_S
-    global MIN_TEMP, MAX_TEMP, MIN_HUM, MAX_HUM
-    global SENSOR_SOURCE, LAST_TEMP, LAST_HUM
+# Response format ("format text|json")
+# In JSON mode every CLI response is one compact line,
+# {"v": JSON_SCHEMA, "type": ..., ...}, so host scripts parse it with a
+# single json.loads() per line. Temperatures are in C and humidity in %
+# (null when unknown). With JSON_COMMITS each committed reading is printed
+# as a "reading" line as well. Lines that do not start with "{" (boot,
+# [TASK], [NET], [SNAP] messages) are for humans and can be skipped.
+JSON_SCHEMA = 1
+JSON_MODE = False
+JSON_COMMITS = False
+
+def emit_json(kind, fields):
+    out = {"v": JSON_SCHEMA, "type": kind}
+    out.update(fields)
+    print(json.dumps(out, separators=(",", ":")))
+
+def say(text, kind="msg"):
+    # A response without structured fields (acknowledgements, errors)
+    if JSON_MODE:
+        emit_json(kind, {"text": text})
+    else:
+        print(f"[CMD] {text}")
+
+def json_fixed(v):
+    return None if v is None or v == MISSING else v / SCALE
+
+def json_range(lo, hi):
+    return [json_fixed(lo), json_fixed(hi)]
+
+def emit_reading(bits):
+    # STATE subscriber: last_read_ms changes on every commit
+    if JSON_COMMITS:
+        emit_json("reading", {"t": data_s(), "temp": STATE.last_temp, "hum": STATE.last_hum,
+                              "source": STATE.sensor_source, "boot": LOG.boot})
+
+STATE.subscribe(BITS["last_read_ms"], emit_reading)
+
+# Binary telemetry stream ("stream <period>|commits|off")
+# Sends the committed reading as a fixed 22-byte CRC-checked frame (see
+# telemetry_stream.py) every STREAM_PERIOD_S, or on every commit, instead of
+# text lines. Frames share the serial port with text; the host reader
+# (tools/read_stream.py) resyncs on the frame marker and CRC.
+STREAM_OUT = getattr(sys.stdout, "buffer", sys.stdout)
+STREAM_FRAME = bytearray(FRAME_SIZE)
+STREAM_PERIOD_S = config.STREAM_PERIOD_S  # 0 = no periodic frames
+STREAM_COMMITS = False
+STREAM_SEQ = 0
+_stream_next_ms = 0
+
+def stream_active():
+    return STREAM_COMMITS or STREAM_PERIOD_S > 0
+
+def send_frame():
+    global STREAM_SEQ
+    pack_frame(STREAM_FRAME, LOG.boot, STREAM_SEQ, data_s(), to_fixed(STATE.last_temp),
+               to_fixed(STATE.last_hum), source_code(STATE.sensor_source))
+    STREAM_SEQ = (STREAM_SEQ + 1) & 0xffffffff
+    STREAM_OUT.write(STREAM_FRAME)
+
+def stream_commit(bits):
+    # STATE subscriber, like emit_reading
+    if STREAM_COMMITS:
+        send_frame()
+
+STATE.subscribe(BITS["last_read_ms"], stream_commit)
+
+# MQTT publisher (see mqtt_publisher.py)
+# Queues every commit and publishes them in batches from the mqtt task; the
+# queue rides out Wi-Fi and broker outages.
+MQTT = None
+if NET_AVAILABLE and config.MQTT_BROKER:
+    MQTT = MqttPublisher(config.MQTT_BROKER, config.MQTT_PORT, config.MQTT_CLIENT_ID, config.MQTT_TOPIC,
+                         config.MQTT_USER, config.MQTT_PASSWORD, config.MQTT_KEEPALIVE_S,
+                         config.MQTT_BATCH, config.MQTT_BATCH_MS, config.MQTT_QUEUE_RECORDS,
+                         config.MQTT_DRAIN_MS, config.MQTT_CONNECT_TIMEOUT_MS,
+                         config.MQTT_BACKOFF_MIN_MS, config.MQTT_BACKOFF_MAX_MS,
+                         config.MQTT_POLL_MS, LOG.boot)
+
+def mqtt_commit(bits):
+    # STATE subscriber, like stream_commit
+    MQTT.add(data_s(), to_fixed(STATE.last_temp), to_fixed(STATE.last_hum), source_code(STATE.sensor_source))
+
+if MQTT is not None:
+    STATE.subscribe(BITS["last_read_ms"], mqtt_commit)
+
+# Command handlers
+# Each takes the parsed arguments its COMMANDS entry declares.
+def cmd_help(topic):
+    print_help(topic)
+
+def cmd_format(mode, commits):
+    global JSON_MODE, JSON_COMMITS
+    JSON_MODE = mode == "json"
+    JSON_COMMITS = JSON_MODE and commits == "commits"
+    say(f"Format {mode}{' with commits' if JSON_COMMITS else ''}")
+
+def cmd_stream(mode):
+    # "stream" shows the settings; "stream 5s", "stream commits", "stream off"
+    global STREAM_PERIOD_S, STREAM_COMMITS, _stream_next_ms
+    if mode == "off":
+        STREAM_PERIOD_S = 0
+        STREAM_COMMITS = False
+    elif mode == "commits":
+        STREAM_PERIOD_S = 0
+        STREAM_COMMITS = True
+    elif mode is not None:
+        STREAM_PERIOD_S = parse_duration(mode)
+        STREAM_COMMITS = False
+        _stream_next_ms = monotonic_ms()
+    if STREAM_COMMITS:
+        say(f"stream: every commit, {STREAM_SEQ} frames sent")
+    elif STREAM_PERIOD_S:
+        say(f"stream: every {STREAM_PERIOD_S}s, {STREAM_SEQ} frames sent")
+    else:
+        say(f"stream: off, {STREAM_SEQ} frames sent")
 
-    if not SELECT_AVAILABLE:
+def cmd_net():
+    if not NET_AVAILABLE:
+        say("net: not available")
         return
+    ip = wlan.ifconfig()[0] if WIFI.state == UP else None
+    up_s = (monotonic_ms() - WIFI.up_since_ms) // 1000 if WIFI.up_since_ms is not None else None
+    if JSON_MODE:
+        emit_json("net", {"state": WIFI.state_name(), "ip": ip, "up_s": up_s, "rssi": WIFI.rssi,
+                          "rssi_min": WIFI.rssi_min, "rssi_max": WIFI.rssi_max, "attempts": WIFI.attempts,
+                          "connects": WIFI.connects, "failures": WIFI.failures, "drops": WIFI.drops,
+                          "backoff_ms": WIFI.backoff_ms, "last_status": WIFI.last_status,
+                          "metrics": {"port": config.METRICS_PORT, "clients": METRICS.clients(),
+                                      "scrapes": METRICS.scrapes, "requests": METRICS.requests,
+                                      "renders": METRICS.renders, "bytes": METRICS.body.size(),
+                                      "overflows": METRICS.body.overflows, "timeouts": METRICS.timeouts,
+                                      "errors": METRICS.errors}})
+        return
+    up = f"{up_s}s" if up_s is not None else "-"
+    print(f"[CMD] net: {WIFI.state_name()} ip={ip} up={up} rssi={WIFI.rssi} ({WIFI.rssi_min}..{WIFI.rssi_max}) "
+          f"attempts={WIFI.attempts} connects={WIFI.connects} failures={WIFI.failures} drops={WIFI.drops} "
+          f"backoff={WIFI.backoff_ms}ms")
+    if config.METRICS_PORT:
+        print(f"[CMD] metrics: port={config.METRICS_PORT} clients={METRICS.clients()} scrapes={METRICS.scrapes} "
+              f"requests={METRICS.requests} renders={METRICS.renders} bytes={METRICS.body.size()} "
+              f"overflows={METRICS.body.overflows} timeouts={METRICS.timeouts} errors={METRICS.errors}")
+
+def cmd_mqtt():
+    if MQTT is None:
+        say("mqtt: not configured")
+        return
+    if JSON_MODE:
+        emit_json("mqtt", {"state": MQTT.state_name(), "broker": f"{MQTT.broker}:{MQTT.port}",
+                           "topic": MQTT.topic, "queued": len(MQTT.queue), "capacity": MQTT.queue.capacity,
+                           "published": MQTT.published, "packets": MQTT.packets, "bytes": MQTT.bytes_sent,
+                           "dropped": MQTT.queue.dropped, "attempts": MQTT.attempts,
+                           "connects": MQTT.connects, "failures": MQTT.failures, "drops": MQTT.drops,
+                           "backoff_ms": MQTT.backoff_ms, "last_status": MQTT.last_status})
+        return
+    print(f"[CMD] mqtt: {MQTT.state_name()} {MQTT.broker}:{MQTT.port} topic={MQTT.topic} "
+          f"queued={len(MQTT.queue)}/{MQTT.queue.capacity} published={MQTT.published} "
+          f"packets={MQTT.packets} bytes={MQTT.bytes_sent} dropped={MQTT.queue.dropped}")
+    print(f"[CMD] mqtt: attempts={MQTT.attempts} connects={MQTT.connects} failures={MQTT.failures} "
+          f"drops={MQTT.drops} backoff={MQTT.backoff_ms}ms last_status={MQTT.last_status}")
+
+def cmd_ping():
+    if not NET_AVAILABLE:
+        say("ping: not available")
+        return
+    targets = []
+    for t in range(len(PINGS)):
+        lo, avg, hi, loss, samples = PINGS.stats(t)
+        if JSON_MODE:
+            targets.append({"label": PINGS.labels[t], "address": PINGS.addresses[t], "min_ms": lo, "avg_ms": avg,
+                            "max_ms": hi, "loss_pct": loss, "samples": samples,
+                            "sent": PINGS.sent[t], "received": PINGS.received[t]})
+        else:
+            rtt = f"{lo}/{avg}/{hi}ms" if avg is not None else "-"
+            loss = f"{loss}%" if loss is not None else "-"
+            print(f"[CMD] ping {PINGS.labels[t]} {PINGS.addresses[t]}: min/avg/max={rtt} loss={loss} "
+                  f"({samples} samples) sent={PINGS.sent[t]} received={PINGS.received[t]}")
+    if JSON_MODE:
+        emit_json("ping", {"targets": targets, "late": PINGS.late, "errors": PINGS.errors})
+    else:
+        print(f"[CMD] ping: late={PINGS.late} errors={PINGS.errors}")
 
-    if sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
-        line = sys.stdin.readline().strip()
-        if not line:
-            return
+def cmd_override(name, label, value):
+    # "temp 30" / "temp clear" (value None)
+    STATE.set(name, value)
+    if value is None:
+        say(f"{label} override cleared")
+    else:
+        say(f"Override {label.lower()} = {value}")
 
-        def handle_cmd(cmd):
-            global OVERRIDE_TEMP, OVERRIDE_HUM, OVERRIDE_UPTIME_OFFSET_S
-            global MIN_TEMP, MAX_TEMP, MIN_HUM, MAX_HUM
-            global SENSOR_SOURCE, LAST_TEMP, LAST_HUM
-
-            # ---- Help ----
-            if cmd == "help":
-                print_help()
-                return
-            if cmd.startswith("help "):
-                parts = cmd.split()
-                if len(parts) >= 2:
-                    print_help(parts[1])
-                else:
-                    print_help()
-                return
-
-            # ---- Set overrides ----
-            if cmd.startswith("temp "):
-                OVERRIDE_TEMP = float(cmd.split()[1])
-                print(f"[CMD] Override temp = {OVERRIDE_TEMP}")
-                return
-
-            if cmd.startswith("hum "):
-                OVERRIDE_HUM = float(cmd.split()[1])
-                print(f"[CMD] Override humidity = {OVERRIDE_HUM}")
-                return
-
-            if cmd.startswith("time "):
-                desired_str = cmd[5:].strip()
-                try:
-                    desired_seconds = parse_uptime_str(desired_str)
-                    actual_elapsed_s = (utime.ticks_ms() - start_time) // 1000
-                    OVERRIDE_UPTIME_OFFSET_S = int(desired_seconds - actual_elapsed_s)
-                    print(f"[CMD] Uptime set to '{desired_str}' (offset={OVERRIDE_UPTIME_OFFSET_S}s)")
-                except Exception as e:
-                    print(f"[CMD] Bad time format: '{desired_str}' ({e})")
-                return
-
-            # ---- Clear overrides ----
-            if cmd == "clear":
-                OVERRIDE_TEMP = None
-                OVERRIDE_HUM = None
-                OVERRIDE_UPTIME_OFFSET_S = 0
-                print("[CMD] All overrides cleared")
-                return
-
-            if cmd in ("temp clear", "clear temp"):
-                OVERRIDE_TEMP = None
-                print("[CMD] Temp override cleared")
-                return
-
-            if cmd in ("hum clear", "clear hum"):
-                OVERRIDE_HUM = None
-                print("[CMD] Humidity override cleared")
-                return
-
-            if cmd in ("time clear", "clear time"):
-                OVERRIDE_UPTIME_OFFSET_S = 0
-                print("[CMD] Uptime override cleared")
-                return
-
-            # ---- Min/Max reset ----
-            if cmd in ("minmax clear", "clear minmax"):
-                MIN_TEMP = MAX_TEMP = MIN_HUM = MAX_HUM = None
-                print("[CMD] Min/Max reset")
-                return
-
-            # ---- Sensor source debug ----
-            if cmd == "sensor":
-                print(f"[CMD] sensor_source={SENSOR_SOURCE} last_temp={LAST_TEMP} last_hum={LAST_HUM}")
-                return
-
-            # ---- Status ----
-            if cmd == "status":
-                print(f"[CMD] temp={OVERRIDE_TEMP} hum={OVERRIDE_HUM} time_offset={OVERRIDE_UPTIME_OFFSET_S}s "
-                      f"minmax=T({MIN_TEMP},{MAX_TEMP}) H({MIN_HUM},{MAX_HUM}) sensor_source={SENSOR_SOURCE}")
-                return
-
-            print(f"[CMD] Unknown: {cmd}")
-
-        # 1) Semicolon-delimited commands: "temp 43; hum 69; time 3d 04:17"
-        if ";" in line:
-            parts = [p.strip() for p in line.split(";") if p.strip()]
-            for p in parts:
-                handle_cmd(p)
+def cmd_time(desired_str):
+    if desired_str is None:
+        STATE.set("uptime_offset_s", 0)
+        say("Uptime override cleared")
+        return
+    try:
+        desired_seconds = parse_uptime_str(desired_str)
+        actual_elapsed_s = monotonic_s()
+        STATE.set("uptime_offset_s", int(desired_seconds - actual_elapsed_s))
+        say(f"Uptime set to '{desired_str}' (offset={STATE.uptime_offset_s}s)")
+    except Exception as e:
+        say(f"Bad time format: '{desired_str}' ({e})", "error")
+
+def cmd_clear(what):
+    # "clear" clears every override; "clear temp" etc. one of them
+    if what == "temp":
+        cmd_override("override_temp", "Temp", None)
+    elif what == "hum":
+        cmd_override("override_hum", "Humidity", None)
+    elif what == "time":
+        cmd_time(None)
+    elif what == "minmax":
+        cmd_minmax("clear")
+    else:
+        STATE.set("override_temp", None)
+        STATE.set("override_hum", None)
+        STATE.set("uptime_offset_s", 0)
+        say("All overrides cleared")
+
+def cmd_minmax(action):
+    if action == "clear":
+        for name in ("min_temp", "max_temp", "min_hum", "max_hum"):
+            STATE.set(name, None)
+        for window in MINMAX_WINDOWS:
+            window.clear()
+        STATE.set("summary_minmax", (None, None, None, None))
+        say("Min/Max reset")
+        return
+    now_s = data_s()
+    if JSON_MODE:
+        windows = {"boot": {"temp": [STATE.min_temp, STATE.max_temp], "hum": [STATE.min_hum, STATE.max_hum]}}
+        for window in MINMAX_WINDOWS:
+            windows[fmt_window(window.window_s)] = {"temp": json_range(*window.temp_range(now_s)),
+                                                    "hum": json_range(*window.hum_range(now_s))}
+        emit_json("minmax", windows)
+        return
+    print(f"[CMD] minmax boot: T {STATE.min_temp}/{STATE.max_temp} H {STATE.min_hum}/{STATE.max_hum}")
+    for window in MINMAX_WINDOWS:
+        t_min, t_max = window.temp_range(now_s)
+        h_min, h_max = window.hum_range(now_s)
+        print(f"[CMD] minmax {fmt_window(window.window_s)}: "
+              f"T {fmt_fixed(t_min)}/{fmt_fixed(t_max)} H {fmt_fixed(h_min)}/{fmt_fixed(h_max)}")
+
+def cmd_sensor():
+    if JSON_MODE:
+        emit_json("sensor", {"source": STATE.sensor_source, "temp": STATE.last_temp, "hum": STATE.last_hum,
+                             "age_ms": monotonic_ms() - STATE.last_read_ms})
+        return
+    print(f"[CMD] sensor_source={STATE.sensor_source} last_temp={STATE.last_temp} last_hum={STATE.last_hum}")
+
+def cmd_history(minutes):
+    if minutes is None:
+        minutes = 10
+    now_s = data_s()
+    if JSON_MODE:
+        samples = [[t_s - now_s, json_fixed(temp), json_fixed(hum)]
+                   for t_s, temp, hum in HISTORY.window(minutes * 60, now_s)]
+        emit_json("history", {"interval_s": HISTORY.interval_s, "samples": samples})
+        return
+    print(f"[CMD] history: {len(HISTORY)}/{HISTORY.capacity} samples, one per {HISTORY.interval_s}s")
+    for t_s, temp, hum in HISTORY.window(minutes * 60, now_s):
+        print(f"[CMD]   -{now_s - t_s}s T={fmt_fixed(temp)} H={fmt_fixed(hum)}")
+
+def cmd_rollup(kind, span):
+    # "avg 24h" / "min 30m" / "max 7d"
+    seconds = parse_duration(span)
+    t_min, t_max, t_sum, t_n, h_min, h_max, h_sum, h_n = ROLLUPS.query(seconds, data_s())
+    if kind == "avg":
+        temp = t_sum // t_n if t_n else None
+        hum = h_sum // h_n if h_n else None
+    else:
+        temp = t_min if kind == "min" else t_max
+        hum = h_min if kind == "min" else h_max
+    bucket_s = ROLLUPS.level_for(seconds).period_s
+    if JSON_MODE:
+        emit_json(kind, {"span_s": seconds, "temp": json_fixed(temp), "hum": json_fixed(hum),
+                         "readings": t_n, "bucket_s": bucket_s})
+        return
+    print(f"[CMD] {kind} {span}: T={fmt_fixed(temp)} H={fmt_fixed(hum)} "
+          f"({t_n} readings, {bucket_s}s buckets)")
+
+def cmd_perf():
+    if JSON_MODE:
+        tasks = {}
+        for name in TASK_STATS:
+            runs, late, errors, worst_us = TASK_STATS[name]
+            tasks[name] = {"runs": runs, "late": late, "errors": errors, "worst_us": worst_us}
+        emit_json("perf", {"tasks": tasks, "renders": RENDER_COUNT,
+                           "alloc_last": RENDER_ALLOC_LAST if MEM_ALLOC_AVAILABLE else None,
+                           "alloc_max": RENDER_ALLOC_MAX if MEM_ALLOC_AVAILABLE else None,
+                           "cli": {"lines": CLI_LINES, "commands": CLI_COMMANDS,
+                                   "queued": len(_cli_parts), "dropped": CLI_DROPPED},
+                           "i2c": {"writes": lcd.i2c_writes, "bytes": lcd.i2c_bytes}})
+        return
+    for name in TASK_STATS:
+        runs, late, errors, worst_us = TASK_STATS[name]
+        print(f"[CMD] task {name}: runs={runs} late={late} errors={errors} worst={worst_us}us")
+    alloc = f"{RENDER_ALLOC_LAST}/{RENDER_ALLOC_MAX}B" if MEM_ALLOC_AVAILABLE else "n/a"
+    print(f"[CMD] renders={RENDER_COUNT} alloc_per_frame(last/max)={alloc}")
+    print(f"[CMD] cli: lines={CLI_LINES} commands={CLI_COMMANDS} queued={len(_cli_parts)} dropped={CLI_DROPPED}")
+    print(f"[CMD] i2c: writes={lcd.i2c_writes} bytes={lcd.i2c_bytes}")
+
+def cmd_log(action, minutes):
+    if action == "flush":
+        say(f"log: flushed {LOG.flush()} bytes")
+        return
+    if action == "read":
+        if minutes is None:
+            minutes = 10
+        since_s = max(0, monotonic_s() - minutes * 60)
+        if JSON_MODE:
+            records = [[t_s, json_fixed(temp), json_fixed(hum), SOURCES[source]]
+                       for boot, t_s, temp, hum, source in LOG.records(LOG.boot, since_s)]
+            emit_json("log_read", {"boot": LOG.boot, "records": records})
             return
+        for boot, t_s, temp, hum, source in LOG.records(LOG.boot, since_s):
+            print(f"[CMD]   {t_s}s T={fmt_fixed(temp)} H={fmt_fixed(hum)} {SOURCES[source]}")
+        return
+    segments = LOG.segments()
+    if JSON_MODE:
+        emit_json("log", {"boot": LOG.boot, "segments": len(segments), "max_segments": LOG.max_segments,
+                          "records": LOG.records_logged, "buffered": LOG.buffered(),
+                          "page_bytes": LOG.page_bytes, "flushes": LOG.flushes,
+                          "flushed_bytes": LOG.flushed_bytes, "errors": LOG.errors})
+        return
+    print(f"[CMD] log: boot={LOG.boot} segments={len(segments)}/{LOG.max_segments} "
+          f"records={LOG.records_logged} buffered={LOG.buffered()}/{LOG.page_bytes}B "
+          f"flushes={LOG.flushes} flushed={LOG.flushed_bytes}B errors={LOG.errors}")
+
+def cmd_snapshot(action):
+    stores = (("state", SNAPSHOTS), ("data", DATA_SNAPSHOTS))
+    if action == "save":
+        now_s = data_s()
+        results = []
+        for name, store in stores:
+            saved = store.save(now_s)
+            results.append(f"{name} {'saved seq ' + str(store.seq) if saved else 'unchanged'}")
+        say("snapshot: " + ", ".join(results))
+        return
+    if JSON_MODE:
+        fields = {}
+        for name, store in stores:
+            restored = store.restored
+            fields[name] = {"seq": store.seq, "saves": store.saves, "unchanged": store.unchanged,
+                            "errors": store.errors, "restored": list(restored) if restored else None}
+        emit_json("snapshot", fields)
+        return
+    for name, store in stores:
+        print(f"[CMD] snapshot {name}: seq={store.seq} saves={store.saves} "
+              f"unchanged={store.unchanged} errors={store.errors} restored={store.restored}")
+
+def cmd_status():
+    if JSON_MODE:
+        emit_json("status", {"temp": STATE.last_temp, "hum": STATE.last_hum, "source": STATE.sensor_source,
+                             "override_temp": STATE.override_temp, "override_hum": STATE.override_hum,
+                             "time_offset_s": STATE.uptime_offset_s, "uptime_s": uptime_seconds(),
+                             "min_temp": STATE.min_temp, "max_temp": STATE.max_temp,
+                             "min_hum": STATE.min_hum, "max_hum": STATE.max_hum})
+        return
+    print(f"[CMD] temp={STATE.override_temp} hum={STATE.override_hum} time_offset={STATE.uptime_offset_s}s "
+          f"minmax=T({STATE.min_temp},{STATE.max_temp}) H({STATE.min_hum},{STATE.max_hum}) "
+          f"sensor_source={STATE.sensor_source}")
+
+# Argument parsers: parse(tokens, i) -> (value, next i).
+# Required arguments raise IndexError when missing and ValueError when
+# malformed; optional ones return (None, i) and consume nothing when the next
+# token is not theirs, so it is read as the next command.
+def arg_duration(tokens, i):
+    # "30m", "24h", "7d"; checked here, passed on as typed (for labels)
+    if parse_duration(tokens[i]) <= 0:
+        raise ValueError(tokens[i])
+    return tokens[i], i + 1
+
+def arg_override(tokens, i):
+    # A finite number, or "clear" (None)
+    if tokens[i].lower() == "clear":
+        return None, i + 1
+    value = float(tokens[i])
+    if not is_finite(value):
+        raise ValueError(tokens[i])
+    return value, i + 1
+
+def arg_uptime(tokens, i):
+    # "5:07:09", "3d 04:17" (two tokens), or "clear" (None)
+    value = tokens[i]
+    i += 1
+    if value.lower() == "clear":
+        return None, i
+    if value[-1] in "dD" and i < len(tokens) and ":" in tokens[i]:
+        value += " " + tokens[i]
+        i += 1
+    return value, i
+
+def arg_choice(*choices):
+    def parse(tokens, i):
+        if tokens[i].lower() not in choices:
+            raise ValueError(tokens[i])
+        return tokens[i].lower(), i + 1
+    return parse
+
+def opt_int(tokens, i):
+    if i < len(tokens) and tokens[i].isdigit():
+        return int(tokens[i]), i + 1
+    return None, i
+
+def opt_choice(*choices):
+    def parse(tokens, i):
+        if i < len(tokens) and tokens[i].lower() in choices:
+            return tokens[i].lower(), i + 1
+        return None, i
+    return parse
+
+def opt_stream(tokens, i):
+    # "off", "commits" or a period ("5s", "1m")
+    if i < len(tokens):
+        word = tokens[i].lower()
+        if word in ("off", "commits"):
+            return word, i + 1
+        try:
+            seconds = parse_duration(word)
+        except ValueError:
+            return None, i
+        if seconds <= 0:
+            raise ValueError(word)
+        return word, i + 1
+    return None, i
+
+def opt_topic(tokens, i):
+    # Any command name ("help time")
+    if i < len(tokens) and tokens[i].lower() in COMMANDS:
+        return tokens[i].lower(), i + 1
+    return None, i
+
+# Command table: keyword -> (handler, argument parsers). The parsers are the
+# command's arity; dispatch is one dict lookup per command.
+COMMANDS = {
+    "help": (cmd_help, (opt_topic,)),
+    "format": (cmd_format, (arg_choice("text", "json"), opt_choice("commits"))),
+    "stream": (cmd_stream, (opt_stream,)),
+    "temp": (lambda value: cmd_override("override_temp", "Temp", value), (arg_override,)),
+    "hum": (lambda value: cmd_override("override_hum", "Humidity", value), (arg_override,)),
+    "time": (cmd_time, (arg_uptime,)),
+    "clear": (cmd_clear, (opt_choice("temp", "hum", "time", "minmax"),)),
+    "minmax": (cmd_minmax, (opt_choice("clear"),)),
+    "sensor": (cmd_sensor, ()),
+    "history": (cmd_history, (opt_int,)),
+    "avg": (lambda span: cmd_rollup("avg", span), (arg_duration,)),
+    "min": (lambda span: cmd_rollup("min", span), (arg_duration,)),
+    "max": (lambda span: cmd_rollup("max", span), (arg_duration,)),
+    "perf": (cmd_perf, ()),
+    "log": (cmd_log, (opt_choice("flush", "read"), opt_int)),
+    "snapshot": (cmd_snapshot, (opt_choice("save"),)),
+    "status": (cmd_status, ()),
+    "net": (cmd_net, ()),
+    "ping": (cmd_ping, ()),
+    "mqtt": (cmd_mqtt, ()),
+}
+
+def run_command(tokens, i):
+    # Runs the command starting at tokens[i], taking the arguments its
+    # COMMANDS entry declares. Returns where the next command starts (the
+    # end of tokens after an error).
+    word = tokens[i].lower()
+    entry = COMMANDS.get(word)
+    if entry is None:
+        say(f"Unknown: {' '.join(tokens[i:])}", "error")
+        return len(tokens)
+    handler, parsers = entry
+    args = []
+    i += 1
+    try:
+        for parse in parsers:
+            value, i = parse(tokens, i)
+            args.append(value)
+    except IndexError:
+        say(f"{word}: missing argument (see 'help')", "error")
+        return len(tokens)
+    except ValueError:
+        say(f"{word}: bad argument {repr(tokens[i])}", "error")
+        return len(tokens)
+    handler(*args)
+    return i
+
+# Serial input
+# Bytes are read one at a time while the poller reports more, so a
+# half-typed or slowly streamed line never blocks the loop; a line runs
+# once its newline arrives. Its commands are queued (one token list per ";"
+# part, split once) and run at most CLI_COMMANDS_PER_TICK per tick. No input
+# is read while commands are queued, so a burst waits in the USB buffer
+# rather than in RAM.
+if SELECT_AVAILABLE:
+    STDIN_POLL = select.poll()
+    STDIN_POLL.register(sys.stdin, select.POLLIN)
+CLI_LINE = bytearray(config.CLI_LINE_BYTES)
+_cli_len = 0
+_cli_overflow = False  # dropping the rest of a line that did not fit
+_cli_parts = []        # token lists still to run, oldest first
+_cli_pos = 0           # next token in _cli_parts[0]
+CLI_LINES = 0
+CLI_COMMANDS = 0
+CLI_DROPPED = 0        # lines longer than CLI_LINE_BYTES
+
+def queue_line(line):
+    for part in line.split(";"):
+        tokens = part.split()
+        if tokens:
+            _cli_parts.append(tokens)
+
+def run_queued(budget):
+    # Runs up to budget queued commands; returns how many ran
+    global _cli_pos, CLI_COMMANDS
+    ran = 0
+    while _cli_parts and ran < budget:
+        tokens = _cli_parts[0]
+        ran += 1
+        CLI_COMMANDS += 1
+        try:
+            _cli_pos = run_command(tokens, _cli_pos)
+        except Exception:
+            # Don't re-run a failing command on every tick: drop the rest
+            # of its part and let the task log the error
+            _cli_pos = len(tokens)
+            raise
+        finally:
+            if _cli_pos >= len(tokens):
+                _cli_parts.pop(0)
+                _cli_pos = 0
+    return ran
+
+def read_input(limit):
+    # Reads available bytes (at most limit) into CLI_LINE, stopping after a
+    # complete line, which is queued. Returns bytes read.
+    global _cli_len, _cli_overflow, CLI_LINES, CLI_DROPPED
+    n = 0
+    while n < limit and STDIN_POLL.poll(0):
+        ch = sys.stdin.read(1)
+        if not ch:
+            break
+        n += 1
+        byte = ord(ch)
+        if byte == 10 or byte == 13:
+            if _cli_overflow:
+                CLI_DROPPED += 1
+                say(f"Line too long (max {len(CLI_LINE)} bytes), ignored", "error")
+            elif _cli_len:
+                CLI_LINES += 1
+                queue_line(bytes(memoryview(CLI_LINE)[:_cli_len]).decode())
+            _cli_len = 0
+            _cli_overflow = False
+            if _cli_parts:
+                break
+        elif byte < 128:
+            if _cli_len < len(CLI_LINE):
+                CLI_LINE[_cli_len] = byte
+                _cli_len += 1
+            else:
+                _cli_overflow = True
+    return n
 
-        # 2) Token-walk mode: "hum 69 temp 43 time 30"
-        tokens = line.split()
-        i = 0
-        while i < len(tokens):
-            t = tokens[i].lower()
-
-            # single-word commands
-            if t in ("clear", "status", "sensor", "help"):
-                handle_cmd(t)
-                i += 1
-                continue
-
-            # "help time"
-            if t == "help" and i + 1 < len(tokens):
-                handle_cmd(f"help {tokens[i+1]}")
-                i += 2
-                continue
-
-            # two-word clear commands (temp clear / clear temp etc.)
-            if i + 1 < len(tokens) and tokens[i+1].lower() == "clear" and t in ("temp", "hum", "time", "minmax"):
-                handle_cmd(f"{t} clear")
-                i += 2
-                continue
-            if i + 1 < len(tokens) and t == "clear" and tokens[i+1].lower() in ("temp", "hum", "time", "minmax"):
-                handle_cmd(f"clear {tokens[i+1].lower()}")
-                i += 2
-                continue
-
-            # key/value commands (temp 43 / hum 69 / time 30)
-            if t in ("temp", "hum", "time") and i + 1 < len(tokens):
-                handle_cmd(f"{t} {tokens[i+1]}")
-                i += 2
-                continue
-
-            # fallback: treat the rest as one command (lets "time 3d 04:17" work if typed alone)
-            handle_cmd(" ".join(tokens[i:]))
+def poll_command():
+    # Runs queued commands, then reads input while budget is left
+    budget = config.CLI_COMMANDS_PER_TICK
+    budget -= run_queued(budget)
+    if not SELECT_AVAILABLE:
+        return
+    left = config.CLI_READ_BYTES
+    while budget > 0 and left > 0 and not _cli_parts:
+        n = read_input(left)
+        if not n:
             break
+        left -= n
+        budget -= run_queued(budget)
 
 ##############################################################################################################
 ##############################################################################################################
 
-while True:
-    # --- Uptime / stats page ---
-    lcd_new_page()
-    start_time_display = utime.time()
-    while utime.time() - start_time_display < 5:
-        poll_command()
-
-        uptime = get_uptime()
-
-        # Ensure min/max gets populated even if user stares at page 1 forever
-        # (non-blocking due to caching/rate-limit)
-        get_temp_and_humidity()
-
-        lcd_write_line(0, f"Up: {uptime}")
-
-        # T xx/XX  H xx/XX (fits in 16)
-        stats_line = f"T {fmt_mm(MIN_TEMP)}/{fmt_mm(MAX_TEMP)} H {fmt_mm(MIN_HUM)}/{fmt_mm(MAX_HUM)}"
-        lcd_write_line(1, stats_line)
-
-        utime.sleep(1)
-
-    # --- Temp/RH page ---
-    lcd_new_page()
-    start_time_display = utime.time()
-    while utime.time() - start_time_display < 5:
-        poll_command()
+# Allocation-free row rendering
+# Pages format straight into preallocated row buffers using static byte
+# templates and fixed-width number writers, then hand the buffers to the LCD
+# frame. No str objects are built per frame, so rendering does not churn the
+# heap. (Float values, which only come from overrides, still cost one float
+# temporary for their decimal digit.)
+ROW_BUFS = (bytearray(16), bytearray(16))
+
+def row_put(buf, pos, text):
+    # Copies the bytes of text into buf at pos; returns the position after it
+    for i in range(len(text)):
+        if pos >= len(buf):
+            break
+        buf[pos] = text[i]
+        pos += 1
+    return pos
+
+def row_put_int(buf, pos, value, width=1):
+    # Writes an int in decimal, zero-padded to width digits; returns the
+    # position after it
+    if value < 0:
+        pos = row_put(buf, pos, b"-")
+        value = -value
+    digits = 1
+    scale = 10
+    while value >= scale:
+        digits += 1
+        scale *= 10
+    if digits < width:
+        digits = width
+    end = pos + digits
+    i = end - 1
+    while i >= pos:
+        if i < len(buf):
+            buf[i] = 0x30 + value % 10
+        value //= 10
+        i -= 1
+    return min(end, len(buf))
+
+def row_put_value(buf, pos, value):
+    # Writes a reading as the old f-string did for ints and None; floats get
+    # exactly one decimal
+    if value is None:
+        return row_put(buf, pos, b"None")
+    if isinstance(value, int):
+        return row_put_int(buf, pos, value)
+    tenths = round(value * 10)
+    if tenths < 0:
+        pos = row_put(buf, pos, b"-")
+        tenths = -tenths
+    pos = row_put_int(buf, pos, tenths // 10)
+    pos = row_put(buf, pos, b".")
+    return row_put_int(buf, pos, tenths % 10)
+
+def row_put_mm(buf, pos, value):
+    # Min/max field: two digits, or "--" before the first reading
+    if value is None:
+        return row_put(buf, pos, b"--")
+    return row_put_int(buf, pos, int(value), 2)
+
+def row_put_mm_fixed(buf, pos, value):
+    # Same as row_put_mm for a fixed-point value (truncated, like int())
+    if value is None:
+        return row_put(buf, pos, b"--")
+    if value < 0:
+        return row_put_mm(buf, pos, -(-value // SCALE))
+    return row_put_mm(buf, pos, value // SCALE)
+
+def row_put_uptime(buf, pos, total_seconds):
+    # Same layout as get_uptime()
+    total_hours = total_seconds // 3600
+    minutes = total_seconds % 3600 // 60
+    if total_hours >= UPTIME_DAYS_AFTER_H:
+        pos = row_put_int(buf, pos, total_seconds // 86400)
+        pos = row_put(buf, pos, b"d ")
+        pos = row_put_int(buf, pos, total_hours % 24, 2)
+        pos = row_put(buf, pos, b":")
+        return row_put_int(buf, pos, minutes, 2)
+    pos = row_put_int(buf, pos, total_hours)
+    pos = row_put(buf, pos, b":")
+    pos = row_put_int(buf, pos, minutes, 2)
+    pos = row_put(buf, pos, b":")
+    return row_put_int(buf, pos, total_seconds % 60, 2)
+
+def row_finish(row, buf, pos):
+    # Pads the row with spaces and places it in the LCD frame
+    while pos < len(buf):
+        buf[pos] = 0x20
+        pos += 1
+    lcd.frame_write(0, row, buf)
+
+# Display pages
+# Pages only read committed state; the sensor task keeps it fresh.
+# Each page renders its rows and returns the monotonic time (ms) at which its
+# content can next change on its own, or None if it only changes when the
+# state it reads is committed (see the DIRTY_* bits it declares in PAGES).
+def render_page_summary():
+    buf = ROW_BUFS[0]
+    pos = row_put(buf, 0, b"Up: ")
+    pos = row_put_uptime(buf, pos, uptime_seconds())
+    row_finish(0, buf, pos)
+
+    # T xx/XX  H xx/XX (fits in 16), over SUMMARY_WINDOW or since boot
+    buf = ROW_BUFS[1]
+    pos = row_put(buf, 0, b"T ")
+    if SUMMARY_WINDOW is None:
+        pos = row_put_mm(buf, pos, STATE.min_temp)
+        pos = row_put(buf, pos, b"/")
+        pos = row_put_mm(buf, pos, STATE.max_temp)
+        pos = row_put(buf, pos, b" H ")
+        pos = row_put_mm(buf, pos, STATE.min_hum)
+        pos = row_put(buf, pos, b"/")
+        pos = row_put_mm(buf, pos, STATE.max_hum)
+    else:
+        pos = row_put_mm_fixed(buf, pos, STATE.summary_minmax[0])
+        pos = row_put(buf, pos, b"/")
+        pos = row_put_mm_fixed(buf, pos, STATE.summary_minmax[1])
+        pos = row_put(buf, pos, b" H ")
+        pos = row_put_mm_fixed(buf, pos, STATE.summary_minmax[2])
+        pos = row_put(buf, pos, b"/")
+        pos = row_put_mm_fixed(buf, pos, STATE.summary_minmax[3])
+    row_finish(1, buf, pos)
+    return uptime_next_change_ms()
+
+def render_page_readings():
+    buf = ROW_BUFS[0]
+    pos = row_put(buf, 0, b"Temp: ")
+    pos = row_put_value(buf, pos, STATE.last_temp)
+    pos = row_put(buf, pos, b" \xdf C")
+    row_finish(0, buf, pos)
+
+    buf = ROW_BUFS[1]
+    pos = row_put(buf, 0, b"Humid: ")
+    pos = row_put_value(buf, pos, STATE.last_hum)
+    pos = row_put(buf, pos, b" % RH")
+    row_finish(1, buf, pos)
+    return None
+
+PING_LABELS = tuple(label.encode()[:6] for label in PINGS.labels)
+
+def render_page_ping():
+    # "gw     12ms 0%" for the first two targets
+    for row in range(2):
+        buf = ROW_BUFS[row]
+        pos = 0
+        if row < len(PINGS):
+            pos = row_put(buf, 0, PING_LABELS[row])
+            while pos < 7:
+                buf[pos] = 0x20
+                pos += 1
+            avg = PINGS.avg_ms[row]
+            pos = row_put(buf, pos, b"--") if avg is None else row_put_int(buf, pos, avg)
+            pos = row_put(buf, pos, b"ms ")
+            loss = PINGS.loss_pct[row]
+            pos = row_put(buf, pos, b"--") if loss is None else row_put_int(buf, pos, loss)
+            pos = row_put(buf, pos, b"%")
+        row_finish(row, buf, pos)
+    return None
+
+# (render function, DIRTY_* bits the page depends on)
+PAGES = (
+    (render_page_summary, DIRTY_MINMAX | DIRTY_UPTIME),
+    (render_page_readings, DIRTY_READING),
+)
+if NET_AVAILABLE and len(PINGS):
+    PAGES += ((render_page_ping, DIRTY_PING),)
+CURRENT_PAGE = 0
+_page_started_ms = monotonic_ms()
+
+# Heap bytes allocated per rendered frame (MicroPython only: gc.mem_alloc),
+# when config.MEASURE_RENDER_ALLOC asks for it
+MEM_ALLOC_AVAILABLE = hasattr(gc, "mem_alloc") and config.MEASURE_RENDER_ALLOC
+RENDER_ALLOC_LAST = 0
+RENDER_ALLOC_MAX = 0
+
+def record_render_alloc(nbytes):
+    global RENDER_ALLOC_LAST, RENDER_ALLOC_MAX
+    RENDER_ALLOC_LAST = nbytes
+    if nbytes > RENDER_ALLOC_MAX:
+        RENDER_ALLOC_MAX = nbytes
+_page_next_change_ms = None  # None: nothing time-driven on the current page
+RENDER_COUNT = 0
+
+def display_tick():
+    # Renders the current page only if it is due: on a page switch, when a
+    # time-driven value rolls over, or when state the page shows changed.
+    # Returns the monotonic time (ms) of the next scheduled change.
+    global CURRENT_PAGE, _page_started_ms, _page_next_change_ms
+    global RENDER_DIRTY, RENDER_COUNT
+    now = monotonic_ms()
+    page_switch_ms = _page_started_ms + config.PAGE_PERIOD_MS
+    if now >= page_switch_ms:
+        CURRENT_PAGE = (CURRENT_PAGE + 1) % len(PAGES)
+        _page_started_ms = now
+        page_switch_ms = now + config.PAGE_PERIOD_MS
+        lcd_new_page()
+        RENDER_DIRTY = ALL_BITS
+
+    render, depends_on = PAGES[CURRENT_PAGE]
+    due = _page_next_change_ms is not None and now >= _page_next_change_ms
+    if due or RENDER_DIRTY & depends_on:
+        RENDER_DIRTY = 0
+        RENDER_COUNT += 1
+        if MEM_ALLOC_AVAILABLE:
+            # Hold off collection so the heap delta is exactly what this frame
+            # allocated; collection comes back on even if the I2C write fails
+            gc.disable()
+            try:
+                before = gc.mem_alloc()
+                _page_next_change_ms = render()
+                lcd.flush()
+                record_render_alloc(gc.mem_alloc() - before)
+            finally:
+                gc.enable()
+        else:
+            _page_next_change_ms = render()
+            lcd.flush()
+
+    if _page_next_change_ms is not None and _page_next_change_ms < page_switch_ms:
+        return _page_next_change_ms
+    return page_switch_ms
+
+def cli_tick():
+    # Commands only write STATE; subscribers hear about it here
+    poll_command()
+    STATE.publish()
+
+def sensor_tick():
+    # Non-blocking due to caching/rate-limit; also applies active overrides
+    get_temp_and_humidity()
+
+def net_tick():
+    # Advances the Wi-Fi state machine and reports link changes
+    state = WIFI.state
+    due = WIFI.poll(monotonic_ms())
+    if WIFI.state != state:
+        if WIFI.state == UP:
+            print(f"[NET] Link up: {wlan.ifconfig()[0]} rssi={WIFI.rssi} (attempt {WIFI.attempts})")
+        elif state == UP:
+            print(f"[NET] Link down, retry in {WIFI.backoff_ms // 1000}s")
+        elif state == CONNECTING:
+            print(f"[NET] Connect failed (status {WIFI.last_status}), retry in {WIFI.backoff_ms // 1000}s")
+    return due
+
+_snapshot_next_ms = monotonic_ms() + config.SNAPSHOT_PERIOD_S * 1000
+_data_snapshot_next_ms = monotonic_ms() + config.SNAPSHOT_DATA_PERIOD_S * 1000
+
+def snapshot_tick():
+    # Saves one object per run while a snapshot is being written, so the
+    # flash writes are spread across scheduler turns
+    global _snapshot_next_ms, _data_snapshot_next_ms
+    now = monotonic_ms()
+    if now >= _data_snapshot_next_ms:
+        if DATA_SNAPSHOTS.step(data_s()):
+            return now
+        _data_snapshot_next_ms = now + config.SNAPSHOT_DATA_PERIOD_S * 1000
+    if now >= _snapshot_next_ms:
+        if SNAPSHOTS.step(data_s()):
+            return now
+        _snapshot_next_ms = now + config.SNAPSHOT_PERIOD_S * 1000
+    return min(_snapshot_next_ms, _data_snapshot_next_ms)
+
+def ping_tick():
+    # Sends due pings and collects replies; the ping page follows through STATE
+    due = PINGS.poll(monotonic_ms(), WIFI.state == UP)
+    if STATE.set("ping_results", PINGS.results):
+        STATE.publish()
+    return due
+
+def metrics_tick():
+    # Serves scrapers a segment at a time; never waits on a socket
+    return METRICS.poll(monotonic_ms(), WIFI.state == UP)
+
+def mqtt_tick():
+    # Keeps the broker connection up and publishes queued readings
+    state = MQTT.state
+    due = MQTT.poll(monotonic_ms(), WIFI.state == UP)
+    if MQTT.state != state:
+        if MQTT.state == UP:
+            print(f"[NET] MQTT connected to {MQTT.broker}:{MQTT.port}, {len(MQTT.queue)} readings queued")
+        elif state == UP:
+            print(f"[NET] MQTT connection lost, retry in {MQTT.backoff_ms // 1000}s")
+        elif state == CONNECTING:
+            print(f"[NET] MQTT connect failed (status {MQTT.last_status}), retry in {MQTT.backoff_ms // 1000}s")
+    return due
+
+def stream_tick():
+    # Sends a frame every STREAM_PERIOD_S; idle (None) when periodic frames are off
+    global _stream_next_ms
+    if STREAM_PERIOD_S <= 0:
+        return None
+    now = monotonic_ms()
+    if now >= _stream_next_ms:
+        send_frame()
+        _stream_next_ms += STREAM_PERIOD_S * 1000
+        if _stream_next_ms <= now:
+            _stream_next_ms = now + STREAM_PERIOD_S * 1000
+    return _stream_next_ms
+
+def log_tick():
+    # Bounds how long a partly filled page can sit in RAM
+    since_s = LOG.buffered_since()
+    if since_s is not None and monotonic_s() - since_s >= config.LOG_FLUSH_S:
+        LOG.flush()
 
-        temperature, humidity = get_temp_and_humidity()
+##############################################################################################################
+##############################################################################################################
 
-        lcd_write_line(0, f"Temp: {temperature} \xDF C")
-        lcd_write_line(1, f"Humid: {humidity} % RH")
+# Cooperative tasks
+# Each subsystem runs as its own uasyncio task on its own period (see config.py).
+# Work functions must return quickly; nothing here may block the scheduler.
+TASK_STATS = {}  # name -> [runs, late, errors, worst_run_us]
 
-        utime.sleep(1)
\ No newline at end of file
+def _run_work(name, stats, work):
+    # Runs one step of a task, timing it and containing its errors.
+    # Returns whatever work() returned, or None if it raised.
+    result = None
+    started_us = utime.ticks_us()
+    try:
+        result = work()
+    except Exception as e:
+        # A bad command or flaky peripheral must not take the task down
+        stats[2] += 1
+        print(f"[TASK] {name} error: {repr(e)}")
+    run_us = utime.ticks_diff(utime.ticks_us(), started_us)
+    stats[0] += 1
+    if run_us > stats[3]:
+        stats[3] = run_us
+    return result
+
+async def run_every(name, period_ms, work):
+    # Runs work() on a fixed schedule. If a run finishes after the next one
+    # was already due, that deadline is counted as missed and the schedule
+    # restarts from now instead of bursting to catch up.
+    stats = TASK_STATS[name] = [0, 0, 0, 0]
+    deadline = monotonic_ms()
+    while True:
+        _run_work(name, stats, work)
+
+        deadline += period_ms
+        delay = deadline - monotonic_ms()
+        if delay < 0:
+            stats[1] += 1
+            deadline = monotonic_ms()
+            delay = 0
+        await asyncio.sleep_ms(delay)
+
+async def run_when_due(name, poll_ms, work):
+    # Runs work(), which returns the monotonic time (ms) it next needs to run,
+    # and sleeps until then. Wakes at least every poll_ms so changes flagged
+    # in between (e.g. RENDER_DIRTY) are picked up; those wakes only cost a
+    # flag test in work().
+    stats = TASK_STATS[name] = [0, 0, 0, 0]
+    while True:
+        due = _run_work(name, stats, work)
+        delay = poll_ms
+        if due is not None:
+            delay = min(max(due - monotonic_ms(), 0), poll_ms)
+        await asyncio.sleep_ms(delay)
+
+async def main():
+    tasks = [
+        asyncio.create_task(run_every("cli", config.CLI_PERIOD_MS, cli_tick)),
+        asyncio.create_task(run_every("sensor", config.SENSOR_PERIOD_MS, sensor_tick)),
+        asyncio.create_task(run_when_due("display", config.DISPLAY_POLL_MS, display_tick)),
+        asyncio.create_task(run_every("log", config.LOG_PERIOD_MS, log_tick)),
+        asyncio.create_task(run_when_due("snapshot", config.SNAPSHOT_PERIOD_S * 1000, snapshot_tick)),
+        asyncio.create_task(run_when_due("stream", 1000, stream_tick)),
+    ]
+    if NET_AVAILABLE:
+        tasks.append(asyncio.create_task(run_when_due("net", config.NET_PERIOD_MS, net_tick)))
+        if len(PINGS):
+            tasks.append(asyncio.create_task(run_when_due("ping", config.PING_PERIOD_MS, ping_tick)))
+        if MQTT is not None:
+            tasks.append(asyncio.create_task(run_when_due("mqtt", config.MQTT_POLL_MS, mqtt_tick)))
+        if config.METRICS_PORT:
+            tasks.append(asyncio.create_task(run_when_due("metrics", config.METRICS_POLL_MS, metrics_tick)))
+    await asyncio.gather(*tasks)
+
+asyncio.run(main())
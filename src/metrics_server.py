@@ -0,0 +1,247 @@
+import socket
+
+# Room reserved in front of the body for the response header, which is
+# written right-aligned against the body so the response is one slice
+HEADER_ROOM = 128
+HEADER = ("HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+          "Content-Length: %d\r\nConnection: close\r\n\r\n")
+BAD_REQUEST = b"HTTP/1.0 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+NOT_FOUND = b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+NOT_ALLOWED = b"HTTP/1.0 405 Method Not Allowed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+REQUEST_MAX_BYTES = 1024  # larger request headers get a 400
+RECV_BYTES = 256
+SEND_BYTES = 1460         # one TCP segment per client per poll
+
+
+class Exposition:
+
+    # Prometheus text exposition written into a fixed buffer.
+    #
+    # metric() declares a metric's type, sample() adds one value with at
+    # most one label. A line that does not fit is dropped (and counted in
+    # overflows) rather than growing the buffer. None is written as NaN.
+
+    def __init__(self, size, offset=0):
+        self.buf = bytearray(size)
+        self.offset = offset
+        self.length = offset
+        self.overflows = 0
+
+    def reset(self):
+        self.length = self.offset
+
+    def size(self):
+        return self.length - self.offset
+
+    def write(self, data):
+        end = self.length + len(data)
+        if end > len(self.buf):
+            self.overflows += 1
+            return False
+        self.buf[self.length:end] = data
+        self.length = end
+        return True
+
+    def metric(self, name, kind):
+        self.write(f"# TYPE {name} {kind}\n".encode())
+
+    def sample(self, name, value, label=None, label_value=None):
+        if value is None:
+            value = "NaN"
+        elif value is True or value is False:
+            value = int(value)
+        if label is None:
+            self.write(f"{name} {value}\n".encode())
+        else:
+            self.write(f'{name}{{{label}="{label_value}"}} {value}\n'.encode())
+
+
+class MetricsServer:
+
+    # Minimal non-blocking HTTP server for GET /metrics.
+    #
+    # poll() accepts waiting connections, reads requests and sends responses
+    # a segment at a time, then returns; it never waits on a socket. Up to
+    # max_clients scrapers are served at once (more wait in the listen
+    # backlog), and a client that has not finished within timeout_ms is
+    # dropped.
+    #
+    # The body is rendered by render(exposition) into one preallocated
+    # buffer, at most every refresh_ms and only when a scrape asks for it.
+    # Concurrent scrapers are all sent slices of that same buffer, so it is
+    # only re-rendered while no response is going out.
+
+    def __init__(self, port, render, max_clients=4, buffer_bytes=4096,
+                 refresh_ms=1000, timeout_ms=5000, poll_ms=50):
+        self.port = port
+        self.render = render
+        self.max_clients = max_clients
+        self.refresh_ms = refresh_ms
+        self.timeout_ms = timeout_ms
+        self.poll_ms = poll_ms
+        self.body = Exposition(buffer_bytes, HEADER_ROOM)
+        self._view = memoryview(self.body.buf)
+        self._start = HEADER_ROOM   # response = buf[_start:body.length]
+        self._rendered_ms = None
+        self._listener = None
+        self._listen_after_ms = None  # retry time after a failed listen
+        self._socks = [None] * max_clients
+        self._request = [b""] * max_clients
+        self._response = [None] * max_clients  # memoryview being sent
+        self._serving = [False] * max_clients  # response is a slice of the body
+        self._sent = [0] * max_clients
+        self._deadline = [0] * max_clients
+        self.requests = 0
+        self.scrapes = 0     # /metrics responses
+        self.renders = 0
+        self.timeouts = 0
+        self.errors = 0      # socket errors (listen, accept, receive, send)
+
+    def clients(self):
+        return sum(1 for sock in self._socks if sock is not None)
+
+    def poll(self, now_ms, link_up):
+        # Returns the monotonic time (ms) poll() next needs to run
+        if not link_up:
+            self.close()
+            return now_ms + self.poll_ms
+        if self._listener is None:
+            if self._listen_after_ms is not None and now_ms < self._listen_after_ms:
+                return self._listen_after_ms
+            if not self._listen():
+                # e.g. the port is taken; don't retry on every poll
+                self._listen_after_ms = now_ms + self.timeout_ms
+                return self._listen_after_ms
+        self._accept(now_ms)
+        for slot in range(self.max_clients):
+            if self._socks[slot] is None:
+                continue
+            if now_ms >= self._deadline[slot]:
+                self.timeouts += 1
+                self._drop(slot)
+            elif self._response[slot] is None:
+                self._read(slot, now_ms)
+            else:
+                self._write(slot)
+        return now_ms + self.poll_ms
+
+    def _listen(self):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(("0.0.0.0", self.port))
+            sock.listen(self.max_clients)
+            sock.setblocking(False)
+        except OSError:
+            self.errors += 1
+            return False
+        self._listener = sock
+        return True
+
+    def _accept(self, now_ms):
+        for slot in range(self.max_clients):
+            if self._socks[slot] is not None:
+                continue
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return  # nothing waiting (EAGAIN)
+            sock.setblocking(False)
+            self._socks[slot] = sock
+            self._request[slot] = b""
+            self._response[slot] = None
+            self._sent[slot] = 0
+            self._deadline[slot] = now_ms + self.timeout_ms
+
+    def _read(self, slot, now_ms):
+        try:
+            data = self._socks[slot].recv(RECV_BYTES)
+        except OSError as e:
+            if e.args and e.args[0] in (11, 35):  # EAGAIN / EWOULDBLOCK
+                return
+            self.errors += 1
+            self._drop(slot)
+            return
+        if not data:
+            self._drop(slot)  # closed before sending a full request
+            return
+        request = self._request[slot] + data
+        self._request[slot] = request
+        if b"\r\n\r\n" not in request:
+            if len(request) > REQUEST_MAX_BYTES:
+                self._respond(slot, BAD_REQUEST)
+            return
+        self.requests += 1
+        self._request[slot] = b""
+        parts = request.split(b"\r\n", 1)[0].split()
+        if len(parts) < 2:
+            self._respond(slot, BAD_REQUEST)
+        elif parts[0] != b"GET":
+            self._respond(slot, NOT_ALLOWED)
+        elif parts[1] != b"/metrics" and not parts[1].startswith(b"/metrics?"):
+            self._respond(slot, NOT_FOUND)
+        else:
+            self._refresh(now_ms)
+            self.scrapes += 1
+            self._serving[slot] = True
+            self._respond(slot, self._view[self._start:self.body.length])
+
+    def _refresh(self, now_ms):
+        # Re-renders the body when it is older than refresh_ms, unless a
+        # response is still being sent from it
+        if self._rendered_ms is not None and now_ms - self._rendered_ms < self.refresh_ms:
+            return
+        for serving in self._serving:
+            if serving:
+                return
+        body = self.body
+        body.reset()
+        self.render(body)
+        header = (HEADER % (body.length - HEADER_ROOM)).encode()
+        self._start = HEADER_ROOM - len(header)
+        body.buf[self._start:HEADER_ROOM] = header
+        self._rendered_ms = now_ms
+        self.renders += 1
+
+    def _respond(self, slot, response):
+        self._response[slot] = response if isinstance(response, memoryview) else memoryview(response)
+        self._sent[slot] = 0
+        self._write(slot)
+
+    def _write(self, slot):
+        response = self._response[slot]
+        sent = self._sent[slot]
+        try:
+            count = self._socks[slot].send(response[sent:sent + SEND_BYTES])
+        except OSError as e:
+            if e.args and e.args[0] in (11, 35):
+                return
+            self.errors += 1
+            self._drop(slot)
+            return
+        self._sent[slot] = sent + (count or 0)
+        if self._sent[slot] >= len(response):
+            self._drop(slot)
+
+    def _drop(self, slot):
+        try:
+            self._socks[slot].close()
+        except OSError:
+            pass
+        self._socks[slot] = None
+        self._request[slot] = b""
+        self._response[slot] = None
+        self._serving[slot] = False
+
+    def close(self):
+        # Drops every client and the listener (e.g. when the link goes down)
+        for slot in range(self.max_clients):
+            if self._socks[slot] is not None:
+                self._drop(slot)
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except OSError:
+                pass
+            self._listener = None
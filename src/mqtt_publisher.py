@@ -0,0 +1,331 @@
+import json
+import socket
+import struct
+
+from history import MISSING, SCALE
+from telemetry_log import SOURCES
+
+# Connection states
+DOWN = 0        # not connected; next attempt after the backoff
+CONNECTING = 1  # TCP connect and MQTT CONNECT sent, waiting for CONNACK
+UP = 2
+STATE_NAMES = ("down", "connecting", "up")
+
+# Queued reading: data time (s), temp and hum (fixed point), source code
+RECORD = "<IhhB"
+RECORD_SIZE = struct.calcsize(RECORD)
+
+PINGREQ = b"\xc0\x00"
+PAYLOAD_VERSION = 1
+
+# Socket errors that only mean "not yet" on a non-blocking socket
+# (EAGAIN/EWOULDBLOCK, EALREADY, EINPROGRESS on Linux, MicroPython and BSD)
+PENDING_ERRNOS = (11, 35, 36, 37, 114, 115)
+
+
+def _pending(e):
+    return bool(e.args) and e.args[0] in PENDING_ERRNOS
+
+
+def _remaining_length(length):
+    # MQTT variable-length integer
+    out = bytearray()
+    while True:
+        byte = length & 0x7f
+        length >>= 7
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return out
+
+
+def _string(text):
+    data = text.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+class RecordQueue:
+
+    # Bounded FIFO of readings, packed RECORD_SIZE bytes each into one
+    # preallocated ring. When full, push() drops the oldest record.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buf = bytearray(capacity * RECORD_SIZE)
+        self._head = 0    # index of the oldest record
+        self._count = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._count
+
+    def push(self, t_s, temp_fixed, hum_fixed, source):
+        # Returns True if the oldest record was dropped to make room
+        dropped = self._count == self.capacity
+        if dropped:
+            self._head = (self._head + 1) % self.capacity
+            self._count -= 1
+            self.dropped += 1
+        index = (self._head + self._count) % self.capacity
+        struct.pack_into(RECORD, self._buf, index * RECORD_SIZE, t_s, temp_fixed, hum_fixed, source)
+        self._count += 1
+        return dropped
+
+    def peek(self, i):
+        # (t_s, temp_fixed, hum_fixed, source) of the i-th oldest record
+        index = (self._head + i) % self.capacity
+        return struct.unpack_from(RECORD, self._buf, index * RECORD_SIZE)
+
+    def pop(self, count):
+        count = min(count, self._count)
+        self._head = (self._head + count) % self.capacity
+        self._count -= count
+
+
+class MqttPublisher:
+
+    # Batched MQTT 3.1.1 publisher (QoS 0) with an offline queue.
+    #
+    # add() only queues the reading. poll() keeps the broker connection up
+    # and publishes the queue, `batch` readings per PUBLISH, once a full
+    # batch is waiting or the oldest reading has waited batch_ms. While the
+    # link or the broker is down readings stay queued (the queue is bounded;
+    # the oldest are dropped first). After a reconnect the backlog drains one
+    # packet per drain_ms, so it does not flood the broker or the radio.
+    #
+    # poll() never waits on the socket: the TCP connect, CONNECT/CONNACK and
+    # every packet go out non-blocking, a piece per poll. Readings leave the
+    # queue only once their packet has been handed to TCP in full; a packet
+    # cut off by a dropped connection is sent again. Connect failures back
+    # off from backoff_min_ms to backoff_max_ms, like WifiLink.
+    #
+    # The broker must be an IPv4 address: resolving a name would block.
+
+    def __init__(self, broker, port, client_id, topic, user=None, password=None,
+                 keepalive_s=60, batch=10, batch_ms=10000, queue_records=512, drain_ms=250,
+                 connect_timeout_ms=5000, backoff_min_ms=2000, backoff_max_ms=300000,
+                 poll_ms=100, boot=0):
+        self.broker = broker
+        self.port = port
+        self.client_id = client_id
+        self.topic = topic
+        self.user = user
+        self.password = password
+        self.keepalive_ms = keepalive_s * 1000
+        self.batch = batch
+        self.batch_ms = batch_ms
+        self.drain_ms = drain_ms
+        self.connect_timeout_ms = connect_timeout_ms
+        self.backoff_min_ms = backoff_min_ms
+        self.backoff_max_ms = backoff_max_ms
+        self.poll_ms = poll_ms
+        self.boot = boot
+        self.queue = RecordQueue(queue_records)
+        self._topic = _string(topic)
+        self.state = DOWN
+        self.backoff_ms = 0
+        self._due_ms = None          # next attempt (DOWN) or CONNACK timeout (CONNECTING)
+        self._sock = None
+        self._out = None             # memoryview of the packet being sent
+        self._out_pos = 0
+        self._in_flight = 0          # queued readings in that packet
+        self._rx = b""
+        self._batch_since_ms = None  # when the oldest unsent reading was seen
+        self._next_send_ms = 0
+        self._last_rx_ms = 0
+        self._last_ping_ms = 0
+        self.attempts = 0
+        self.connects = 0
+        self.failures = 0            # attempts that timed out, were refused or rejected
+        self.drops = 0               # established connections that went down
+        self.last_status = None      # CONNACK return code or errno of the last failure
+        self.published = 0           # readings handed to TCP
+        self.packets = 0
+        self.bytes_sent = 0
+
+    def add(self, t_s, temp_fixed, hum_fixed, source):
+        if self.queue.push(t_s, temp_fixed, hum_fixed, source) and self._in_flight:
+            # The dropped record was part of the packet going out
+            self._in_flight -= 1
+
+    def state_name(self):
+        return STATE_NAMES[self.state]
+
+    def poll(self, now_ms, link_up):
+        # Returns the monotonic time (ms) poll() next needs to run
+        if self._due_ms is None:
+            self._due_ms = now_ms + self.backoff_ms
+        if len(self.queue) and self._batch_since_ms is None:
+            self._batch_since_ms = now_ms
+        if not link_up:
+            if self.state != DOWN:
+                if self.state == UP:
+                    self.drops += 1
+                self._down(now_ms, self.backoff_min_ms)
+            return now_ms + self.poll_ms
+        if self.state == DOWN:
+            if now_ms < self._due_ms:
+                return self._due_ms
+            self._connect(now_ms)
+        if self.state == CONNECTING:
+            self._poll_connecting(now_ms)
+        elif self.state == UP:
+            self._poll_up(now_ms)
+        if self.state == DOWN:
+            return self._due_ms
+        return now_ms + self.poll_ms
+
+    def _connect(self, now_ms):
+        self.state = CONNECTING
+        self.attempts += 1
+        self._due_ms = now_ms + self.connect_timeout_ms
+        self._rx = b""
+        try:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.setblocking(False)
+            self._sock.connect((self.broker, self.port))
+        except OSError as e:
+            if not _pending(e):
+                self._fail(now_ms, e.args[0] if e.args else None)
+                return
+        self._start_packet(self._connect_packet(), 0)
+
+    def _connect_packet(self):
+        flags = 0x02  # clean session
+        payload = _string(self.client_id)
+        if self.user is not None:
+            flags |= 0x80
+            payload += _string(self.user)
+            if self.password is not None:
+                flags |= 0x40
+                payload += _string(self.password)
+        body = _string("MQTT") + bytes((4, flags)) + struct.pack("!H", self.keepalive_ms // 1000) + payload
+        return b"\x10" + _remaining_length(len(body)) + body
+
+    def _poll_connecting(self, now_ms):
+        if now_ms >= self._due_ms:
+            self._fail(now_ms, self.last_status)
+            return
+        if not self._flush(now_ms) or self._out is not None:
+            return
+        data = self._receive(now_ms)
+        if data is None:
+            return
+        self._rx += data
+        if len(self._rx) < 4:
+            return
+        if self._rx[0] != 0x20 or self._rx[3] != 0:
+            self._fail(now_ms, self._rx[3])
+            return
+        self._rx = b""
+        self.state = UP
+        self.connects += 1
+        self.backoff_ms = 0
+        self._next_send_ms = now_ms
+
+    def _poll_up(self, now_ms):
+        if not self._flush(now_ms):
+            return
+        self._receive(now_ms)  # PINGRESP; also notices a closed connection
+        if self.state != UP:
+            return
+        if now_ms - self._last_rx_ms > self.keepalive_ms * 3 // 2:
+            # No PINGRESP in time: the broker or the path is gone
+            self.drops += 1
+            self._down(now_ms, self.backoff_min_ms)
+            return
+        if self._out is not None:
+            return
+        count = len(self.queue)
+        if now_ms - max(self._last_rx_ms, self._last_ping_ms) >= self.keepalive_ms // 2:
+            # Publishes get no reply at QoS 0, so liveness comes from pings
+            self._last_ping_ms = now_ms
+            self._start_packet(PINGREQ, 0)
+            self._flush(now_ms)
+        elif count and now_ms >= self._next_send_ms and (
+                count >= self.batch or now_ms - self._batch_since_ms >= self.batch_ms):
+            self._publish(min(count, self.batch))
+            self._next_send_ms = now_ms + self.drain_ms
+            self._flush(now_ms)
+
+    def _publish(self, count):
+        readings = []
+        for i in range(count):
+            t_s, temp, hum, source = self.queue.peek(i)
+            readings.append([t_s, None if temp == MISSING else temp / SCALE,
+                             None if hum == MISSING else hum / SCALE,
+                             SOURCES[source] if source < len(SOURCES) else source])
+        payload = json.dumps({"v": PAYLOAD_VERSION, "device": self.client_id, "boot": self.boot,
+                              "readings": readings}).encode()
+        body_length = len(self._topic) + len(payload)
+        self._start_packet(b"\x30" + _remaining_length(body_length) + self._topic + payload, count)
+
+    def _start_packet(self, packet, readings):
+        self._out = memoryview(packet)
+        self._out_pos = 0
+        self._in_flight = readings
+
+    def _flush(self, now_ms):
+        # Sends what the socket takes of the pending packet. Returns False if
+        # the connection failed.
+        if self._out is None:
+            return True
+        try:
+            sent = self._sock.send(self._out[self._out_pos:])
+        except OSError as e:
+            if _pending(e):
+                return True
+            self._lost(now_ms, e.args[0] if e.args else None)
+            return False
+        sent = sent or 0
+        self._out_pos += sent
+        self.bytes_sent += sent
+        if self._out_pos >= len(self._out):
+            if self._in_flight:
+                self.queue.pop(self._in_flight)
+                self.published += self._in_flight
+                self.packets += 1
+                self._batch_since_ms = now_ms if len(self.queue) else None
+            self._out = None
+            self._in_flight = 0
+        return True
+
+    def _receive(self, now_ms):
+        # Returns the bytes received, or None if there were none
+        try:
+            data = self._sock.recv(16)
+        except OSError as e:
+            if not _pending(e):
+                self._lost(now_ms, e.args[0] if e.args else None)
+            return None
+        if not data:
+            self._lost(now_ms, None)  # closed by the broker
+            return None
+        self._last_rx_ms = now_ms
+        return data
+
+    def _lost(self, now_ms, status):
+        if self.state == UP:
+            self.drops += 1
+            self._down(now_ms, self.backoff_min_ms)
+        else:
+            self._fail(now_ms, status)
+
+    def _fail(self, now_ms, status):
+        self.failures += 1
+        self.last_status = status
+        backoff = self.backoff_ms * 2 if self.backoff_ms else self.backoff_min_ms
+        self._down(now_ms, min(backoff, self.backoff_max_ms))
+
+    def _down(self, now_ms, backoff_ms):
+        # Readings in a half-sent packet stay queued and go out again
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+        self._out = None
+        self._in_flight = 0
+        self.state = DOWN
+        self.backoff_ms = backoff_ms
+        self._due_ms = now_ms + backoff_ms
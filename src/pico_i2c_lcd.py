@@ -2,7 +2,6 @@ import utime
 import gc
 
 from lcd_api import LcdApi
-from machine import I2C
 
 # PCF8574 pin definitions
 MASK_RS = 0x01       # P0
@@ -12,6 +11,14 @@ MASK_E  = 0x04       # P2
 SHIFT_BACKLIGHT = 3  # P3
 SHIFT_DATA      = 4  # P4-P7
 
+# Every HD44780 byte is four PCF8574 port writes (high nibble with E high/low,
+# then low nibble with E high/low). At 400 kHz each port write takes ~22 us,
+# so one byte spans ~90 us, comfortably longer than the 37 us the controller
+# needs per instruction. That lets a whole run of bytes go out back-to-back
+# in a single I2C transaction.
+BUS_BYTES_PER_CHAR = 4
+MAX_BATCH_CHARS    = 40  # LcdApi caps num_columns at 40
+
 class I2cLcd(LcdApi):
     
     #Implements a HD44780 character LCD connected via PCF8574 on I2C
@@ -19,7 +26,16 @@ class I2cLcd(LcdApi):
     def __init__(self, i2c, i2c_addr, num_lines, num_columns):
         self.i2c = i2c
         self.i2c_addr = i2c_addr
-        self.i2c.writeto(self.i2c_addr, bytes([0]))
+        # Preallocated transmit buffers so steady-state writes never allocate
+        self._port_buf = bytearray(1)
+        self._byte_buf = bytearray(BUS_BYTES_PER_CHAR)
+        self._run_buf = bytearray(BUS_BYTES_PER_CHAR * MAX_BATCH_CHARS)
+        self._run_mv = memoryview(self._run_buf)
+        self._run_views = [None] * (MAX_BATCH_CHARS + 1)  # cached slices, by char count
+        # Bus counters (transactions and bytes since boot, for perf/metrics)
+        self.i2c_writes = 0
+        self.i2c_bytes = 0
+        self._writeto(bytes([0]))
         utime.sleep_ms(20)   # Allow LCD time to powerup
         # Send reset 3 times
         self.hal_write_init_nibble(self.LCD_FUNCTION_RESET)
@@ -38,49 +54,77 @@ class I2cLcd(LcdApi):
         self.hal_write_command(cmd)
         gc.collect()
 
+    def _writeto(self, buf):
+        # One I2C transaction to the PCF8574
+        self.i2c.writeto(self.i2c_addr, buf)
+        self.i2c_writes += 1
+        self.i2c_bytes += len(buf)
+
     def hal_write_init_nibble(self, nibble):
         # Writes an initialization nibble to the LCD.
         # This particular function is only used during initialization.
         byte = ((nibble >> 4) & 0x0f) << SHIFT_DATA
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        gc.collect()
-        
+        buf = self._byte_buf
+        buf[0] = byte | MASK_E
+        buf[1] = byte
+        self._writeto(memoryview(buf)[:2])
+
     def hal_backlight_on(self):
         # Allows the hal layer to turn the backlight on
-        self.i2c.writeto(self.i2c_addr, bytes([1 << SHIFT_BACKLIGHT]))
-        gc.collect()
-        
+        self._port_buf[0] = 1 << SHIFT_BACKLIGHT
+        self._writeto(self._port_buf)
+
     def hal_backlight_off(self):
         #Allows the hal layer to turn the backlight off
-        self.i2c.writeto(self.i2c_addr, bytes([0]))
-        gc.collect()
-        
+        self._port_buf[0] = 0
+        self._writeto(self._port_buf)
+
+    def _pack_byte(self, buf, offset, value, flags):
+        # Packs one HD44780 byte into buf[offset:offset + 4] as the PCF8574
+        # E-high/E-low sequence for the high nibble followed by the low nibble.
+        # Data is latched on the falling edge of E.
+        high = flags | (((value >> 4) & 0x0f) << SHIFT_DATA)
+        low = flags | ((value & 0x0f) << SHIFT_DATA)
+        buf[offset] = high | MASK_E
+        buf[offset + 1] = high
+        buf[offset + 2] = low | MASK_E
+        buf[offset + 3] = low
+
     def hal_write_command(self, cmd):
-        # Write a command to the LCD. Data is latched on the falling edge of E.
-        byte = ((self.backlight << SHIFT_BACKLIGHT) |
-                (((cmd >> 4) & 0x0f) << SHIFT_DATA))
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        byte = ((self.backlight << SHIFT_BACKLIGHT) |
-                ((cmd & 0x0f) << SHIFT_DATA))
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
+        # Write a command to the LCD in a single I2C transaction.
+        self._pack_byte(self._byte_buf, 0, cmd,
+                        self.backlight << SHIFT_BACKLIGHT)
+        self._writeto(self._byte_buf)
         if cmd <= 3:
             # The home and clear commands require a worst case delay of 4.1 msec
             utime.sleep_ms(5)
-        gc.collect()
 
     def hal_write_data(self, data):
-        # Write data to the LCD. Data is latched on the falling edge of E.
-        byte = (MASK_RS |
-                (self.backlight << SHIFT_BACKLIGHT) |
-                (((data >> 4) & 0x0f) << SHIFT_DATA))
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        byte = (MASK_RS |
-                (self.backlight << SHIFT_BACKLIGHT) |
-                ((data & 0x0f) << SHIFT_DATA))      
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        gc.collect()
+        # Write data to the LCD in a single I2C transaction.
+        self._pack_byte(self._byte_buf, 0, data,
+                        MASK_RS | (self.backlight << SHIFT_BACKLIGHT))
+        self._writeto(self._byte_buf)
+
+    def hal_write_data_buf(self, buf, count):
+        # Write the first count bytes of buf as data, batching up to
+        # MAX_BATCH_CHARS characters per I2C transaction.
+        flags = MASK_RS | (self.backlight << SHIFT_BACKLIGHT)
+        run = self._run_buf
+        start = 0
+        while start < count:
+            end = min(count, start + MAX_BATCH_CHARS)
+            offset = 0
+            for i in range(start, end):
+                self._pack_byte(run, offset, buf[i], flags)
+                offset += BUS_BYTES_PER_CHAR
+            # Slicing allocates, so each run length's view is made only once
+            view = self._run_views[end - start]
+            if view is None:
+                view = self._run_mv[:offset]
+                self._run_views[end - start] = view
+            self._writeto(view)
+            start = end
+
+    def hal_sleep_us(self, usecs):
+        # Sleep for some time (given in microseconds)
+        utime.sleep_us(usecs)
@@ -0,0 +1,196 @@
+import socket
+import struct
+from array import array
+
+# ICMP echo request/reply
+ECHO_REQUEST = 8
+ECHO_REPLY = 0
+HEADER = "!BBHHH"  # type, code, checksum, identifier, sequence
+HEADER_SIZE = 8
+PAYLOAD_SIZE = 16
+IDENT = 0x5050
+
+# Ring buffer entry for a request that got no reply in time
+LOST = 0xffff
+
+
+def checksum(buf, length):
+    # Internet checksum (RFC 1071) of buf[:length]
+    total = 0
+    for i in range(0, length - 1, 2):
+        total += (buf[i] << 8) | buf[i + 1]
+    if length & 1:
+        total += buf[length - 1] << 8
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+class PingMonitor:
+
+    # ICMP echo monitor for several targets over one non-blocking raw socket.
+    #
+    # poll() sends each target an echo request every period_ms (targets are
+    # staggered across the period), collects whatever replies have arrived
+    # and expires requests older than timeout_ms as lost; it never waits on
+    # the network. Requests to all targets are in flight at the same time.
+    # Each target keeps its last `history` results (RTT in ms, or LOST) in a
+    # ring; avg_ms/loss_pct are refreshed from it with every result, and
+    # stats() gives min/avg/max/loss on demand.
+    #
+    # RTTs are measured when poll() sees the reply, so their resolution is
+    # the poll_ms at which poll() asks to run while requests are in flight.
+    # Targets must be IPv4 addresses: resolving names would block.
+
+    def __init__(self, targets, period_ms=5000, timeout_ms=2000, history=60, poll_ms=10):
+        self.labels = [label for label, _ in targets]
+        self.addresses = [address for _, address in targets]
+        count = len(targets)
+        self.period_ms = period_ms
+        self.timeout_ms = timeout_ms
+        self.history = history
+        self.poll_ms = poll_ms
+        self._rtt = array("H", [LOST] * (count * history))  # rings, one per target
+        self._head = [0] * count
+        self._filled = [0] * count
+        self._sent_ms = [None] * count  # send time of the request in flight
+        self._seq = [0] * count
+        self._next_ms = None
+        self.sent = [0] * count
+        self.received = [0] * count
+        self.avg_ms = [None] * count    # per target, updated with every result
+        self.loss_pct = [None] * count
+        self.results = 0   # results recorded so far (changes when the above may)
+        self.late = 0      # replies that arrived after their timeout
+        self.errors = 0    # socket errors (open, send, receive)
+        self._sock = None
+        self._packet = bytearray(HEADER_SIZE + PAYLOAD_SIZE)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def poll(self, now_ms, link_up):
+        # Returns the monotonic time (ms) poll() next needs to run
+        count = len(self.addresses)
+        if self._next_ms is None:
+            self._next_ms = [now_ms + t * self.period_ms // max(count, 1) for t in range(count)]
+        if not link_up:
+            self.close()
+            return now_ms + self.period_ms
+        if self._sock is None and not self._open():
+            return now_ms + self.period_ms
+        self._receive(now_ms)
+        due = now_ms + self.period_ms
+        in_flight = False
+        for t in range(count):
+            sent = self._sent_ms[t]
+            if sent is not None and now_ms - sent >= self.timeout_ms:
+                self._record(t, LOST)
+                self._sent_ms[t] = None
+            if self._sent_ms[t] is None and now_ms >= self._next_ms[t]:
+                self._send(t, now_ms)
+                self._next_ms[t] += self.period_ms
+                if self._next_ms[t] <= now_ms:
+                    self._next_ms[t] = now_ms + self.period_ms
+            if self._sent_ms[t] is not None:
+                # The next request waits for this one's reply or timeout
+                in_flight = True
+                due = min(due, self._sent_ms[t] + self.timeout_ms)
+            else:
+                due = min(due, self._next_ms[t])
+        if in_flight:
+            due = min(due, now_ms + self.poll_ms)
+        return due
+
+    def _open(self):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, 1)
+            sock.setblocking(False)
+        except (OSError, AttributeError):
+            self.errors += 1
+            return False
+        self._sock = sock
+        return True
+
+    def close(self):
+        # Requests in flight when the link goes down are dropped, not counted
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+        for t in range(len(self._sent_ms)):
+            self._sent_ms[t] = None
+
+    def _send(self, t, now_ms):
+        self._seq[t] = (self._seq[t] + 1) & 0x0fff
+        seq = (t << 12) | self._seq[t]
+        packet = self._packet
+        struct.pack_into(HEADER, packet, 0, ECHO_REQUEST, 0, 0, IDENT, seq)
+        struct.pack_into("!H", packet, 2, checksum(packet, len(packet)))
+        self.sent[t] += 1
+        try:
+            self._sock.sendto(packet, (self.addresses[t], 1))
+        except OSError:
+            # e.g. no route: counts as lost right away
+            self.errors += 1
+            self._record(t, LOST)
+            return
+        self._sent_ms[t] = now_ms
+
+    def _receive(self, now_ms):
+        # Drains the replies that have arrived (bounded, so a flood of ICMP
+        # traffic cannot hold up the loop)
+        for _ in range(2 * len(self.addresses) + 2):
+            try:
+                data, _ = self._sock.recvfrom(64)
+            except OSError:
+                return  # nothing pending (EAGAIN) or a transient error
+            # Raw IPv4 sockets hand over the IP header too
+            offset = (data[0] & 0x0f) * 4 if data and data[0] >> 4 == 4 else 0
+            if len(data) < offset + HEADER_SIZE:
+                continue
+            kind, _, _, ident, seq = struct.unpack_from(HEADER, data, offset)
+            if kind != ECHO_REPLY or ident != IDENT:
+                continue
+            t = seq >> 12
+            if t >= len(self.addresses) or seq & 0x0fff != self._seq[t]:
+                continue
+            sent = self._sent_ms[t]
+            if sent is None:
+                self.late += 1
+                continue
+            self._sent_ms[t] = None
+            self.received[t] += 1
+            self._record(t, min(now_ms - sent, LOST - 1))
+
+    def _record(self, t, rtt_ms):
+        self._rtt[t * self.history + self._head[t]] = rtt_ms
+        self._head[t] = (self._head[t] + 1) % self.history
+        if self._filled[t] < self.history:
+            self._filled[t] += 1
+        _, self.avg_ms[t], _, self.loss_pct[t], _ = self.stats(t)
+        self.results += 1
+
+    def stats(self, t):
+        # (min, avg, max, loss %, samples) over the target's ring; RTTs are
+        # None when nothing came back, loss is None before the first result
+        base = t * self.history
+        lo = hi = None
+        total = 0
+        replies = 0
+        samples = self._filled[t]
+        for i in range(samples):
+            rtt = self._rtt[base + i]
+            if rtt == LOST:
+                continue
+            replies += 1
+            total += rtt
+            if lo is None or rtt < lo:
+                lo = rtt
+            if hi is None or rtt > hi:
+                hi = rtt
+        avg = total // replies if replies else None
+        loss = (samples - replies) * 100 // samples if samples else None
+        return lo, avg, hi, loss, samples
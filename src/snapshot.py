@@ -0,0 +1,266 @@
+import json
+import struct
+
+try:
+    from binascii import crc32
+except ImportError:
+    # Ports built without binascii.crc32: bitwise CRC-32 (slow, but only
+    # runs once per snapshot)
+    def crc32(data, crc=0):
+        crc ^= 0xffffffff
+        for byte in data:
+            crc ^= byte
+            for _ in range(8):
+                crc = (crc >> 1) ^ (0xedb88320 if crc & 1 else 0)
+        return crc ^ 0xffffffff
+
+# File header: magic, format version, sequence number, data time (seconds),
+# payload length, CRC-32 of the payload followed by (seq, data_s)
+MAGIC = b"PSNP"
+VERSION = 1
+HEADER = "<4sBIiII"
+HEADER_SIZE = struct.calcsize(HEADER)
+
+# Each object in the payload: JSON length, buffer bytes, then the JSON and
+# the raw buffers
+RECORD = "<HI"
+RECORD_SIZE = struct.calcsize(RECORD)
+
+
+def flatten(name, obj, out):
+    # Appends (name, obj) and its SNAPSHOT_CHILDREN, depth first
+    out.append((name, obj))
+    for attr in getattr(obj, "SNAPSHOT_CHILDREN", ()):
+        child = getattr(obj, attr)
+        if isinstance(child, list):
+            for i in range(len(child)):
+                flatten(f"{name}.{attr}.{i}", child[i], out)
+        else:
+            flatten(f"{name}.{attr}", child, out)
+
+
+class SnapshotStore:
+
+    # Crash-safe snapshots of in-RAM state, alternating between two files.
+    #
+    # objects are (name, obj) pairs; each obj declares what to save in
+    # SNAPSHOT_KEY/SNAPSHOT_FIELDS (plain values, stored as JSON),
+    # SNAPSHOT_BUFFERS (arrays, stored raw) and SNAPSHOT_CHILDREN. Plain
+    # globals (if any) come from get_globals() and go back through
+    # set_globals().
+    #
+    # A save goes to the older of the two files and writes its header last,
+    # so a reset mid-write leaves a file whose magic or CRC does not check
+    # out; restore() then falls back to the other copy. A save starts by
+    # capturing every object at once (buffers are copied), so the file holds
+    # one moment's state; it is skipped when the payload's CRC matches the
+    # last one written, i.e. nothing changed. step() then writes one object
+    # per call so a save never stalls the scheduler for long.
+
+    def __init__(self, paths, objects, get_globals, set_globals):
+        self.paths = paths
+        self.objects = []
+        for name, obj in objects:
+            flatten(name, obj, self.objects)
+        self.get_globals = get_globals
+        self.set_globals = set_globals
+        self.seq = 0
+        self.saves = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.restored = None  # (path, seq, data_s) of the copy loaded at boot
+        self._last_crc = None
+        self._file = None
+        self._pending = None  # captured records not yet written
+
+    def _records(self):
+        # Yields (json_bytes, buffers) for the globals, then every object
+        if self.get_globals is not None:
+            yield json.dumps({"n": "globals", "f": self.get_globals()}).encode(), ()
+        for name, obj in self.objects:
+            fields = {}
+            for attr in getattr(obj, "SNAPSHOT_KEY", ()) + getattr(obj, "SNAPSHOT_FIELDS", ()):
+                fields[attr] = getattr(obj, attr)
+            buffers = [getattr(obj, attr) for attr in getattr(obj, "SNAPSHOT_BUFFERS", ())]
+            sizes = [_nbytes(buf) for buf in buffers]
+            yield json.dumps({"n": name, "f": fields, "b": sizes}).encode(), buffers
+
+    def _record_crc(self, crc, meta, buffers):
+        crc = crc32(struct.pack(RECORD, len(meta), _buffers_size(buffers)), crc)
+        crc = crc32(meta, crc)
+        for buf in buffers:
+            crc = crc32(buf, crc)
+        return crc
+
+    def _capture(self):
+        # Encodes every object now, copying its buffers, so a save written
+        # over several steps is not mixed with later changes. Returns
+        # (records, payload CRC, payload length).
+        records = []
+        crc = 0
+        length = 0
+        for meta, buffers in self._records():
+            buffers = [bytes(buf) for buf in buffers]
+            crc = self._record_crc(crc, meta, buffers)
+            length += RECORD_SIZE + len(meta) + _buffers_size(buffers)
+            records.append((meta, buffers))
+        return records, crc, length
+
+    def step(self, data_s):
+        # Advances a save by one object, starting one if state changed.
+        # Returns True while the save is still in progress.
+        try:
+            if self._file is None:
+                return self._begin(data_s)
+            return self._write_next()
+        except OSError:
+            self.errors += 1
+            self._abort()
+            return False
+
+    def save(self, data_s):
+        # Runs a whole save now. Returns True if a snapshot was written.
+        saves = self.saves
+        while self.step(data_s):
+            pass
+        return self.saves != saves
+
+    def _begin(self, data_s):
+        records, crc, length = self._capture()
+        if crc == self._last_crc:
+            self.unchanged += 1
+            return False
+        self._data_s = data_s
+        self._crc = crc
+        self._length = length
+        self._pending = records
+        self._file = open(self.paths[(self.seq + 1) % 2], "wb")
+        # Invalid until the real header replaces it at the end
+        self._file.write(bytes(HEADER_SIZE))
+        return True
+
+    def _write_next(self):
+        f = self._file
+        if self._pending:
+            meta, buffers = self._pending.pop(0)
+            f.write(struct.pack(RECORD, len(meta), _buffers_size(buffers)))
+            f.write(meta)
+            for buf in buffers:
+                f.write(buf)
+            return True
+        seq = self.seq + 1
+        crc = crc32(struct.pack("<Ii", seq, self._data_s), self._crc)
+        f.seek(0)
+        f.write(struct.pack(HEADER, MAGIC, VERSION, seq, self._data_s, self._length, crc))
+        f.close()
+        self._file = None
+        self._pending = None
+        self.seq = seq
+        self.saves += 1
+        self._last_crc = self._crc
+        return False
+
+    def _abort(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+        self._file = None
+        self._pending = None
+
+    def _check(self, path):
+        # (seq, data_s, payload CRC) if the file's header and CRC check out,
+        # else None
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return None
+        with f:
+            data = f.read(HEADER_SIZE)
+            if len(data) < HEADER_SIZE:
+                return None
+            magic, version, seq, data_s, length, crc = struct.unpack(HEADER, data)
+            if magic != MAGIC or version != VERSION:
+                return None
+            chunk = bytearray(256)
+            running = 0
+            left = length
+            while left:
+                n = f.readinto(chunk)
+                if not n:
+                    return None
+                n = min(n, left)
+                running = crc32(memoryview(chunk)[:n], running)
+                left -= n
+            if crc32(struct.pack("<Ii", seq, data_s), running) != crc:
+                return None
+            return seq, data_s, running
+
+    def restore(self):
+        # Loads the newest valid copy into the registered objects and
+        # globals. Objects whose SNAPSHOT_KEY or buffer sizes no longer
+        # match (configuration changed) are left as they are. Returns the
+        # snapshot's data time, or None if there was no valid copy.
+        best = None
+        for path in self.paths:
+            found = self._check(path)
+            if found is not None and (best is None or found[0] > best[1]):
+                best = (path,) + found
+        if best is None:
+            return None
+        path, seq, data_s, payload_crc = best
+        objects = dict(self.objects)
+        with open(path, "rb") as f:
+            f.seek(HEADER_SIZE)
+            while True:
+                data = f.read(RECORD_SIZE)
+                if len(data) < RECORD_SIZE:
+                    break
+                meta_len, size = struct.unpack(RECORD, data)
+                meta = json.loads(f.read(meta_len).decode())
+                name = meta["n"]
+                fields = meta["f"]
+                if name == "globals":
+                    if self.set_globals is not None:
+                        self.set_globals(fields)
+                    continue
+                obj = objects.get(name)
+                if obj is None or not self._compatible(obj, meta):
+                    f.seek(size, 1)
+                    continue
+                for attr in getattr(obj, "SNAPSHOT_BUFFERS", ()):
+                    f.readinto(getattr(obj, attr))
+                for attr in getattr(obj, "SNAPSHOT_FIELDS", ()):
+                    if attr in fields:
+                        setattr(obj, attr, fields[attr])
+        self.seq = seq
+        self.restored = (path, seq, data_s)
+        self._last_crc = payload_crc
+        return data_s
+
+    def _compatible(self, obj, meta):
+        fields = meta["f"]
+        for attr in getattr(obj, "SNAPSHOT_KEY", ()):
+            if fields.get(attr) != getattr(obj, attr):
+                return False
+        buffers = [getattr(obj, attr) for attr in getattr(obj, "SNAPSHOT_BUFFERS", ())]
+        sizes = [_nbytes(buf) for buf in buffers]
+        return sizes == meta.get("b", [])
+
+
+def _buffers_size(buffers):
+    size = 0
+    for buf in buffers:
+        size += _nbytes(buf)
+    return size
+
+
+def _nbytes(buf):
+    # Size in bytes of an array or bytearray
+    view = memoryview(buf)
+    try:
+        return view.nbytes
+    except AttributeError:
+        # MicroPython memoryviews have no nbytes
+        return len(view) * view.itemsize
@@ -0,0 +1,96 @@
+# Fields of the shared State, in bit order. Each field has its own dirty bit
+# (BITS[name]) so consumers can subscribe to exactly the inputs they use.
+FIELDS = (
+    "last_temp",        # last committed temperature (C)
+    "last_hum",         # last committed humidity (%)
+    "last_read_ms",     # monotonic time of the last commit
+    "sensor_source",    # "sensor" | "override" | "unknown"
+    "override_temp",
+    "override_hum",
+    "uptime_offset_s",  # uptime override, as an offset so it keeps counting
+    "min_temp",         # since-boot min/max
+    "max_temp",
+    "min_hum",
+    "max_hum",
+    "summary_minmax",   # (temp_min, temp_max, hum_min, hum_max) of the page-1 window, fixed point
+    "ping_results",     # ping results recorded (changes when the ping stats may)
+)
+BITS = {}
+for _i, _name in enumerate(FIELDS):
+    BITS[_name] = 1 << _i
+ALL_BITS = (1 << len(FIELDS)) - 1
+
+# Fields carried across reboots by the state snapshot (the rest are
+# recomputed or tied to this boot's clock)
+PERSISTED = (
+    "last_temp", "last_hum", "sensor_source",
+    "override_temp", "override_hum", "uptime_offset_s",
+    "min_temp", "max_temp", "min_hum", "max_hum",
+)
+
+
+class State:
+
+    # Primary and derived device state in one slotted object.
+    #
+    # Writers go through set(), which only records a change (the field's bit
+    # in pending) when the value actually differs. publish() then hands the
+    # changed bits to every subscriber whose mask overlaps them, once per
+    # batch of writes (e.g. once per commit_reading()), so outputs only do
+    # work when their inputs changed.
+    #
+    # MicroPython ignores __slots__; under CPython (tools/simulate.py) it
+    # turns a misspelt field into an error.
+
+    __slots__ = FIELDS + ("pending", "_subscribers")
+
+    def __init__(self):
+        self.last_temp = None
+        self.last_hum = None
+        self.last_read_ms = 0
+        self.sensor_source = "unknown"
+        self.override_temp = None
+        self.override_hum = None
+        self.uptime_offset_s = 0
+        self.min_temp = None
+        self.max_temp = None
+        self.min_hum = None
+        self.max_hum = None
+        self.summary_minmax = (None, None, None, None)
+        self.ping_results = 0
+        self.pending = 0  # nothing has been written yet; a commit sets last_read_ms
+        self._subscribers = []
+
+    def set(self, name, value):
+        # Returns True if the field changed. The type counts too: 20 -> 20.0
+        # changes how the value is shown.
+        old = getattr(self, name)
+        if type(old) is type(value) and old == value:
+            return False
+        setattr(self, name, value)
+        self.pending |= BITS[name]
+        return True
+
+    def subscribe(self, mask, callback):
+        # callback(bits) runs from publish() with the changed bits in mask
+        self._subscribers.append((mask, callback))
+
+    def publish(self):
+        # Delivers pending changes to subscribers. Returns the bits delivered.
+        bits = self.pending
+        if not bits:
+            return 0
+        self.pending = 0
+        for mask, callback in self._subscribers:
+            if bits & mask:
+                callback(bits & mask)
+        return bits
+
+    def values(self):
+        # PERSISTED fields as a dict (for the snapshot)
+        return {name: getattr(self, name) for name in PERSISTED}
+
+    def restore(self, values):
+        for name in PERSISTED:
+            if name in values:
+                self.set(name, values[name])
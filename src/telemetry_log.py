@@ -0,0 +1,371 @@
+import os
+import struct
+
+# Segment header: magic, format version, log2(page bytes), boot number,
+# segment number
+MAGIC = b"PLOG"
+VERSION = 2
+HEADER = "<4sBBHI"
+HEADER_SIZE = struct.calcsize(HEADER)
+
+# Size of the fixed record of format version 1, kept for size comparisons:
+# seconds since boot, temp, hum, source ("<IhhB")
+V1_RECORD_SIZE = 9
+
+# Record head byte. Records after the first in a page are deltas against the
+# previous record; fields that did not change are left out.
+HEAD_KEY = 0x80       # keyframe: absolute time and values follow
+HEAD_TEMP = 0x40      # temp follows (zigzag varint)
+HEAD_HUM = 0x20       # hum follows (zigzag varint)
+HEAD_SOURCE_SHIFT = 3  # 2-bit source code
+HEAD_DT_MASK = 0x07   # delta time 0..6 inline; HEAD_DT_VARINT = varint follows
+HEAD_DT_VARINT = 7
+PAD = 0x00            # fills the rest of a page; never a valid head
+
+# Marks a missing value (same as history.MISSING)
+MISSING = -32768
+
+# Reading sources as stored in records
+SOURCES = ("unknown", "sensor", "override")
+
+
+def source_code(source):
+    return SOURCES.index(source) if source in SOURCES else 0
+
+
+def segment_name(segment):
+    return f"seg{segment:08d}.bin"
+
+
+def _put_varint(buf, pos, end, value):
+    # Writes an unsigned LEB128 varint; returns the new position, or -1 if
+    # it does not fit before end
+    while True:
+        if pos >= end:
+            return -1
+        if value < 0x80:
+            buf[pos] = value
+            return pos + 1
+        buf[pos] = (value & 0x7f) | 0x80
+        value >>= 7
+        pos += 1
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def encode_record(buf, pos, end, key, t_s, temp, hum, source, prev_t_s, prev_temp, prev_hum):
+    # Encodes one record at buf[pos:end]. A keyframe stores absolute time and
+    # values; otherwise time is a delta and values are deltas left out when
+    # zero. Returns the end position, or -1 if the record does not fit.
+    if key:
+        dt = t_s
+        d_temp = temp
+        d_hum = hum
+    else:
+        dt = t_s - prev_t_s
+        d_temp = temp - prev_temp
+        d_hum = hum - prev_hum
+    head = source << HEAD_SOURCE_SHIFT
+    if key:
+        head |= HEAD_KEY | HEAD_DT_VARINT
+    elif dt < HEAD_DT_VARINT:
+        head |= dt
+    else:
+        head |= HEAD_DT_VARINT
+    if key or d_temp:
+        head |= HEAD_TEMP
+    if key or d_hum:
+        head |= HEAD_HUM
+    if head == PAD or pos >= end:
+        return -1
+    buf[pos] = head
+    pos += 1
+    if head & HEAD_DT_MASK == HEAD_DT_VARINT:
+        pos = _put_varint(buf, pos, end, dt)
+    if pos >= 0 and head & HEAD_TEMP:
+        pos = _put_varint(buf, pos, end, _zigzag(d_temp))
+    if pos >= 0 and head & HEAD_HUM:
+        pos = _put_varint(buf, pos, end, _zigzag(d_hum))
+    return pos
+
+
+def decode_page(buf, length):
+    # Yields (t_s, temp_fixed, hum_fixed, source) from one page. Stops at
+    # padding, at the end of the data, or at a record cut short.
+    pos = 0
+    t_s = temp = hum = 0
+    while pos < length:
+        head = buf[pos]
+        if head == PAD:
+            return
+        pos += 1
+        fields = [head & HEAD_DT_MASK, 0, 0]
+        wanted = (head & HEAD_DT_MASK == HEAD_DT_VARINT, head & HEAD_TEMP, head & HEAD_HUM)
+        for i in range(3):
+            if not wanted[i]:
+                continue
+            value = 0
+            shift = 0
+            while True:
+                if pos >= length:
+                    return
+                byte = buf[pos]
+                pos += 1
+                value |= (byte & 0x7f) << shift
+                shift += 7
+                if not byte & 0x80:
+                    break
+            fields[i] = value
+        if head & HEAD_KEY:
+            t_s = fields[0]
+            temp = _unzigzag(fields[1])
+            hum = _unzigzag(fields[2])
+        else:
+            t_s += fields[0]
+            temp += _unzigzag(fields[1])
+            hum += _unzigzag(fields[2])
+        yield t_s, temp, hum, (head >> HEAD_SOURCE_SHIFT) & 0x03
+
+
+def read_header(f):
+    # (boot, segment, page_bytes) from an open segment file, or None
+    data = f.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE:
+        return None
+    magic, version, page_shift, boot, segment = struct.unpack(HEADER, data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    return boot, segment, 1 << page_shift
+
+
+def read_segment(f, page, since_s=None):
+    # Yields (t_s, temp_fixed, hum_fixed, source) from an open segment file
+    # positioned after its header, decoding one page at a time into page (a
+    # bytearray of the segment's page size). With since_s, pages that end
+    # before it are skipped by binary search on their keyframe times.
+    page_bytes = len(page)
+    start = 0
+    if since_s is not None:
+        lo = 0
+        hi = (f.seek(0, 2) - HEADER_SIZE) // page_bytes
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            f.seek(HEADER_SIZE + mid * page_bytes)
+            n = f.readinto(page)
+            first = next(decode_page(page, n or 0), None)
+            if first is not None and first[0] <= since_s:
+                lo = mid
+            else:
+                hi = mid - 1
+        start = lo
+    f.seek(HEADER_SIZE + start * page_bytes)
+    while True:
+        n = f.readinto(page)
+        if not n:
+            return
+        for record in decode_page(page, n):
+            if since_s is None or record[0] >= since_s:
+                yield record
+        if n < page_bytes:
+            return
+
+
+class TelemetryLog:
+
+    # Append-only binary log of committed readings on the device filesystem.
+    #
+    # append() only encodes a record into a RAM page. Flash is written when
+    # the page fills (or when flush() is called; a partly written page keeps
+    # filling and only its new bytes are written next time), so the flash
+    # sees page-sized writes rather than one small write per reading.
+    # Segment files hold at most segment_bytes; when one is full the next is
+    # started and the oldest beyond max_segments is deleted, so the log has a
+    # fixed footprint and wear is spread across the segments.
+    #
+    # Records are delta-encoded zigzag varints (see encode_record): a slowly
+    # changing reading costs 2 bytes instead of 9. Every page starts with a
+    # keyframe, so each page decodes on its own and readers can seek by page.
+    #
+    # Every boot starts a new segment whose header carries a boot number, so
+    # the seconds-since-boot timestamps stay unambiguous across reboots (an
+    # empty segment left by a boot that logged nothing is reused). A record
+    # cut short by power loss is ignored on read.
+
+    def __init__(self, directory="log", page_bytes=256, segment_bytes=16384, max_segments=16):
+        self.directory = directory
+        self.max_segments = max_segments
+        page_shift = 6
+        while (1 << (page_shift + 1)) <= page_bytes:
+            page_shift += 1
+        self.page_shift = page_shift
+        self.page_bytes = 1 << page_shift
+        self.segment_pages = max(1, (segment_bytes - HEADER_SIZE) // self.page_bytes)
+        self._page = bytearray(self.page_bytes)
+        self._used = 0        # bytes encoded into the page
+        self._written = 0     # bytes of the page already on flash
+        self._records = 0     # records in the page
+        self._records_written = 0
+        self._since_s = None  # time of the page's oldest unwritten record
+        self._prev = [0, 0, 0]  # t_s, temp, hum of the last record
+        self.flushes = 0
+        self.flushed_bytes = 0
+        self.records_logged = 0
+        self.errors = 0
+        try:
+            os.mkdir(directory)
+        except OSError:
+            pass
+        segments = self.segments()
+        self.boot = 0
+        for segment in reversed(segments):
+            header = self._header(segment)
+            if header is not None:
+                self.boot = (header[0] + 1) & 0xffff
+                break
+        self._segment = segments[-1] if segments else -1
+        self._segment_used = self.segment_pages  # forces a new segment on first flush
+        try:
+            # Claim this boot's number on flash now; a reboot before the
+            # first flush would otherwise reuse it. A last segment with no
+            # records (the previous boot logged nothing) is taken over rather
+            # than adding another, so a reset loop cannot push out the log.
+            if segments and os.stat(self._path(self._segment))[6] <= HEADER_SIZE:
+                self._write_header()
+            else:
+                self._start_segment()
+        except OSError:
+            self.errors += 1
+
+    def _path(self, segment):
+        return self.directory + "/" + segment_name(segment)
+
+    def segments(self):
+        # Segment numbers on flash, oldest first
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith("seg") and name.endswith(".bin"):
+                try:
+                    segments.append(int(name[3:-4]))
+                except ValueError:
+                    pass
+        segments.sort()
+        return segments
+
+    def _header(self, segment):
+        try:
+            with open(self._path(segment), "rb") as f:
+                return read_header(f)
+        except OSError:
+            return None
+
+    def append(self, t_s, temp_fixed, hum_fixed, source):
+        # Encodes one record into the page; writes the page out once full
+        prev = self._prev
+        code = source_code(source)
+        end = encode_record(self._page, self._used, self.page_bytes, self._used == 0,
+                            t_s, temp_fixed, hum_fixed, code, prev[0], prev[1], prev[2])
+        if end < 0:
+            # Page full (or the record would look like padding): pad the page,
+            # write it out and start the next one with a keyframe
+            for i in range(self._used, self.page_bytes):
+                self._page[i] = PAD
+            self._used = self.page_bytes
+            self.flush()
+            end = encode_record(self._page, 0, self.page_bytes, True,
+                                t_s, temp_fixed, hum_fixed, code, 0, 0, 0)
+        if self._since_s is None:
+            self._since_s = t_s
+        self._used = end
+        self._records += 1
+        self.records_logged += 1
+        prev[0] = t_s
+        prev[1] = temp_fixed
+        prev[2] = hum_fixed
+
+    def buffered(self):
+        # Bytes encoded but not yet on flash
+        return self._used - self._written
+
+    def buffered_since(self):
+        # Timestamp of the oldest record not yet on flash, or None
+        return self._since_s
+
+    def flush(self):
+        # Writes the unwritten part of the page to the current segment,
+        # starting a new segment at a page boundary where the current one is
+        # full. Returns bytes written.
+        count = self._used - self._written
+        if count:
+            try:
+                if self._written == 0 and self._segment_used >= self.segment_pages:
+                    self._start_segment()
+                with open(self._path(self._segment), "ab") as f:
+                    f.write(memoryview(self._page)[self._written:self._used])
+                self.flushes += 1
+                self.flushed_bytes += count
+            except OSError:
+                # Flash full or failing: drop the page rather than grow RAM.
+                # Part of it may already be on flash, leaving that page short,
+                # so continue in a new segment to keep pages aligned.
+                self.errors += 1
+                self._used = self.page_bytes
+                self._segment_used = self.segment_pages
+            self._written = self._used
+            self._records_written = self._records
+            self._since_s = None
+        if self._used >= self.page_bytes:
+            self._segment_used += 1
+            self._used = 0
+            self._written = 0
+            self._records = 0
+            self._records_written = 0
+        return count
+
+    def _start_segment(self):
+        self._segment += 1
+        self._write_header()
+        segments = self.segments()
+        for segment in segments[:max(0, len(segments) - self.max_segments)]:
+            try:
+                os.remove(self._path(segment))
+            except OSError:
+                pass
+
+    def _write_header(self):
+        with open(self._path(self._segment), "wb") as f:
+            f.write(struct.pack(HEADER, MAGIC, VERSION, self.page_shift, self.boot, self._segment))
+        self._segment_used = 0
+
+    def records(self, boot=None, since_s=None):
+        # Yields (boot, t_s, temp_fixed, hum_fixed, source) oldest first,
+        # from flash and then the RAM page, one page at a time, so a segment
+        # is never loaded whole. boot limits the output to one boot and
+        # since_s skips older records (seeking by page keyframes).
+        page = None
+        for segment in self.segments():
+            try:
+                f = open(self._path(segment), "rb")
+            except OSError:
+                continue
+            with f:
+                header = read_header(f)
+                if header is None or (boot is not None and header[0] != boot):
+                    continue
+                if page is None or len(page) != header[2]:
+                    page = bytearray(header[2])
+                for record in read_segment(f, page, since_s):
+                    yield (header[0],) + record
+        if boot is None or boot == self.boot:
+            # Records in the written part of the page came from flash above
+            skip = self._records_written
+            for record in decode_page(self._page, self._used):
+                if skip:
+                    skip -= 1
+                elif since_s is None or record[0] >= since_s:
+                    yield (self.boot,) + record
@@ -0,0 +1,95 @@
+import struct
+
+from snapshot import crc32
+
+# Frame: marker, format version, boot number, sequence number, data time
+# (seconds), temp and hum (fixed point, MISSING when unknown), source code,
+# then CRC-32 of everything after the marker. Little-endian, 22 bytes.
+SYNC = b"\xa5\x5a"
+VERSION = 1
+FRAME = "<2sBHIIhhB"
+BODY_SIZE = struct.calcsize(FRAME)
+FRAME_SIZE = BODY_SIZE + 4
+
+# Marks a missing value (same as history.MISSING)
+MISSING = -32768
+
+# A sequence number this close below 2**32 followed by one this close above 0
+# is a wrap-around; any other backwards step is a resync
+SEQ_WRAP_WINDOW = 1 << 16
+
+
+def pack_frame(buf, boot, seq, t_s, temp_fixed, hum_fixed, source):
+    # Encodes one frame into buf (a bytearray of FRAME_SIZE) in place
+    struct.pack_into(FRAME, buf, 0, SYNC, VERSION, boot, seq, t_s, temp_fixed, hum_fixed, source)
+    struct.pack_into("<I", buf, BODY_SIZE, crc32(memoryview(buf)[2:BODY_SIZE]))
+
+
+class FrameDecoder:
+
+    # Incremental decoder for one device's serial byte stream.
+    #
+    # The stream may mix frames with text (boot messages, command replies)
+    # and may start mid-frame. feed() scans for the marker and only accepts a
+    # frame whose version and CRC check out; anything else is skipped one
+    # byte at a time, so a corrupted or truncated frame costs at most that
+    # frame. Sequence gaps (frames lost on the wire or dropped by the
+    # device), reboots (boot number changes) and resyncs (the sequence going
+    # backwards within a boot) are counted.
+
+    def __init__(self):
+        self._buf = bytearray()
+        self.frames = 0
+        self.crc_errors = 0
+        self.skipped = 0   # bytes that were not part of a valid frame
+        self.lost = 0      # frames missing from the sequence
+        self.reboots = 0
+        self.resets = 0    # sequence restarted without a boot change
+        self._last = None  # (boot, seq) of the previous frame
+
+    def feed(self, data):
+        # Buffers data and returns [(boot, seq, t_s, temp_fixed, hum_fixed,
+        # source)] for every frame completed by it. A plain method rather than
+        # a generator, so the data is taken even if the result is not used.
+        frames = []
+        buf = self._buf
+        buf += data
+        pos = 0
+        while True:
+            start = buf.find(SYNC, pos)
+            if start < 0:
+                # Keep a trailing marker byte, it may start the next frame
+                keep = 1 if buf[-1:] == SYNC[:1] else 0
+                self.skipped += len(buf) - pos - keep
+                pos = len(buf) - keep
+                break
+            self.skipped += start - pos
+            if len(buf) - start < FRAME_SIZE:
+                pos = start
+                break
+            crc = struct.unpack_from("<I", buf, start + BODY_SIZE)[0]
+            fields = struct.unpack_from(FRAME, buf, start)
+            if fields[1] != VERSION or crc32(memoryview(buf)[start + 2:start + BODY_SIZE]) != crc:
+                if fields[1] == VERSION:
+                    self.crc_errors += 1
+                self.skipped += 1
+                pos = start + 1
+                continue
+            pos = start + FRAME_SIZE
+            boot, seq = fields[2], fields[3]
+            if self._last is not None:
+                if boot != self._last[0]:
+                    self.reboots += 1
+                else:
+                    last = self._last[1]
+                    if seq > last:
+                        self.lost += seq - last - 1
+                    elif last >= 0x100000000 - SEQ_WRAP_WINDOW and seq < SEQ_WRAP_WINDOW:
+                        self.lost += (seq - last - 1) & 0xffffffff
+                    else:
+                        self.resets += 1
+            self._last = (boot, seq)
+            self.frames += 1
+            frames.append(fields[2:])
+        del buf[:pos]
+        return frames
@@ -0,0 +1,113 @@
+# Link states
+DOWN = 0        # not connected; next attempt after the backoff
+CONNECTING = 1  # connect() issued, waiting for the link or the timeout
+UP = 2
+STATE_NAMES = ("down", "connecting", "up")
+
+
+class WifiLink:
+
+    # Non-blocking Wi-Fi bring-up and reconnect for network.WLAN.
+    #
+    # poll() advances a small state machine and returns the monotonic time
+    # (ms) it next needs to run; it never sleeps or waits on the radio. An
+    # attempt that has not come up within connect_timeout_ms, or that the
+    # driver reports as failed (negative status: wrong password, no AP), is
+    # abandoned and retried after a backoff that doubles from backoff_min_ms
+    # to backoff_max_ms. A successful connect resets the backoff; a dropped
+    # link is retried after backoff_min_ms.
+
+    def __init__(self, wlan, ssid, password, connect_timeout_ms=15000,
+                 backoff_min_ms=2000, backoff_max_ms=300000, poll_ms=250, check_ms=10000):
+        self.wlan = wlan
+        self.ssid = ssid
+        self.password = password
+        self.connect_timeout_ms = connect_timeout_ms
+        self.backoff_min_ms = backoff_min_ms
+        self.backoff_max_ms = backoff_max_ms
+        self.poll_ms = poll_ms
+        self.check_ms = check_ms
+        self.state = DOWN
+        self.backoff_ms = 0        # the first attempt goes out at once
+        self.attempts = 0
+        self.connects = 0
+        self.failures = 0          # attempts that timed out or failed
+        self.drops = 0             # established links that went down
+        self.last_status = None    # driver status of the last failed attempt
+        self.rssi = None           # link quality while up (dBm)
+        self.rssi_min = None
+        self.rssi_max = None
+        self.up_since_ms = None
+        self._due_ms = None        # next attempt (DOWN) or timeout (CONNECTING)
+
+    def poll(self, now_ms):
+        if self._due_ms is None:
+            self._due_ms = now_ms + self.backoff_ms
+        connected = self.wlan.isconnected()
+        if self.state == UP:
+            if connected:
+                self._sample_rssi()
+                return now_ms + self.check_ms
+            self.drops += 1
+            self._down(now_ms, self.backoff_min_ms)
+        elif self.state == CONNECTING:
+            if connected:
+                self.state = UP
+                self.connects += 1
+                self.backoff_ms = 0
+                self.up_since_ms = now_ms
+                self._sample_rssi()
+                return now_ms + self.check_ms
+            status = self._status()
+            if (status is not None and status < 0) or now_ms >= self._due_ms:
+                self.failures += 1
+                self.last_status = status
+                try:
+                    self.wlan.disconnect()
+                except OSError:
+                    pass
+                backoff = self.backoff_ms * 2 if self.backoff_ms else self.backoff_min_ms
+                self._down(now_ms, min(backoff, self.backoff_max_ms))
+            else:
+                return min(now_ms + self.poll_ms, self._due_ms)
+        elif connected:
+            # Came up on its own (e.g. the driver reconnected)
+            self.state = CONNECTING
+            return self.poll(now_ms)
+        if now_ms < self._due_ms:
+            return self._due_ms
+        self.state = CONNECTING
+        self.attempts += 1
+        self._due_ms = now_ms + self.connect_timeout_ms
+        try:
+            self.wlan.connect(self.ssid, self.password)
+        except OSError:
+            pass  # shows up as a timeout
+        return now_ms + self.poll_ms
+
+    def _down(self, now_ms, backoff_ms):
+        self.state = DOWN
+        self.backoff_ms = backoff_ms
+        self.up_since_ms = None
+        self.rssi = None
+        self._due_ms = now_ms + backoff_ms
+
+    def _status(self):
+        try:
+            return self.wlan.status()
+        except (OSError, TypeError, ValueError):
+            return None
+
+    def _sample_rssi(self):
+        try:
+            rssi = self.wlan.status("rssi")
+        except (OSError, TypeError, ValueError):
+            return
+        self.rssi = rssi
+        if self.rssi_min is None or rssi < self.rssi_min:
+            self.rssi_min = rssi
+        if self.rssi_max is None or rssi > self.rssi_max:
+            self.rssi_max = rssi
+
+    def state_name(self):
+        return STATE_NAMES[self.state]
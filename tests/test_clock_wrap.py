@@ -0,0 +1,78 @@
+"""
+main.py's monotonic clock across utime.ticks_ms() wraps (every 2**30 ms).
+
+Boots src/main.py in the simulator (tools/simulate.py) with ticks_ms()
+starting just before a wrap, then drives the virtual clock by hand and checks
+that monotonic_ms(), uptime and deadlines taken from the clock stay in step
+with virtual time. Runs on CPython only:
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+TOOLS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+sys.path.insert(0, TOOLS_DIR)
+
+import simulate  # noqa: E402
+
+DAY_MS = 86400 * 1000
+
+
+@pytest.fixture
+def device(tmp_path):
+    # (main.py's globals, virtual clock) after a 1 s boot that ends 5 s
+    # before ticks_ms() wraps
+    args = simulate.parse_args(["--seconds", "1", "--no-net", "--fs", str(tmp_path),
+                                "--ticks-start", str(simulate.TICKS_PERIOD - 6000)])
+    sim = simulate.Simulation(args)
+    assert sim.run(), sim.error
+    return sim.module.__dict__, sim.clock
+
+
+def step_through(device, step_ms, total_ms):
+    # Advances the virtual clock step_ms at a time, reading the clock after
+    # each step; returns [(virtual ms, monotonic_ms(), uptime_seconds())]
+    main, clock = device
+    samples = []
+    elapsed = 0
+    while elapsed < total_ms:
+        clock.advance_us(step_ms * 1000)
+        elapsed += step_ms
+        samples.append((clock.us // 1000, main["monotonic_ms"](), main["uptime_seconds"]()))
+    return samples
+
+
+def test_monotonic_ms_tracks_virtual_time_across_a_wrap(device):
+    main, clock = device
+    base = clock.us // 1000 - main["monotonic_ms"]()
+    samples = step_through(device, 7, 20000)
+    assert clock.ticks_ms() < 20000  # the wrap was crossed
+    last_ms = last_s = -1
+    for virtual_ms, mono_ms, uptime_s in samples:
+        assert mono_ms == virtual_ms - base
+        assert mono_ms > last_ms
+        assert uptime_s >= last_s
+        last_ms, last_s = mono_ms, uptime_s
+
+
+def test_monotonic_ms_survives_many_wraps_with_sparse_reads(device):
+    # Reads five days apart (just under the half-wrap limit of ~6.2 days)
+    main, clock = device
+    base = clock.us // 1000 - main["monotonic_ms"]()
+    samples = step_through(device, 5 * DAY_MS, 60 * DAY_MS)
+    assert (clock.ticks_start_ms + clock.us // 1000) // simulate.TICKS_PERIOD >= 4
+    for virtual_ms, mono_ms, uptime_s in samples:
+        assert mono_ms == virtual_ms - base
+        assert uptime_s == mono_ms // 1000
+
+
+def test_deadline_set_before_a_wrap_falls_due_after_it(device):
+    main, clock = device
+    deadline = main["monotonic_ms"]() + 10000
+    clock.advance_us(9999 * 1000)
+    assert main["monotonic_ms"]() < deadline
+    clock.advance_us(1000)
+    assert main["monotonic_ms"]() >= deadline
@@ -0,0 +1,188 @@
+"""
+Decodes the device telemetry log (src/telemetry_log.py) on the host and
+exports it as CSV or as columnar binary files.
+
+Copy the log/ directory off the Pico (e.g. `mpremote cp -r :log .`) or point
+the tool at a simulator filesystem (tools/simulate.py --fs DIR):
+
+    python tools/decode_log.py log/ > readings.csv
+    python tools/decode_log.py log/ --boot 3 --since 3600 --out boot3.csv
+    python tools/decode_log.py log/ --format columns --out readings/
+    python tools/decode_log.py log/ --stats
+
+Segments are decoded one page at a time with the device's own decoder, so
+logs of any size stream through in constant memory.
+
+CSV columns: boot, t_s (seconds since that boot), temp and hum (blank when
+the sensor had no value) and source.
+
+Columnar output writes one little-endian array per column (boot.u16,
+t_s.u32, temp.i16, hum.i16, source.u8; temp/hum in tenths, -32768 when
+missing) plus columns.json describing them, ready for numpy.fromfile() or
+similar.
+"""
+import argparse
+import array
+import json
+import os
+import sys
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.normpath(os.path.join(TOOLS_DIR, "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import telemetry_log  # noqa: E402
+
+# name, array typecode, file suffix
+COLUMNS = (
+    ("boot", "H", "u16"),
+    ("t_s", "I", "u32"),
+    ("temp", "h", "i16"),
+    ("hum", "h", "i16"),
+    ("source", "B", "u8"),
+)
+COLUMN_CHUNK = 4096
+
+
+def segment_files(paths):
+    # Expands directories to their segment files, ordered by segment number
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(name for name in os.listdir(path) if name.startswith("seg") and name.endswith(".bin"))
+            files += [os.path.join(path, name) for name in names]
+        else:
+            files.append(path)
+    return files
+
+
+def read_records(files, boot=None, since_s=None, skipped=None):
+    # Yields (boot, t_s, temp, hum, source) from the segment files in order
+    page = None
+    for path in files:
+        with open(path, "rb") as f:
+            header = telemetry_log.read_header(f)
+            if header is None:
+                if skipped is not None:
+                    skipped.append(path)
+                continue
+            if boot is not None and header[0] != boot:
+                continue
+            if page is None or len(page) != header[2]:
+                page = bytearray(header[2])
+            for record in telemetry_log.read_segment(f, page, since_s):
+                yield (header[0],) + record
+
+
+def fmt_fixed(value):
+    if value == telemetry_log.MISSING:
+        return ""
+    return f"{value / 10:.1f}"
+
+
+def csv_line(record):
+    boot, t_s, temp, hum, source = record
+    return f"{boot},{t_s},{fmt_fixed(temp)},{fmt_fixed(hum)},{telemetry_log.SOURCES[source]}\n"
+
+
+def write_csv(records, out):
+    out.write("boot,t_s,temp,hum,source\n")
+    count = 0
+    for record in records:
+        out.write(csv_line(record))
+        count += 1
+    return count
+
+
+def write_columns(records, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    files = [open(os.path.join(out_dir, f"{name}.{suffix}"), "wb") for name, _, suffix in COLUMNS]
+    chunks = [array.array(code) for _, code, _ in COLUMNS]
+    count = 0
+    try:
+        for record in records:
+            for chunk, value in zip(chunks, record):
+                chunk.append(value)
+            count += 1
+            if len(chunks[0]) >= COLUMN_CHUNK:
+                for f, chunk in zip(files, chunks):
+                    _write_chunk(f, chunk)
+        for f, chunk in zip(files, chunks):
+            _write_chunk(f, chunk)
+    finally:
+        for f in files:
+            f.close()
+    schema = {
+        "rows": count,
+        "columns": [{"name": name, "file": f"{name}.{suffix}", "type": suffix, "byteorder": "little"}
+                    for name, _, suffix in COLUMNS],
+        "scale": {"temp": 10, "hum": 10},
+        "missing": telemetry_log.MISSING,
+        "sources": list(telemetry_log.SOURCES),
+    }
+    with open(os.path.join(out_dir, "columns.json"), "w") as f:
+        json.dump(schema, f, indent=2)
+    return count
+
+
+def _write_chunk(f, chunk):
+    if sys.byteorder != "little":
+        chunk.byteswap()
+    chunk.tofile(f)
+    del chunk[:]
+
+
+def print_stats(files, records, out):
+    # Compares the encoded size with the version-1 fixed records and CSV
+    count = 0
+    csv_bytes = 0
+    boots = set()
+    for record in records:
+        count += 1
+        csv_bytes += len(csv_line(record))
+        boots.add(record[0])
+    log_bytes = sum(os.path.getsize(path) for path in files)
+    fixed_bytes = count * telemetry_log.V1_RECORD_SIZE
+    out.write(f"segments      {len(files)}\n")
+    out.write(f"boots         {len(boots)}\n")
+    out.write(f"records       {count}\n")
+    if not count:
+        return
+    out.write(f"log bytes     {log_bytes} ({log_bytes / count:.2f} per record, incl. headers and padding)\n")
+    out.write(f"v1 fixed      {fixed_bytes} ({fixed_bytes / log_bytes:.1f}x larger)\n")
+    out.write(f"csv           {csv_bytes} ({csv_bytes / log_bytes:.1f}x larger)\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode PulsPI telemetry log segments")
+    parser.add_argument("paths", nargs="+", help="log directories or segment files")
+    parser.add_argument("--format", choices=("csv", "columns"), default="csv")
+    parser.add_argument("--out", help="output file (csv, default stdout) or directory (columns)")
+    parser.add_argument("--boot", type=int, help="only this boot number")
+    parser.add_argument("--since", type=int, metavar="SECONDS", help="only records at or after this time since boot")
+    parser.add_argument("--stats", action="store_true", help="print size statistics instead of exporting")
+    args = parser.parse_args(argv)
+
+    files = segment_files(args.paths)
+    skipped = []
+    records = read_records(files, args.boot, args.since, skipped)
+    if args.stats:
+        print_stats(files, records, sys.stdout)
+    elif args.format == "columns":
+        if not args.out:
+            parser.error("--format columns needs --out DIR")
+        count = write_columns(records, args.out)
+        print(f"{count} records -> {args.out}", file=sys.stderr)
+    elif args.out:
+        with open(args.out, "w") as out:
+            count = write_csv(records, out)
+        print(f"{count} records -> {args.out}", file=sys.stderr)
+    else:
+        write_csv(records, sys.stdout)
+    for path in skipped:
+        print(f"skipped {path}: not a version {telemetry_log.VERSION} segment", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
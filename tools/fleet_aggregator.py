@@ -0,0 +1,520 @@
+"""
+Collects readings from many PulsPI boards at once and answers fleet-wide
+queries (hottest devices, stale devices, min/max per zone) from memory.
+
+    python tools/fleet_aggregator.py --udp 9310 --query 9300
+    python tools/fleet_aggregator.py --serial /dev/ttyACM0 /dev/ttyACM1 --zones zones.csv
+    python tools/fleet_loadgen.py --devices 1000 --port 9310    # simulated fleet
+
+Inputs (any mix, all on one asyncio loop):
+
+* UDP datagrams holding JSON (a `"type":"reading"` line from `format json
+  commits`, or an MQTT publisher batch `{"device":...,"readings":[...]}`) or
+  binary telemetry frames (src/telemetry_stream.py). JSON names its device;
+  frames are keyed by the sender's address.
+* Serial ports (or capture files) carrying the binary stream or JSON lines;
+  the device is the port's file name.
+
+Each device keeps a ring of per-interval averages (history.History) and
+minute/hour/day rollups (history.Rollups), the same structures the board
+uses. Fleet queries do not scan the fleet: current temperatures are kept in
+heap indexes (fleet-wide and per zone) and devices in last-heard order, so
+"hottest 10" costs O(10 log n) and "stale" only visits stale devices.
+
+Queries are lines sent to the --query TCP port (e.g. `nc localhost 9300`);
+each answer is one JSON line:
+
+    hottest [N]            coldest [N]
+    stale [SECONDS]        zones
+    zone NAME              device NAME [SPAN]     (SPAN like 15m, 1h, 1d)
+    stats                  help
+
+A device's zone comes from --zones (CSV rows "device,zone"), else from its
+name up to the first "-" (e.g. "lab-07" is in zone "lab").
+"""
+import argparse
+import asyncio
+import collections
+import heapq
+import json
+import os
+import socket
+import sys
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.normpath(os.path.join(TOOLS_DIR, "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import telemetry_log  # noqa: E402
+import telemetry_stream  # noqa: E402
+from history import History, Rollups, MISSING, SCALE  # noqa: E402
+
+JSON_SCHEMA = 1
+ROLLUP_LEVELS = ((60, 120), (3600, 168), (86400, 31))
+READ_CHUNK = 4096
+UDP_RCVBUF = 4 * 1024 * 1024  # absorbs bursts while a query is being answered (capped by the kernel)
+SPAN_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+REBOOT_JUMP_S = 300  # data time stepping back further than this means the device rebooted
+
+
+def from_fixed(value):
+    return None if value == MISSING else value / SCALE
+
+
+def parse_span(text):
+    if text[-1] in SPAN_UNITS:
+        return int(text[:-1]) * SPAN_UNITS[text[-1]]
+    return int(text)
+
+
+class ExtremaIndex:
+
+    # Current value per key, with the largest and smallest found without a
+    # scan. Updates push onto a max-heap and a min-heap; entries that no
+    # longer match the key's current value are discarded lazily when they
+    # surface, and the heaps are rebuilt once stale entries outnumber live
+    # ones.
+
+    def __init__(self):
+        self.values = {}
+        self._max = []
+        self._min = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def update(self, key, value):
+        if value is None:
+            self.values.pop(key, None)
+            return
+        if self.values.get(key) == value:
+            return
+        self.values[key] = value
+        heapq.heappush(self._max, (-value, key))
+        heapq.heappush(self._min, (value, key))
+        if len(self._max) > 2 * len(self.values) + 64:
+            self._max = [(-v, k) for k, v in self.values.items()]
+            self._min = [(v, k) for k, v in self.values.items()]
+            heapq.heapify(self._max)
+            heapq.heapify(self._min)
+
+    def top(self, count, largest=True):
+        # [(key, value)], largest (or smallest) first
+        heap = self._max if largest else self._min
+        out = []
+        keep = []
+        seen = set()
+        while heap and len(out) < count:
+            entry = heapq.heappop(heap)
+            value = -entry[0] if largest else entry[0]
+            key = entry[1]
+            if key in seen or self.values.get(key) != value:
+                continue  # stale or duplicate entry
+            seen.add(key)
+            out.append((key, value))
+            keep.append(entry)
+        for entry in keep:
+            heapq.heappush(heap, entry)
+        return out
+
+    def extremes(self):
+        # ((key, min), (key, max)), or None when empty
+        if not self.values:
+            return None
+        return self.top(1, False)[0], self.top(1, True)[0]
+
+
+class Device:
+
+    __slots__ = ("name", "zone", "history", "rollups", "t_s", "temp", "hum", "source",
+                 "boot", "last_seen", "readings")
+
+    def __init__(self, name, zone, history_capacity, history_interval_s):
+        self.name = name
+        self.zone = zone
+        self.history = History(history_capacity, history_interval_s)
+        self.rollups = Rollups(ROLLUP_LEVELS)
+        self.t_s = None       # device data time of the newest reading
+        self.temp = None
+        self.hum = None
+        self.source = None
+        self.boot = None
+        self.last_seen = None  # host time.monotonic() of the newest reading
+        self.readings = 0
+
+
+class Fleet:
+
+    def __init__(self, zones=None, history_capacity=1440, history_interval_s=60):
+        self.zone_map = zones or {}
+        self.history_capacity = history_capacity
+        self.history_interval_s = history_interval_s
+        self.devices = {}
+        self.recency = collections.OrderedDict()  # name -> None, least recently heard first
+        self.temps = ExtremaIndex()
+        self.zone_temps = {}
+        self.zone_hums = {}
+        self.readings = 0
+        self.errors = 0           # datagrams or lines that could not be parsed
+        self.reboots = 0          # device reboots seen (boot change or data time reset)
+        self.started = time.monotonic()
+
+    def zone_of(self, name):
+        if name in self.zone_map:
+            return self.zone_map[name]
+        return name.split("-", 1)[0] if "-" in name else "default"
+
+    def device(self, name):
+        device = self.devices.get(name)
+        if device is None:
+            device = Device(name, self.zone_of(name), self.history_capacity, self.history_interval_s)
+            self.devices[name] = device
+            self.zone_temps.setdefault(device.zone, ExtremaIndex())
+            self.zone_hums.setdefault(device.zone, ExtremaIndex())
+        return device
+
+    def ingest(self, name, t_s, temp, hum, source, boot=None, now=None):
+        device = self.device(name)
+        rebooted = boot is not None and device.boot is not None and boot != device.boot
+        if device.t_s is not None and device.t_s - t_s > REBOOT_JUMP_S:
+            # No (or an unchanged) boot number, but the data clock restarted
+            rebooted = True
+        if rebooted:
+            # The data clock restarts, so the rings do too
+            device.history = History(self.history_capacity, self.history_interval_s)
+            device.rollups = Rollups(ROLLUP_LEVELS)
+            device.t_s = None
+            self.reboots += 1
+        if boot is not None:
+            device.boot = boot
+        if device.t_s is not None and t_s < device.t_s:
+            # Older than what we have in this boot (e.g. a backlog replayed
+            # out of order): keep it out of the rings, which only move forward
+            device.readings += 1
+            self.readings += 1
+            return
+        device.history.add(t_s, temp, hum)
+        device.rollups.add(t_s, temp, hum)
+        device.t_s = t_s
+        device.temp = temp
+        device.hum = hum
+        device.source = source
+        device.last_seen = time.monotonic() if now is None else now
+        device.readings += 1
+        self.readings += 1
+        self.recency[name] = None
+        self.recency.move_to_end(name)
+        self.temps.update(name, temp)
+        self.zone_temps[device.zone].update(name, temp)
+        self.zone_hums[device.zone].update(name, hum)
+
+    # Queries
+
+    def summary(self, device, now):
+        return {"device": device.name, "zone": device.zone, "temp": device.temp, "hum": device.hum,
+                "source": device.source, "t": device.t_s,
+                "age_s": round(now - device.last_seen, 1) if device.last_seen is not None else None}
+
+    def hottest(self, count, largest=True, now=None):
+        now = time.monotonic() if now is None else now
+        return [self.summary(self.devices[name], now) for name, _ in self.temps.top(count, largest)]
+
+    def stale(self, seconds, now=None):
+        # Devices not heard from for seconds, longest silent first
+        now = time.monotonic() if now is None else now
+        out = []
+        for name in self.recency:
+            device = self.devices[name]
+            if now - device.last_seen < seconds:
+                break
+            out.append(self.summary(device, now))
+        return out
+
+    def zone(self, zone):
+        temps = self.zone_temps.get(zone)
+        if temps is None:
+            return None
+        out = {"zone": zone, "devices": len(temps)}
+        for label, index in (("temp", temps), ("hum", self.zone_hums[zone])):
+            extremes = index.extremes()
+            if extremes is None:
+                out[label] = None
+            else:
+                (lo_name, lo), (hi_name, hi) = extremes
+                out[label] = {"min": lo, "min_device": lo_name, "max": hi, "max_device": hi_name}
+        return out
+
+    def zones(self):
+        return [self.zone(zone) for zone in sorted(self.zone_temps)]
+
+    def device_report(self, name, span_s=3600, now=None):
+        device = self.devices.get(name)
+        if device is None:
+            return None
+        now = time.monotonic() if now is None else now
+        out = self.summary(device, now)
+        out["boot"] = device.boot
+        out["readings"] = device.readings
+        out["history"] = len(device.history)
+        if device.t_s is not None:
+            t_min, t_max, t_sum, t_n, h_min, h_max, h_sum, h_n = device.rollups.query(span_s, device.t_s)
+            out["span_s"] = span_s
+            out["temp_range"] = [from_fixed(t_min) if t_min is not None else None,
+                                 from_fixed(t_max) if t_max is not None else None]
+            out["temp_avg"] = round(t_sum / t_n / SCALE, 2) if t_n else None
+            out["hum_range"] = [from_fixed(h_min) if h_min is not None else None,
+                                from_fixed(h_max) if h_max is not None else None]
+            out["hum_avg"] = round(h_sum / h_n / SCALE, 2) if h_n else None
+        return out
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {"devices": len(self.devices), "zones": len(self.zone_temps), "readings": self.readings,
+                "rate": round(self.readings / elapsed, 1) if elapsed > 0 else None,
+                "errors": self.errors, "reboots": self.reboots, "uptime_s": round(elapsed)}
+
+
+def readings_from_json(obj, default_device):
+    # Yields (device, t_s, temp, hum, source, boot) from a device JSON line
+    # or an MQTT publisher batch
+    if obj.get("type") == "reading":
+        yield default_device, obj["t"], obj.get("temp"), obj.get("hum"), obj.get("source"), obj.get("boot")
+    elif "readings" in obj:
+        device = obj.get("device", default_device)
+        for t_s, temp, hum, source in obj["readings"]:
+            yield device, t_s, temp, hum, source, obj.get("boot")
+
+
+def source_name(code):
+    return telemetry_log.SOURCES[code] if code < len(telemetry_log.SOURCES) else str(code)
+
+
+class StreamParser:
+
+    # One device's byte stream (serial or a capture): binary frames and JSON
+    # lines, mixed with text the board prints in between
+
+    def __init__(self, fleet, name):
+        self.fleet = fleet
+        self.name = name
+        self.decoder = telemetry_stream.FrameDecoder()
+        self._line = bytearray()
+
+    def feed(self, data):
+        for boot, seq, t_s, temp, hum, source in self.decoder.feed(data):
+            self.fleet.ingest(self.name, t_s, from_fixed(temp), from_fixed(hum), source_name(source), boot)
+        line = self._line
+        line += data
+        start = 0
+        while True:
+            end = line.find(b"\n", start)
+            if end < 0:
+                break
+            text = bytes(line[start:end]).strip()
+            start = end + 1
+            # Lines may carry a "[0d 00:01:02] " console prefix
+            brace = text.find(b'{"v"')
+            if brace < 0:
+                continue
+            try:
+                for reading in readings_from_json(json.loads(text[brace:]), self.name):
+                    self.fleet.ingest(*reading)
+            except (ValueError, KeyError, TypeError):
+                self.fleet.errors += 1
+        del line[:start]
+        if len(line) > READ_CHUNK:
+            del line[:-READ_CHUNK]  # no newline in sight (binary only)
+
+
+class UdpReceiver(asyncio.DatagramProtocol):
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.decoders = {}  # sender address -> FrameDecoder
+        self.datagrams = 0
+
+    def datagram_received(self, data, addr):
+        self.datagrams += 1
+        name = f"{addr[0]}:{addr[1]}"
+        if data[:1] == b"{":
+            try:
+                for line in data.splitlines():
+                    if line.strip():
+                        for reading in readings_from_json(json.loads(line), name):
+                            self.fleet.ingest(*reading)
+            except (ValueError, KeyError, TypeError):
+                self.fleet.errors += 1
+            return
+        decoder = self.decoders.get(addr)
+        if decoder is None:
+            decoder = self.decoders[addr] = telemetry_stream.FrameDecoder()
+        frames = 0
+        for boot, seq, t_s, temp, hum, source in decoder.feed(data):
+            self.fleet.ingest(name, t_s, from_fixed(temp), from_fixed(hum), source_name(source), boot)
+            frames += 1
+        if not frames:
+            self.fleet.errors += 1
+
+
+def open_serial(loop, fleet, path):
+    # Registers a serial port with the loop; capture files are read at once
+    name = os.path.basename(path)
+    parser = StreamParser(fleet, name)
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(READ_CHUNK)
+                if not data:
+                    return
+                parser.feed(data)
+    fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+    if os.isatty(fd):
+        import termios
+        import tty
+        tty.setraw(fd, termios.TCSANOW)
+
+    def readable():
+        try:
+            data = os.read(fd, READ_CHUNK)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            data = b""
+        if not data:
+            loop.remove_reader(fd)
+            os.close(fd)
+            return
+        parser.feed(data)
+
+    loop.add_reader(fd, readable)
+
+
+def answer(fleet, line, default_stale_s):
+    # One query line -> one JSON-serializable reply
+    tokens = line.split()
+    if not tokens:
+        return None
+    command, args = tokens[0].lower(), tokens[1:]
+    try:
+        if command in ("hottest", "coldest"):
+            count = int(args[0]) if args else 10
+            return {"type": command, "devices": fleet.hottest(count, command == "hottest")}
+        if command == "stale":
+            seconds = parse_span(args[0]) if args else default_stale_s
+            devices = fleet.stale(seconds)
+            return {"type": "stale", "seconds": seconds, "count": len(devices), "devices": devices}
+        if command == "zones":
+            return {"type": "zones", "zones": fleet.zones()}
+        if command == "zone" and args:
+            zone = fleet.zone(args[0])
+            return {"type": "zone", **zone} if zone else {"type": "error", "text": f"unknown zone {args[0]}"}
+        if command == "device" and args:
+            report = fleet.device_report(args[0], parse_span(args[1]) if len(args) > 1 else 3600)
+            if report is None:
+                return {"type": "error", "text": f"unknown device {args[0]}"}
+            return {"type": "device", **report}
+        if command == "stats":
+            return {"type": "stats", **fleet.stats()}
+        if command == "help":
+            return {"type": "help", "commands": ["hottest [N]", "coldest [N]", "stale [SECONDS]", "zones",
+                                                 "zone NAME", "device NAME [SPAN]", "stats"]}
+    except ValueError:
+        pass
+    return {"type": "error", "text": f"bad query: {line.strip()}"}
+
+
+async def serve_queries(reader, writer, fleet, default_stale_s):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            reply = answer(fleet, line.decode(errors="replace"), default_stale_s)
+            if reply is not None:
+                writer.write((json.dumps({"v": JSON_SCHEMA, **reply}) + "\n").encode())
+                await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def report(fleet, period_s, stale_s, out):
+    while True:
+        await asyncio.sleep(period_s)
+        stats = fleet.stats()
+        hottest = fleet.temps.top(1)
+        hot = f"{hottest[0][0]} {hottest[0][1]}C" if hottest else "-"
+        out.write(f"[fleet] devices={stats['devices']} zones={stats['zones']} readings={stats['readings']} "
+                  f"rate={stats['rate']}/s stale={len(fleet.stale(stale_s))} hottest={hot} "
+                  f"errors={stats['errors']}\n")
+        out.flush()
+
+
+def load_zones(path):
+    zones = {}
+    with open(path) as f:
+        for line in f:
+            parts = [part.strip() for part in line.split(",")]
+            if len(parts) >= 2 and parts[0] and not line.startswith("#"):
+                zones[parts[0]] = parts[1]
+    return zones
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    fleet = Fleet(load_zones(args.zones) if args.zones else None, args.history_capacity, args.history_interval)
+    if args.udp:
+        transport, _ = await loop.create_datagram_endpoint(lambda: UdpReceiver(fleet),
+                                                           local_addr=(args.host, args.udp))
+        try:
+            transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+        except OSError:
+            pass
+        print(f"udp on {args.host}:{args.udp}", file=sys.stderr)
+    for path in args.serial:
+        open_serial(loop, fleet, path)
+    if args.query:
+        await asyncio.start_server(lambda r, w: serve_queries(r, w, fleet, args.stale),
+                                   args.host, args.query)
+        print(f"queries on {args.host}:{args.query}", file=sys.stderr)
+    tasks = []
+    if args.report:
+        tasks.append(asyncio.create_task(report(fleet, args.report, args.stale, sys.stderr)))
+    try:
+        await asyncio.sleep(args.seconds if args.seconds else float("inf"))
+    finally:
+        for task in tasks:
+            task.cancel()
+    return fleet
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate readings from a fleet of PulsPI boards")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--udp", type=int, default=9310, help="UDP port for readings (0 = off)")
+    parser.add_argument("--query", type=int, default=9300, help="TCP port for queries (0 = off)")
+    parser.add_argument("--serial", nargs="+", default=[], help="serial ports or capture files")
+    parser.add_argument("--zones", help="CSV file of device,zone rows")
+    parser.add_argument("--stale", type=parse_span, default=60, help="default staleness for 'stale' (e.g. 30s, 5m)")
+    parser.add_argument("--report", type=float, default=10, help="print a fleet summary every N seconds (0 = off)")
+    parser.add_argument("--history-capacity", type=int, default=1440, help="samples kept per device")
+    parser.add_argument("--history-interval", type=int, default=60, help="seconds averaged per sample")
+    parser.add_argument("--seconds", type=float, help="exit after this long")
+    parser.add_argument("--query-once", metavar="QUERY", action="append", default=[],
+                        help="answer this query on stdout before exiting (repeatable; with --seconds)")
+    args = parser.parse_args(argv)
+
+    try:
+        fleet = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        return 0
+    for query in args.query_once:
+        print(json.dumps({"v": JSON_SCHEMA, **answer(fleet, query, args.stale)}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Simulates a fleet of PulsPI boards sending readings over UDP, to load-test
+tools/fleet_aggregator.py.
+
+    python tools/fleet_aggregator.py --udp 9310 --query 9300 &
+    python tools/fleet_loadgen.py --devices 1000 --zones 10 --seconds 60
+    echo "hottest 5" | nc -q1 localhost 9300
+
+Each simulated device follows its own daily temperature/humidity curve
+(offset per zone, plus noise) and sends one reading every --period seconds,
+with sends spread evenly across the period. Devices are named
+"zone03-dev0042", so the aggregator puts them in zone "zone03".
+
+Formats:
+
+* json    - one reading per datagram, as an MQTT publisher payload
+            `{"device":...,"readings":[[t,temp,hum,source]]}`
+* batch   - `{"device":...,"readings":[...]}` with --batch readings, sent
+            every --batch periods (like the MQTT publisher)
+* binary  - 22-byte telemetry frames; each device sends from its own UDP
+            socket, since frames carry no device name
+
+--silent makes a fraction of the devices stop sending after --silent-after
+seconds, so they show up in "stale" queries. At the end the achieved rate
+and how far the sender fell behind its schedule are printed.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import sys
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.normpath(os.path.join(TOOLS_DIR, "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import telemetry_stream  # noqa: E402
+from history import to_fixed  # noqa: E402
+
+TICK_S = 0.01
+
+
+class SimDevice:
+
+    __slots__ = ("name", "index", "zone", "offset", "phase", "sock", "seq", "pending", "flush_at", "silent_at")
+
+    def __init__(self, index, zones, rng):
+        self.index = index
+        self.zone = index % zones
+        self.name = f"zone{self.zone:02d}-dev{index:04d}"
+        self.offset = self.zone * 0.8 + rng.uniform(-1.5, 1.5)
+        self.phase = rng.uniform(0, 2 * math.pi)
+        self.sock = None
+        self.seq = 0
+        self.pending = []     # readings waiting for a batch
+        self.flush_at = None  # batch size of the next datagram
+        self.silent_at = None
+
+    def reading(self, t_s, rng):
+        day = 2 * math.pi * t_s / 86400 + self.phase
+        temp = round(22 + self.offset + 4 * math.sin(day) + rng.gauss(0, 0.3), 1)
+        hum = round(min(95, max(5, 45 - 10 * math.sin(day) + rng.gauss(0, 1))))
+        return temp, hum
+
+
+def make_sender(args, devices):
+    # Returns send(device, t_s, temp, hum) -> bytes sent (0 if batching)
+    target = (args.host, args.port)
+    if args.format == "binary":
+        try:
+            import resource
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if soft < len(devices) + 64:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, len(devices) + 64), hard))
+        except (ImportError, ValueError, OSError):
+            pass
+        frame = bytearray(telemetry_stream.FRAME_SIZE)
+        for device in devices:
+            device.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            device.sock.setblocking(False)
+
+        def send(device, t_s, temp, hum):
+            telemetry_stream.pack_frame(frame, 1, device.seq, t_s, to_fixed(temp), to_fixed(hum), 1)
+            device.seq += 1
+            device.sock.sendto(frame, target)
+            return len(frame)
+        return send
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    batch = args.batch if args.format == "batch" else 1
+
+    def send(device, t_s, temp, hum):
+        if device.flush_at is None:
+            # Stagger the first batch so devices do not all send in the same period
+            device.flush_at = batch - device.index % batch
+        device.pending.append([t_s, temp, hum, "sensor"])
+        if len(device.pending) < device.flush_at:
+            return 0
+        data = json.dumps({"v": 1, "device": device.name, "boot": 1, "readings": device.pending}).encode()
+        device.pending = []
+        device.flush_at = batch
+        sock.sendto(data, target)
+        return len(data)
+    return send
+
+
+async def generate(args):
+    rng = random.Random(args.seed)
+    devices = [SimDevice(i, args.zones, rng) for i in range(args.devices)]
+    for device in rng.sample(devices, int(len(devices) * args.silent)):
+        device.silent_at = args.silent_after
+    send = make_sender(args, devices)
+    start = time.monotonic()
+    step = args.period / len(devices)   # time between consecutive sends
+    sent = nbytes = errors = 0
+    behind_max = 0.0
+    n = 0                               # index of the next send overall
+    while True:
+        now = time.monotonic() - start
+        if args.seconds and now >= args.seconds:
+            break
+        while n * step <= now:
+            due = n * step
+            behind_max = max(behind_max, now - due)
+            device = devices[n % len(devices)]
+            n += 1
+            if device.silent_at is not None and due >= device.silent_at:
+                continue
+            t_s = int(args.t0 + due)
+            temp, hum = device.reading(t_s, rng)
+            try:
+                nbytes += send(device, t_s, temp, hum)
+                sent += 1
+            except (BlockingIOError, OSError):
+                errors += 1
+        await asyncio.sleep(TICK_S)
+    elapsed = time.monotonic() - start
+    print(f"{args.devices} devices, {sent} readings in {elapsed:.1f}s ({sent / elapsed:.0f}/s, "
+          f"{nbytes / elapsed / 1024:.1f} KiB/s), {errors} send errors, "
+          f"at most {behind_max * 1000:.0f} ms behind schedule", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a fleet of PulsPI boards sending UDP readings")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9310)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--zones", type=int, default=10)
+    parser.add_argument("--period", type=float, default=2.0, help="seconds between readings per device")
+    parser.add_argument("--format", choices=("json", "batch", "binary"), default="json")
+    parser.add_argument("--batch", type=int, default=10, help="readings per datagram for --format batch")
+    parser.add_argument("--silent", type=float, default=0.0, help="fraction of devices that go silent")
+    parser.add_argument("--silent-after", type=float, default=10.0, help="seconds before they do")
+    parser.add_argument("--seconds", type=float, help="stop after this long (default: run until Ctrl-C)")
+    parser.add_argument("--t0", type=int, default=0, help="device data time at the start (seconds)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(generate(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""
+Host-side stand-in for machine.I2C with a PCF8574 backpack and an HD44780
+character LCD behind it.
+
+The emulator decodes the port writes produced by src/pico_i2c_lcd.py (RS, RW,
+E and the data nibble on P4-P7), latches nibbles on the falling edge of E and
+drives a simulated HD44780 (DDRAM, CGRAM, address counter, entry mode, display
+shift, 4/8-bit interface). Every transaction is counted and timed so driver
+changes can be compared on a normal Linux box.
+
+Run it directly to benchmark the LCD stack:
+
+    python tools/lcd_emulator.py
+"""
+import errno
+import os
+import sys
+
+# PCF8574 pin mapping used by pico_i2c_lcd.py
+MASK_RS = 0x01
+MASK_RW = 0x02
+MASK_E = 0x04
+MASK_BACKLIGHT = 0x08
+SHIFT_DATA = 4
+
+# HD44780 execution times (datasheet, fosc = 270 kHz)
+CLEAR_HOME_US = 1520
+INSTRUCTION_US = 37
+DATA_WRITE_US = 41  # 37 us plus t_ADD for the address counter update
+
+# I2C framing: START + address byte + STOP, 9 clocks per byte incl. ACK
+I2C_OVERHEAD_BITS = 9 + 2
+I2C_BITS_PER_BYTE = 9
+
+DEFAULT_ADDR = 0x27
+
+
+class HD44780:
+    # Instruction-level model of an HD44780 controller.
+
+    def __init__(self):
+        self.ddram = bytearray(b" " * 128)  # indexed by DDRAM address
+        self.cgram = bytearray(64)
+        self.address = 0
+        self.target_cgram = False
+        self.increment = True
+        self.entry_shift = False
+        self.display_on = False
+        self.cursor_on = False
+        self.blink_on = False
+        self.two_lines = False
+        self.big_font = False
+        self.eight_bit = True  # controller powers up in 8-bit mode
+        self.shift = 0
+        self._pending = None  # high nibble waiting for its low nibble
+        self.commands = 0
+        self.data_writes = 0
+
+    def strobe(self, nibble, rs):
+        # Handles one falling edge of E. Returns the execution time (us) of
+        # the instruction it completed, or 0 if only a high nibble was taken.
+        if self.eight_bit:
+            # D3-D0 are not wired on a PCF8574 backpack and read as 0
+            return self._execute(nibble << 4, rs)
+        if self._pending is None:
+            self._pending = nibble
+            return 0
+        value = (self._pending << 4) | nibble
+        self._pending = None
+        return self._execute(value, rs)
+
+    def _execute(self, value, rs):
+        if rs:
+            self.data_writes += 1
+            self._write_data(value)
+            return DATA_WRITE_US
+        self.commands += 1
+        if value & 0x80:
+            self.address = value & 0x7f
+            self.target_cgram = False
+        elif value & 0x40:
+            self.address = value & 0x3f
+            self.target_cgram = True
+        elif value & 0x20:
+            self.eight_bit = bool(value & 0x10)
+            self.two_lines = bool(value & 0x08)
+            self.big_font = bool(value & 0x04)
+            self._pending = None
+        elif value & 0x10:
+            right = bool(value & 0x04)
+            if value & 0x08:
+                self.shift = (self.shift + (1 if right else -1)) % 40
+            else:
+                self._step_address(right)
+        elif value & 0x08:
+            self.display_on = bool(value & 0x04)
+            self.cursor_on = bool(value & 0x02)
+            self.blink_on = bool(value & 0x01)
+        elif value & 0x04:
+            self.increment = bool(value & 0x02)
+            self.entry_shift = bool(value & 0x01)
+        elif value & 0x02:
+            self.address = 0
+            self.target_cgram = False
+            self.shift = 0
+            return CLEAR_HOME_US
+        elif value & 0x01:
+            for i in range(len(self.ddram)):
+                self.ddram[i] = 0x20
+            self.address = 0
+            self.target_cgram = False
+            self.increment = True
+            self.shift = 0
+            return CLEAR_HOME_US
+        return INSTRUCTION_US
+
+    def _write_data(self, value):
+        if self.target_cgram:
+            self.cgram[self.address] = value
+            self.address = (self.address + (1 if self.increment else -1)) & 0x3f
+            return
+        self.ddram[self.address] = value
+        self._step_address(self.increment)
+        if self.entry_shift:
+            self.shift = (self.shift + (-1 if self.increment else 1)) % 40
+
+    def _step_address(self, forward):
+        # DDRAM addresses are 0x00-0x27 and 0x40-0x67 in 2-line mode,
+        # 0x00-0x4f in 1-line mode.
+        addr = self.address
+        if self.target_cgram:
+            self.address = (addr + (1 if forward else -1)) & 0x3f
+        elif self.two_lines:
+            if forward:
+                addr = {0x27: 0x40, 0x67: 0x00}.get(addr, addr + 1)
+            else:
+                addr = {0x40: 0x27, 0x00: 0x67}.get(addr, addr - 1)
+            self.address = addr
+        else:
+            self.address = (addr + (1 if forward else -1)) % 0x50
+
+    def cursor_pos(self, num_columns):
+        # Returns the (x, y) position the address counter points at, as
+        # LcdApi.move_to() would name it, or None if it is off-screen.
+        if self.target_cgram:
+            return None
+        line_start = self.address & 0x40
+        offset = self.address - line_start
+        y = 1 if line_start else 0
+        if offset >= num_columns:
+            offset -= num_columns
+            y += 2
+        if offset >= num_columns:
+            return None
+        return offset, y
+
+    def text(self, num_lines, num_columns):
+        # Returns the visible text, one str per row, using the same row
+        # addressing as LcdApi.move_to().
+        rows = []
+        for y in range(num_lines):
+            line_start = 0x40 if y & 1 else 0x00
+            first = num_columns if y & 2 else 0
+            chars = []
+            for x in range(num_columns):
+                chars.append(self.ddram[line_start + (first + x + self.shift) % 40])
+            rows.append(bytes(chars).decode("latin-1"))
+        return rows
+
+
+class PCF8574Lcd:
+    # PCF8574 I/O expander wired to an HD44780 the way pico_i2c_lcd.py expects.
+
+    def __init__(self):
+        self.controller = HD44780()
+        self.port = 0
+        self.backlight = False
+        self.protocol_errors = 0
+
+    def write_port(self, byte):
+        # Returns the execution time (us) of any instruction this write
+        # completed, or 0.
+        previous = self.port
+        self.port = byte
+        self.backlight = bool(byte & MASK_BACKLIGHT)
+        if byte & MASK_RW:
+            # pico_i2c_lcd never reads; a set RW bit means a bad byte
+            self.protocol_errors += 1
+        if previous & MASK_E and not byte & MASK_E:
+            # Data and RS are sampled from the port while E was high
+            return self.controller.strobe((previous >> SHIFT_DATA) & 0x0f,
+                                          previous & MASK_RS)
+        return 0
+
+
+class BusStats:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0
+        self.bytes = 0
+        self.bus_us = 0.0
+        self.busy_violations = 0
+
+    def snapshot(self):
+        return {
+            "transactions": self.transactions,
+            "bytes": self.bytes,
+            "bus_us": self.bus_us,
+            "busy_violations": self.busy_violations,
+        }
+
+
+class FakeI2C:
+    # Stand-in for machine.I2C. Accepts the same constructor arguments and
+    # serves writeto()/scan() from emulated devices.
+    #
+    # If a clock is given (an object with now_us() and advance_us(us)),
+    # transactions are timestamped on it and advance it by their bus time,
+    # so the driver's own sleeps are visible to the busy check. Without a
+    # clock, the LCD is assumed idle at the start of every transaction and
+    # only back-to-back writes inside one transaction are checked.
+
+    def __init__(self, id=0, sda=None, scl=None, freq=400000, clock=None,
+                 lcd_addr=DEFAULT_ADDR):
+        self.id = id
+        self.freq = freq
+        self.clock = clock
+        self.lcd = PCF8574Lcd()
+        self.devices = {lcd_addr: self.lcd}
+        self.stats = BusStats()
+        self._busy_until_us = 0.0
+        self._idle_at_us = 0.0
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def writeto(self, addr, buf, stop=True):
+        device = self.devices.get(addr)
+        if device is None:
+            raise OSError(errno.EIO)
+        if self.clock is not None:
+            start = max(self.clock.now_us(), self._idle_at_us)
+        else:
+            start = self._idle_at_us
+            self._busy_until_us = start
+        bit_us = 1e6 / self.freq
+        count = 0
+        for byte in buf:
+            count += 1
+            # Port outputs change once the byte has been clocked in
+            t = start + (9 + I2C_BITS_PER_BYTE * count) * bit_us
+            exec_us = device.write_port(byte)
+            if exec_us:
+                if t < self._busy_until_us:
+                    self.stats.busy_violations += 1
+                self._busy_until_us = t + exec_us
+        bus_us = (I2C_OVERHEAD_BITS + I2C_BITS_PER_BYTE * count) * bit_us
+        self._idle_at_us = start + bus_us
+        if self.clock is not None:
+            self.clock.advance_us(self._idle_at_us - self.clock.now_us())
+        self.stats.transactions += 1
+        self.stats.bytes += count
+        self.stats.bus_us += bus_us
+        return count
+
+    def text(self, num_lines=2, num_columns=16):
+        return self.lcd.controller.text(num_lines, num_columns)
+
+
+##############################################################################################################
+# Benchmark
+##############################################################################################################
+
+class _BenchClock:
+    # Virtual microsecond clock shared by the utime stub and FakeI2C
+
+    def __init__(self):
+        self.us = 0.0
+
+    def now_us(self):
+        return self.us
+
+    def advance_us(self, us):
+        if us > 0:
+            self.us += us
+
+
+def _install_driver_stubs(clock):
+    # Minimal utime/machine modules so src/pico_i2c_lcd.py imports on CPython
+    import types
+
+    utime = types.ModuleType("utime")
+    utime.sleep_ms = lambda ms: clock.advance_us(ms * 1000)
+    utime.sleep_us = lambda us: clock.advance_us(us)
+    utime.sleep = lambda s: clock.advance_us(s * 1000000)
+    utime.ticks_ms = lambda: int(clock.us // 1000)
+    utime.ticks_us = lambda: int(clock.us)
+    sys.modules["utime"] = utime
+
+    machine = types.ModuleType("machine")
+    machine.I2C = FakeI2C
+    machine.Pin = lambda *args, **kwargs: None
+    sys.modules["machine"] = machine
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the LCD stack against an emulated PCF8574/HD44780")
+    parser.add_argument("--freq", type=int, default=400000, help="I2C clock in Hz (default 400000)")
+    args = parser.parse_args(argv)
+
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+    sys.path.insert(0, os.path.normpath(src))
+    clock = _BenchClock()
+    _install_driver_stubs(clock)
+    from pico_i2c_lcd import I2cLcd
+
+    i2c = FakeI2C(0, freq=args.freq, clock=clock)
+    lcd = I2cLcd(i2c, DEFAULT_ADDR, 2, 16)
+    init = i2c.stats.snapshot()
+    failures = []
+
+    def frame(label, rows, expect=None):
+        i2c.stats.reset()
+        for y, row in enumerate(rows):
+            lcd.frame_write(0, y, row)
+        lcd.flush()
+        report(label, i2c.stats.snapshot())
+        check(label, rows if expect is None else expect)
+
+    def putstr_rows(label, rows):
+        i2c.stats.reset()
+        for y, row in enumerate(rows):
+            lcd.move_to(0, y)
+            lcd.putstr(row)
+        report(label, i2c.stats.snapshot())
+        check(label, rows)
+
+    def check(label, rows):
+        shown = i2c.text(2, 16)
+        if shown != list(rows):
+            failures.append(f"{label}: LCD shows {shown!r}, expected {list(rows)!r}")
+        if i2c.stats.busy_violations:
+            failures.append(f"{label}: {i2c.stats.busy_violations} writes while the LCD was busy")
+
+    print(f"{'scenario':<28}{'txns':>6}{'bytes':>7}{'bus us':>10}")
+
+    def report(label, stats):
+        print(f"{label:<28}{stats['transactions']:>6}{stats['bytes']:>7}{stats['bus_us']:>10.0f}")
+
+    report("init", init)
+    if i2c.lcd.protocol_errors:
+        failures.append(f"init: {i2c.lcd.protocol_errors} PCF8574 protocol errors")
+
+    page1 = ["Up: 71:59:58    ", "T 21/27 H 38/55 "]
+    page2 = ["Temp: 24 \xdf C    ", "Humid: 41 % RH  "]
+    putstr_rows("putstr: full page", page1)
+    frame("flush: unchanged page", page1)
+    frame("flush: uptime +1s", ["Up: 71:59:59    ", page1[1]])
+    frame("flush: uptime hour roll", ["Up: 3d 00:00    ", page1[1]])
+    frame("flush: min/max change", ["Up: 3d 00:00    ", "T 20/27 H 38/56 "])
+    frame("flush: page switch", page2)
+    lcd.invalidate()
+    frame("flush: full redraw", page2)
+
+    for failure in failures:
+        print("FAIL " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Minimal MQTT 3.1.1 broker for testing PulsPI's publisher on a Linux box,
+without installing a real broker.
+
+    python tools/mqtt_broker.py --port 1883
+    python tools/mqtt_broker.py --port 1883 --out readings.jsonl --stats
+
+It accepts any client (CONNECT is answered with CONNACK 0), prints every
+PUBLISH and forwards it to matching subscribers (QoS 0, "+" and "#"
+wildcards), and answers PINGREQ. Enough for the device publisher and for
+`mosquitto_sub`-style clients, not for production: no retained messages,
+no persistent sessions, QoS 1 is acknowledged but delivered as QoS 0.
+
+With --out, each message is appended as a JSON line with the receive time,
+client id, topic and payload (parsed as JSON when it is, else as text).
+--down SECONDS closes the listener and every connection for that long after
+--up SECONDS of service, to exercise the device's offline queue:
+
+    python tools/mqtt_broker.py --port 18830 --up 60 --down 120
+    python tools/simulate.py --hours 1 --speed 10 --set MQTT_BROKER='"127.0.0.1"' --set MQTT_PORT=18830
+"""
+import argparse
+import asyncio
+import json
+import struct
+import sys
+import time
+
+CONNECT = 1
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+PINGREQ = 12
+DISCONNECT = 14
+
+
+def encode_length(length):
+    out = bytearray()
+    while True:
+        byte = length & 0x7f
+        length >>= 7
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out)
+
+
+def topic_matches(pattern, topic):
+    pattern = pattern.split("/")
+    topic = topic.split("/")
+    for i, part in enumerate(pattern):
+        if part == "#":
+            return True
+        if i >= len(topic) or (part != "+" and part != topic[i]):
+            return False
+    return len(pattern) == len(topic)
+
+
+class Broker:
+
+    def __init__(self, out=None, quiet=False):
+        self.out = out
+        self.quiet = quiet
+        self.subscriptions = {}  # writer -> [topic filters]
+        self.writers = set()
+        self.clients = {}        # client id -> [connects, messages, bytes]
+        self.messages = 0
+
+    async def read_packet(self, reader):
+        header = await reader.readexactly(1)
+        length = 0
+        shift = 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        return header[0], await reader.readexactly(length) if length else b""
+
+    async def handle(self, reader, writer):
+        self.writers.add(writer)
+        client_id = None
+        try:
+            while True:
+                header, body = await self.read_packet(reader)
+                kind = header >> 4
+                if kind == CONNECT:
+                    name_length = struct.unpack_from("!H", body, 0)[0]
+                    offset = 2 + name_length + 4  # protocol name, level, flags, keepalive
+                    id_length = struct.unpack_from("!H", body, offset)[0]
+                    client_id = body[offset + 2:offset + 2 + id_length].decode(errors="replace")
+                    self.clients.setdefault(client_id, [0, 0, 0])[0] += 1
+                    writer.write(b"\x20\x02\x00\x00")
+                    if not self.quiet:
+                        print(f"connect {client_id} from {writer.get_extra_info('peername')}", file=sys.stderr)
+                elif kind == PUBLISH:
+                    self.publish(client_id, header, body)
+                    if (header >> 1) & 0x03:
+                        topic_length = struct.unpack_from("!H", body, 0)[0]
+                        packet_id = body[2 + topic_length:4 + topic_length]
+                        writer.write(b"\x40\x02" + packet_id)
+                elif kind == SUBSCRIBE:
+                    packet_id = body[:2]
+                    offset = 2
+                    granted = bytearray()
+                    while offset < len(body):
+                        length = struct.unpack_from("!H", body, offset)[0]
+                        pattern = body[offset + 2:offset + 2 + length].decode()
+                        self.subscriptions.setdefault(writer, []).append(pattern)
+                        offset += 3 + length
+                        granted.append(0)
+                    writer.write(b"\x90" + encode_length(2 + len(granted)) + packet_id + bytes(granted))
+                elif kind == PINGREQ:
+                    writer.write(b"\xd0\x00")
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            self.subscriptions.pop(writer, None)
+            writer.close()
+            if not self.quiet and client_id is not None:
+                print(f"disconnect {client_id}", file=sys.stderr)
+
+    def publish(self, client_id, header, body):
+        topic_length = struct.unpack_from("!H", body, 0)[0]
+        topic = body[2:2 + topic_length].decode(errors="replace")
+        offset = 2 + topic_length + (2 if (header >> 1) & 0x03 else 0)
+        payload = body[offset:]
+        self.messages += 1
+        stats = self.clients.setdefault(client_id, [0, 0, 0])
+        stats[1] += 1
+        stats[2] += len(payload)
+        text = payload.decode(errors="replace")
+        if not self.quiet:
+            print(f"{topic} {text}")
+        if self.out is not None:
+            try:
+                value = json.loads(text)
+            except ValueError:
+                value = text
+            self.out.write(json.dumps({"t": round(time.time(), 3), "client": client_id,
+                                       "topic": topic, "payload": value}) + "\n")
+            self.out.flush()
+        packet = bytes([PUBLISH << 4]) + encode_length(len(body[:2 + topic_length]) + len(payload)) \
+            + body[:2 + topic_length] + payload
+        for writer, patterns in self.subscriptions.items():
+            if any(topic_matches(pattern, topic) for pattern in patterns):
+                writer.write(packet)
+
+    def close_all(self):
+        for writer in list(self.writers):
+            writer.close()
+
+    def print_stats(self, out):
+        for client_id, (connects, messages, nbytes) in sorted(self.clients.items(), key=lambda item: str(item[0])):
+            out.write(f"{client_id}: {connects} connects, {messages} messages, {nbytes} payload bytes\n")
+
+
+async def serve(args, broker):
+    while True:
+        server = await asyncio.start_server(broker.handle, args.host, args.port)
+        print(f"listening on {args.host}:{args.port}", file=sys.stderr)
+        if not args.up:
+            async with server:
+                await server.serve_forever()
+        await asyncio.sleep(args.up)
+        server.close()
+        broker.close_all()
+        await server.wait_closed()
+        print(f"down for {args.down}s", file=sys.stderr)
+        await asyncio.sleep(args.down)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Minimal MQTT broker for testing the PulsPI publisher")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--out", help="append received messages to this file as JSON lines")
+    parser.add_argument("--quiet", action="store_true", help="do not print messages and connects")
+    parser.add_argument("--stats", action="store_true", help="print per-client counts to stderr on exit")
+    parser.add_argument("--seconds", type=float, help="exit after this long")
+    parser.add_argument("--up", type=float, help="serve this long, then go down for --down seconds, repeatedly")
+    parser.add_argument("--down", type=float, default=60)
+    args = parser.parse_args(argv)
+
+    out = open(args.out, "a") if args.out else None
+    broker = Broker(out, args.quiet)
+    try:
+        asyncio.run(asyncio.wait_for(serve(args, broker), args.seconds))
+    except (asyncio.TimeoutError, KeyboardInterrupt):
+        pass
+    finally:
+        if out is not None:
+            out.close()
+    if args.stats:
+        broker.print_stats(sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
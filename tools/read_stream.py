@@ -0,0 +1,144 @@
+"""
+Reads the binary telemetry stream (src/telemetry_stream.py) from one or
+more PulsPI boards at once and writes the readings as CSV.
+
+Enable the stream on each board (`stream 1s` or `stream commits` on the
+serial console), then point the reader at the serial ports:
+
+    python tools/read_stream.py /dev/ttyACM0 /dev/ttyACM1 /dev/ttyACM2 > fleet.csv
+    python tools/read_stream.py /dev/ttyACM* --seconds 600 --stats
+
+Capture files work too, e.g. the raw serial output of the simulator:
+
+    python tools/simulate.py --hours 1 --cmd "5 stream commits" --serial-out capture.bin
+    python tools/read_stream.py capture.bin --stats
+
+Serial ports are switched to raw mode and multiplexed with one selector, so
+any number of boards are read from a single thread without blocking on a
+quiet one. Text the boards print in between (boot messages, command replies)
+is skipped; frames are found by their marker and CRC.
+
+CSV columns: device (port or file name), boot, seq, t_s (data time in
+seconds), temp and hum (blank when unknown) and source.
+"""
+import argparse
+import os
+import selectors
+import sys
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.normpath(os.path.join(TOOLS_DIR, "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import telemetry_log  # noqa: E402
+import telemetry_stream  # noqa: E402
+
+READ_CHUNK = 4096
+
+
+def fmt_fixed(value):
+    if value == telemetry_stream.MISSING:
+        return ""
+    return f"{value / 10:.1f}"
+
+
+def csv_line(device, frame):
+    boot, seq, t_s, temp, hum, source = frame
+    source = telemetry_log.SOURCES[source] if source < len(telemetry_log.SOURCES) else source
+    return f"{device},{boot},{seq},{t_s},{fmt_fixed(temp)},{fmt_fixed(hum)},{source}\n"
+
+
+def open_port(path):
+    # Opens a serial port non-blocking in raw mode (USB CDC ignores the baud rate)
+    fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+    if os.isatty(fd):
+        import termios
+        import tty
+        tty.setraw(fd, termios.TCSANOW)
+    return fd
+
+
+def read_file(path, decoder, device, out):
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(READ_CHUNK)
+            if not data:
+                return
+            for frame in decoder.feed(data):
+                out.write(csv_line(device, frame))
+
+
+def read_ports(ports, decoders, out, seconds=None):
+    # Reads all ports until they close, the time is up or Ctrl-C
+    selector = selectors.DefaultSelector()
+    for path in ports:
+        selector.register(open_port(path), selectors.EVENT_READ, path)
+    deadline = time.monotonic() + seconds if seconds else None
+    try:
+        while selector.get_map():
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            for key, _ in selector.select(timeout):
+                try:
+                    data = os.read(key.fd, READ_CHUNK)
+                except BlockingIOError:
+                    continue
+                except OSError as e:
+                    print(f"{key.data}: {e}", file=sys.stderr)
+                    data = b""
+                if not data:
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    continue
+                device = os.path.basename(key.data)
+                for frame in decoders[key.data].feed(data):
+                    out.write(csv_line(device, frame))
+            out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for key in list(selector.get_map().values()):
+            os.close(key.fd)
+        selector.close()
+
+
+def print_stats(decoders, out):
+    for path, decoder in decoders.items():
+        out.write(f"{path}: {decoder.frames} frames, {decoder.lost} lost, {decoder.crc_errors} CRC errors, "
+                  f"{decoder.reboots} reboots, {decoder.resets} resyncs, {decoder.skipped} bytes skipped\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read PulsPI binary telemetry streams")
+    parser.add_argument("paths", nargs="+", help="serial ports or capture files")
+    parser.add_argument("--out", help="output CSV file (default stdout)")
+    parser.add_argument("--seconds", type=float, help="stop reading serial ports after this long")
+    parser.add_argument("--stats", action="store_true", help="print per-device frame statistics to stderr")
+    args = parser.parse_args(argv)
+
+    decoders = {path: telemetry_stream.FrameDecoder() for path in args.paths}
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        out.write("device,boot,seq,t_s,temp,hum,source\n")
+        ports = []
+        for path in args.paths:
+            if os.path.isfile(path):
+                read_file(path, decoders[path], os.path.basename(path), out)
+            else:
+                ports.append(path)
+        if ports:
+            read_ports(ports, decoders, out, args.seconds)
+    finally:
+        if args.out:
+            out.close()
+    if args.stats:
+        print_stats(decoders, sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,811 @@
+"""
+Runs src/main.py on CPython against fake MicroPython modules driven by a
+virtual clock, so days of device time run in seconds on a Linux box.
+
+The fakes cover everything main.py touches on the device:
+
+* utime      - virtual clock; ticks_ms() wraps like MicroPython (2**30 ms)
+* machine    - Pin and I2C (the PCF8574/HD44780 emulator from lcd_emulator.py)
+* dht        - DHT11 fed from a daily temperature/humidity curve or a CSV script
+* network    - WLAN that connects after a short delay, or never (--wifi down);
+               missing with --no-net, to exercise the NET_AVAILABLE path
+* socket     - real sockets, plus raw ICMP sockets that answer pings after a
+               random RTT (--ping-loss drops some; 192.0.2.x never answers)
+* select     - reports sys.stdin readable (select() or poll()) once a scripted command is due
+* sys.stdin  - scripted commands, each released at a virtual time
+* uasyncio   - single-threaded scheduler that sleeps on the virtual clock
+* config     - src/config.py, with --set KEY=VALUE overrides applied
+
+Examples:
+
+    python tools/simulate.py --days 3
+    python tools/simulate.py --hours 2 --cmd "60 temp 35" --cmd "120 clear"
+    python tools/simulate.py --days 1 --script soak.txt --dht readings.csv --echo
+    python tools/simulate.py --days 1 --set CLI_PERIOD_MS=200 --profile
+    python tools/simulate.py --hours 1 --speed 1    # then curl localhost:9100/metrics
+
+Command scripts hold one "AT COMMAND" per line, AT being seconds of device
+time with an optional s/m/h/d suffix (e.g. "90 temp 30", "2h minmax clear").
+DHT scripts are CSV rows of "seconds,temp,hum"; each row holds until the next.
+"""
+import argparse
+import ast
+import cProfile
+import heapq
+import io
+import math
+import os
+import pstats
+import random
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+import types
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.normpath(os.path.join(TOOLS_DIR, "..", "src"))
+sys.path.insert(0, TOOLS_DIR)
+
+from lcd_emulator import FakeI2C  # noqa: E402
+
+TICKS_PERIOD = 1 << 30  # MicroPython ticks_ms()/ticks_us() wrap here
+TICKS_HALF = TICKS_PERIOD >> 1
+EPOCH_START_S = 1700000000  # arbitrary wall-clock start for utime.time()
+
+
+class SimulationEnd(Exception):
+    # Raised from a sleep once the requested amount of device time has run
+    pass
+
+
+class VirtualClock:
+
+    def __init__(self, duration_s, ticks_start_ms=0, speed=None):
+        self.us = 0
+        self.end_us = int(duration_s * 1000000)
+        self.ticks_start_ms = ticks_start_ms
+        self.speed = speed
+        self.sleeps = 0
+        self._wall_start = time.perf_counter()
+
+    # Interface used by lcd_emulator.FakeI2C
+    def now_us(self):
+        return self.us
+
+    def advance_us(self, us):
+        if us > 0:
+            self.us += int(us)
+
+    def sleep_us(self, us):
+        # Every blocking sleep on the device lands here
+        self.sleeps += 1
+        if self.us + us > self.end_us:
+            self.us = self.end_us
+            raise SimulationEnd()
+        self.advance_us(us)
+        if self.speed:
+            ahead = self.us / 1e6 / self.speed - (time.perf_counter() - self._wall_start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def ticks_ms(self):
+        return (self.ticks_start_ms + self.us // 1000) & (TICKS_PERIOD - 1)
+
+    def ticks_us(self):
+        return (self.ticks_start_ms * 1000 + self.us) & (TICKS_PERIOD - 1)
+
+
+def make_utime(clock):
+    utime = types.ModuleType("utime")
+    utime.ticks_ms = clock.ticks_ms
+    utime.ticks_us = clock.ticks_us
+    utime.ticks_diff = lambda a, b: ((a - b + TICKS_HALF) & (TICKS_PERIOD - 1)) - TICKS_HALF
+    utime.ticks_add = lambda t, delta: (t + delta) & (TICKS_PERIOD - 1)
+    utime.time = lambda: EPOCH_START_S + clock.us // 1000000
+    utime.sleep = lambda s: clock.sleep_us(int(s * 1000000))
+    utime.sleep_ms = lambda ms: clock.sleep_us(int(ms * 1000))
+    utime.sleep_us = lambda us: clock.sleep_us(int(us))
+    return utime
+
+
+def make_machine(clock, i2c_devices):
+    machine = types.ModuleType("machine")
+
+    class Pin:
+        IN = 0
+        OUT = 1
+
+        def __init__(self, pin_id, *args, **kwargs):
+            self.id = pin_id
+
+    def I2C(*args, **kwargs):
+        bus = FakeI2C(*args, clock=clock, **kwargs)
+        i2c_devices.append(bus)
+        return bus
+
+    machine.Pin = Pin
+    machine.I2C = I2C
+    return machine
+
+
+class SensorScript:
+    # Produces DHT11 readings for the current virtual time
+
+    def __init__(self, clock, rows=None, fail_rate=0.0, seed=0):
+        self.clock = clock
+        self.rows = rows
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.reads = 0
+        self.failures = 0
+
+    def read(self):
+        self.reads += 1
+        if self.fail_rate and self.random.random() < self.fail_rate:
+            self.failures += 1
+            raise OSError(110)  # ETIMEDOUT, as the dht driver reports it
+        t = self.clock.us / 1e6
+        if self.rows:
+            temp, hum = self.rows[0][1], self.rows[0][2]
+            for at, row_temp, row_hum in self.rows:
+                if at > t:
+                    break
+                temp, hum = row_temp, row_hum
+            return temp, hum
+        # Daily cycle, with the DHT11's whole-degree resolution
+        phase = math.sin(2 * math.pi * t / 86400)
+        temp = round(23 + 4 * phase + self.random.uniform(-0.5, 0.5))
+        hum = round(45 - 10 * phase + self.random.uniform(-1, 1))
+        return temp, hum
+
+
+def make_dht(sensor_script):
+    dht = types.ModuleType("dht")
+
+    class DHT11:
+
+        def __init__(self, pin):
+            self.pin = pin
+            self._temp = None
+            self._hum = None
+
+        def measure(self):
+            self._temp, self._hum = sensor_script.read()
+
+        def temperature(self):
+            return self._temp
+
+        def humidity(self):
+            return self._hum
+
+    dht.DHT11 = DHT11
+    dht.DHT22 = DHT11
+    return dht
+
+
+def make_network(clock, wifi):
+    network = types.ModuleType("network")
+    network.STA_IF = 0
+    network.AP_IF = 1
+
+    class WLAN:
+
+        def __init__(self, interface):
+            self.interface = interface
+            self._active = False
+            self._connect_at_us = None
+
+        def active(self, state=None):
+            if state is None:
+                return self._active
+            self._active = bool(state)
+
+        def connect(self, ssid=None, password=None):
+            if wifi == "up":
+                self._connect_at_us = clock.us + 2000000  # association + DHCP
+
+        def disconnect(self):
+            self._connect_at_us = None
+
+        def isconnected(self):
+            return self._connect_at_us is not None and clock.us >= self._connect_at_us
+
+        def status(self, param=None):
+            if param == "rssi":
+                return -55
+            return 3 if self.isconnected() else 0
+
+        def ifconfig(self):
+            if self.isconnected():
+                return ("192.168.4.20", "255.255.255.0", "192.168.4.1", "192.168.4.1")
+            return ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0")
+
+    network.WLAN = WLAN
+    return network
+
+
+def make_socket(clock, seed, loss_rate):
+    # Real sockets, except raw ICMP ones: those answer echo requests after a
+    # random 2-40 ms RTT, drop loss_rate of them, and never answer for
+    # addresses in TEST-NET-1 (192.0.2.0/24), to exercise timeouts
+    import socket as real_socket
+    module = types.ModuleType("socket")
+    for name in dir(real_socket):
+        if name.isupper() or name in ("getaddrinfo", "error", "timeout"):
+            setattr(module, name, getattr(real_socket, name))
+    rng = random.Random(seed + 1)
+
+    class IcmpSocket:
+
+        def __init__(self):
+            self.replies = []  # (due_us, packet, address), in due order
+
+        def setblocking(self, flag):
+            pass
+
+        def sendto(self, data, address):
+            data = bytes(data)
+            if data[0] == 8 and not address[0].startswith("192.0.2.") and rng.random() >= loss_rate:
+                reply = bytes([0]) + data[1:]
+                header = bytes([0x45]) + bytes(19)  # IPv4 header, as lwIP hands it over
+                due_us = clock.us + rng.randint(2000, 40000)
+                self.replies.append((due_us, header + reply, address))
+                self.replies.sort(key=lambda entry: entry[0])
+            return len(data)
+
+        def recvfrom(self, size):
+            if self.replies and self.replies[0][0] <= clock.us:
+                _, packet, address = self.replies.pop(0)
+                return packet[:size], address
+            raise OSError(11, "EAGAIN")
+
+        def close(self):
+            self.replies = []
+
+    def socket(family=real_socket.AF_INET, kind=real_socket.SOCK_STREAM, proto=0):
+        if kind == real_socket.SOCK_RAW:
+            return IcmpSocket()
+        return real_socket.socket(family, kind, proto)
+
+    module.socket = socket
+    return module
+
+
+class _Wait:
+    # Awaitable handed back to the scheduler: ("sleep", wake_us) or ("join", task)
+
+    def __init__(self, kind, arg):
+        self.kind = kind
+        self.arg = arg
+
+    def __await__(self):
+        yield self
+
+
+class Task:
+
+    def __init__(self, coro):
+        self.coro = coro
+        self.done = False
+        self.result = None
+        self.waiters = []
+
+    def __await__(self):
+        if not self.done:
+            yield _Wait("join", self)
+        return self.result
+
+
+class Scheduler:
+    # Minimal uasyncio event loop. Idle time is spent in clock.sleep_us(), so
+    # the run ends (SimulationEnd) like any other sleep past the deadline.
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.queue = []  # heap of (wake_us, seq, task)
+        self.seq = 0
+        self.steps = 0
+        self.watch = None  # optional (interval_us, callback) run between steps
+        self._next_watch_us = 0
+
+    def schedule(self, task, wake_us):
+        self.seq += 1
+        heapq.heappush(self.queue, (wake_us, self.seq, task))
+
+    def create_task(self, coro):
+        task = Task(coro)
+        self.schedule(task, self.clock.us)
+        return task
+
+    def run(self, coro):
+        main_task = self.create_task(coro)
+        clock = self.clock
+        while not main_task.done:
+            wake_us, _, task = heapq.heappop(self.queue)
+            if wake_us > clock.us:
+                clock.sleep_us(wake_us - clock.us)
+            self.steps += 1
+            if self.watch is not None and clock.us >= self._next_watch_us:
+                interval_us, callback = self.watch
+                self._next_watch_us = clock.us + interval_us
+                callback()
+            try:
+                wait = task.coro.send(None)
+            except StopIteration as stop:
+                task.done = True
+                task.result = stop.value
+                for waiter in task.waiters:
+                    self.schedule(waiter, clock.us)
+                continue
+            if wait.kind == "sleep":
+                self.schedule(task, wait.arg)
+            elif wait.kind == "join":
+                wait.arg.waiters.append(task)
+        return main_task.result
+
+
+def make_uasyncio(scheduler):
+    uasyncio = types.ModuleType("uasyncio")
+    clock = scheduler.clock
+
+    def sleep_ms(ms):
+        return _Wait("sleep", clock.us + max(0, int(ms * 1000)))
+
+    def sleep(s):
+        return sleep_ms(s * 1000)
+
+    async def gather(*aws):
+        tasks = [aw if isinstance(aw, Task) else scheduler.create_task(aw) for aw in aws]
+        results = []
+        for task in tasks:
+            results.append(await task)
+        return results
+
+    uasyncio.sleep_ms = sleep_ms
+    uasyncio.sleep = sleep
+    uasyncio.gather = gather
+    uasyncio.create_task = scheduler.create_task
+    uasyncio.run = scheduler.run
+    return uasyncio
+
+
+def load_config(overrides):
+    # Loads src/config.py as a fresh module and applies KEY=VALUE overrides
+    config = types.ModuleType("config")
+    path = os.path.join(SRC_DIR, "config.py")
+    with open(path) as f:
+        exec(compile(f.read(), path, "exec"), config.__dict__)
+    for override in overrides:
+        key, _, value = override.partition("=")
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass  # plain string
+        setattr(config, key.strip(), value)
+    return config
+
+
+class ScriptedStdin:
+    # Stand-in for sys.stdin that releases each scripted line at its time
+
+    def __init__(self, clock, entries):
+        self.clock = clock
+        self.entries = sorted(entries, key=lambda entry: entry[0])
+        self.pending = ""  # released text not yet read
+        self.fed = 0
+
+    def _release(self):
+        while self.entries and self.entries[0][0] <= self.clock.us:
+            self.pending += self.entries.pop(0)[1] + "\n"
+            self.fed += 1
+
+    def ready(self):
+        self._release()
+        return bool(self.pending)
+
+    def readline(self):
+        self._release()
+        line, sep, rest = self.pending.partition("\n")
+        self.pending = rest
+        return line + sep
+
+    def read(self, n=-1):
+        self._release()
+        if n is None or n < 0:
+            n = len(self.pending)
+        text, self.pending = self.pending[:n], self.pending[n:]
+        return text
+
+
+def make_select(stdin):
+    select = types.ModuleType("select")
+
+    def select_fn(rlist, wlist, xlist, timeout=None):
+        readable = [s for s in rlist if s is stdin and stdin.ready()]
+        return readable, [], []
+
+    class Poll:
+        def __init__(self):
+            self.objects = []
+
+        def register(self, obj, eventmask=None):
+            self.objects.append(obj)
+
+        def poll(self, timeout=-1):
+            return [(s, select.POLLIN) for s in self.objects if s is stdin and stdin.ready()]
+
+    select.select = select_fn
+    select.poll = Poll
+    select.POLLIN = 0x0001
+    select.POLLOUT = 0x0004
+    select.POLLERR = 0x0008
+    select.POLLHUP = 0x0010
+    return select
+
+
+class ConsoleBuffer:
+    # sys.stdout.buffer: binary writes (telemetry stream frames)
+
+    def __init__(self, console):
+        self.console = console
+
+    def write(self, data):
+        self.console.binary_bytes += len(data)
+        if self.console.serial_out is not None:
+            self.console.serial_out.write(bytes(data))
+        return len(data)
+
+
+class Console(io.TextIOBase):
+    # Collects device output, optionally echoing it with virtual timestamps.
+    # With serial_out (a binary file) everything the device sends, text and
+    # binary, is also written there in order, as a host would receive it.
+
+    def __init__(self, clock, echo_to=None, serial_out=None):
+        self.clock = clock
+        self.echo_to = echo_to
+        self.serial_out = serial_out
+        self.lines = 0
+        self.binary_bytes = 0
+        self.tail = []
+        self._partial = ""
+        self.buffer = ConsoleBuffer(self)
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if self.serial_out is not None:
+            self.serial_out.write(text.encode())
+        self._partial += text
+        while "\n" in self._partial:
+            line, self._partial = self._partial.split("\n", 1)
+            self.lines += 1
+            self.tail.append(line)
+            del self.tail[:-10]
+            if self.echo_to is not None:
+                self.echo_to.write(f"[{format_duration(self.clock.us // 1000000)}] {line}\n")
+        return len(text)
+
+
+def parse_at(text):
+    # "90", "90s", "15m", "2h", "1.5d" -> seconds
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    text = text.strip().lower()
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def parse_command_entry(text):
+    at, _, command = text.strip().partition(" ")
+    return int(parse_at(at) * 1000000), command.strip()
+
+
+def load_command_script(path):
+    entries = []
+    with open(path) as f:
+        for raw in f:
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                continue
+            entries.append(parse_command_entry(line))
+    return entries
+
+
+def load_dht_script(path):
+    rows = []
+    with open(path) as f:
+        for raw in f:
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                continue
+            at, temp, hum = line.split(",")[:3]
+            try:
+                rows.append((parse_at(at), float(temp), float(hum)))
+            except ValueError:
+                continue  # header row
+    rows.sort()
+    return rows
+
+
+def format_duration(total_s):
+    total_s = int(total_s)
+    days, rem = divmod(total_s, 86400)
+    hours, rem = divmod(rem, 3600)
+    minutes, seconds = divmod(rem, 60)
+    return f"{days}d {hours:02}:{minutes:02}:{seconds:02}"
+
+
+class _NullI2C:
+
+    def writeto(self, addr, buf, stop=True):
+        return len(buf)
+
+
+class ClockCheck:
+    # Cross-checks main.py's monotonic clock and uptime against the virtual
+    # clock while the run crosses ticks_ms() wraps.
+
+    def __init__(self, clock, module):
+        self.clock = clock
+        self.module = module
+        self.samples = 0
+        self.failures = []
+        self._base_ms = None
+        self._last_uptime_s = None
+
+    def __call__(self):
+        state = self.module.__dict__
+        if "get_uptime" not in state:
+            return  # main.py is still booting
+        virtual_ms = self.clock.us // 1000
+        uptime = state["get_uptime"]()
+        uptime_s = state["parse_uptime_str"](uptime) - state["STATE"].uptime_offset_s
+        if self._base_ms is None:
+            self._base_ms = virtual_ms - uptime_s * 1000
+        self.samples += 1
+        if "monotonic_ms" in state:
+            mono_ms = state["monotonic_ms"]()
+            if abs(virtual_ms - self._base_ms - mono_ms) >= 1000:
+                self.fail(f"monotonic_ms() reads {mono_ms}, expected ~{virtual_ms - self._base_ms}")
+        expected_s = (virtual_ms - self._base_ms) // 1000
+        # "Xd HH:MM" drops the seconds past 72h
+        if not 0 <= expected_s - uptime_s <= 60:
+            self.fail(f"get_uptime() shows {uptime!r}, expected {format_duration(expected_s)}")
+        if self._last_uptime_s is not None and uptime_s < self._last_uptime_s:
+            self.fail(f"get_uptime() went backwards to {uptime!r}")
+        self._last_uptime_s = uptime_s
+
+    def fail(self, message):
+        if len(self.failures) < 20:
+            self.failures.append(f"[{format_duration(self.clock.us // 1000000)}] {message}")
+
+    def wraps(self):
+        return (self.clock.ticks_start_ms + self.clock.us // 1000) // TICKS_PERIOD
+
+
+class Simulation:
+
+    def __init__(self, args):
+        self.args = args
+        duration = args.seconds + args.minutes * 60 + args.hours * 3600 + args.days * 86400
+        if duration <= 0:
+            duration = 60
+        self.clock = VirtualClock(duration, args.ticks_start, args.speed)
+        self.scheduler = Scheduler(self.clock)
+        self.sensor = SensorScript(self.clock,
+                                   load_dht_script(args.dht) if args.dht else None,
+                                   args.dht_fail_rate, args.seed)
+        entries = []
+        if args.script:
+            entries += load_command_script(args.script)
+        entries += [parse_command_entry(entry) for entry in args.cmd]
+        self.stdin = ScriptedStdin(self.clock, entries)
+        self.serial_out = open(args.serial_out, "wb") if args.serial_out else None
+        self.console = Console(self.clock, sys.__stdout__ if args.echo else None, self.serial_out)
+        self.i2c_buses = []
+        self.module = None
+        self.error = None
+        self.clock_check = None
+
+    def fake_modules(self):
+        modules = {
+            "utime": make_utime(self.clock),
+            "machine": make_machine(self.clock, self.i2c_buses),
+            "dht": make_dht(self.sensor),
+            "network": make_network(self.clock, self.args.wifi),
+            "select": make_select(self.stdin),
+            "uasyncio": make_uasyncio(self.scheduler),
+            "config": load_config(self.args.set),
+            "socket": make_socket(self.clock, self.args.seed, self.args.ping_loss),
+        }
+        if self.args.no_net:
+            modules["network"] = None  # import fails, as on a Pico without Wi-Fi
+        return modules
+
+    def run(self):
+        fakes = self.fake_modules()
+        saved_modules = {name: sys.modules.get(name) for name in list(fakes) + ["ping_monitor", "main"]}
+        saved_stdio = sys.stdin, sys.stdout
+        saved_cwd = os.getcwd()
+        fs_root = self.args.fs or tempfile.mkdtemp(prefix="pulspi-fs-")
+        sys.path.insert(0, SRC_DIR)
+        # Modules from src/ bind the fakes (utime, socket) on import, so each
+        # run (e.g. several in one test session) imports its own copies
+        for name, module in list(sys.modules.items()):
+            if os.path.dirname(getattr(module, "__file__", None) or "") == SRC_DIR:
+                del sys.modules[name]
+        sys.modules.update(fakes)
+        self.module = types.ModuleType("main")
+        self.module.__file__ = os.path.join(SRC_DIR, "main.py")
+        sys.modules["main"] = self.module
+        if self.args.check_clock:
+            self.clock_check = ClockCheck(self.clock, self.module)
+            self.scheduler.watch = (int(self.args.check_clock * 1000000), self.clock_check)
+        with open(self.module.__file__) as f:
+            code = compile(f.read(), self.module.__file__, "exec")
+
+        profiler = cProfile.Profile() if self.args.profile else None
+        wall_start = time.perf_counter()
+        try:
+            os.chdir(fs_root)
+            sys.stdin, sys.stdout = self.stdin, self.console
+            if profiler:
+                profiler.enable()
+            exec(code, self.module.__dict__)
+        except SimulationEnd:
+            pass
+        except Exception:
+            self.error = traceback.format_exc()
+        finally:
+            if profiler:
+                profiler.disable()
+            self.wall_s = time.perf_counter() - wall_start
+            sys.stdin, sys.stdout = saved_stdio
+            if self.serial_out is not None:
+                self.serial_out.close()
+            os.chdir(saved_cwd)
+            sys.path.remove(SRC_DIR)
+            for name, module in saved_modules.items():
+                if module is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = module
+        self.fs_root = fs_root
+        self.profiler = profiler
+        return self.error is None and not (self.clock_check and self.clock_check.failures)
+
+    def measure_render_alloc(self, frames=200, out=sys.stdout):
+        # Renders every display page repeatedly after the run, advancing the
+        # clock one second per frame so uptime changes, and reports the peak
+        # bytes held by temporaries while rendering and flushing a frame.
+        # CPython allocates differently from MicroPython (e.g. ints above 256
+        # are objects), so this is a proxy for comparing render paths; the
+        # device's own figure comes from gc.mem_alloc() (see the 'perf' command).
+        state = self.module.__dict__
+        pages = state.get("PAGES")
+        if not pages:
+            return
+        lcd = state["lcd"]
+        # Keep the emulator's own bookkeeping out of the figures
+        bus, lcd.i2c = lcd.i2c, _NullI2C()
+        print("", file=out)
+        print("render alloc  peak temporary bytes per frame (CPython proxy; see 'perf' on the device)", file=out)
+        print(f"{'':<14}{'page':<24}{'avg bytes':>10}{'max bytes':>10}", file=out)
+        tracemalloc.start()
+        try:
+            for page in pages:
+                render = page[0] if isinstance(page, tuple) else page
+                peaks = []
+                for _ in range(frames):
+                    self.clock.advance_us(1000000)
+                    current, _ = tracemalloc.get_traced_memory()
+                    tracemalloc.reset_peak()
+                    render()
+                    lcd.flush()
+                    peaks.append(tracemalloc.get_traced_memory()[1] - current)
+                print(f"{'':<14}{render.__name__:<24}{sum(peaks) / len(peaks):>10.0f}{max(peaks):>10}", file=out)
+        finally:
+            tracemalloc.stop()
+            lcd.i2c = bus
+
+    def report(self, out=sys.stdout):
+        clock = self.clock
+        device_s = clock.us / 1e6
+        wall_s = max(self.wall_s, 1e-9)
+        state = self.module.__dict__
+        print(f"device time   {format_duration(device_s)} ({device_s:.0f} s)", file=out)
+        print(f"wall time     {wall_s:.2f} s ({device_s / wall_s:.0f}x)", file=out)
+        print(f"sleeps        {clock.sleeps}", file=out)
+        steps = self.scheduler.steps
+        print(f"task steps    {steps} ({wall_s * 1e6 / max(steps, 1):.1f} us wall each)", file=out)
+        for name, (runs, late, errors, worst_us) in sorted(state.get("TASK_STATS", {}).items()):
+            print(f"task {name:<8} {runs} runs, {late} late, {errors} errors, worst {worst_us} us", file=out)
+        if self.i2c_buses:
+            stats = self.i2c_buses[0].stats
+            per_s = 1 / max(device_s, 1e-9)
+            print(f"i2c           {stats.transactions} txns, {stats.bytes} bytes, "
+                  f"{stats.bus_us / 1000:.0f} ms bus "
+                  f"({stats.transactions * per_s:.2f} txns/s, {stats.bus_us * per_s / 1000:.3f} ms/s)", file=out)
+            if stats.busy_violations:
+                print(f"i2c           {stats.busy_violations} writes while the LCD was busy", file=out)
+            for row in self.i2c_buses[0].text(2, 16):
+                print(f"lcd           |{row}|", file=out)
+        print(f"dht           {self.sensor.reads} reads, {self.sensor.failures} failures", file=out)
+        print(f"stdin         {self.stdin.fed} commands fed", file=out)
+        print(f"console       {self.console.lines} lines", file=out)
+        if self.console.binary_bytes:
+            print(f"binary        {self.console.binary_bytes} bytes", file=out)
+        if "STATE" in state:
+            device_state = state["STATE"]
+            for name in device_state.__slots__:
+                if not name.startswith("_") and name != "pending":
+                    print(f"{name:<15} {getattr(device_state, name)!r}", file=out)
+        if "RENDER_COUNT" in state:
+            print(f"renders       {state['RENDER_COUNT']}", file=out)
+        if "get_uptime" in state:
+            print(f"uptime        {state['get_uptime']()}", file=out)
+        print(f"filesystem    {self.fs_root}", file=out)
+        if self.clock_check:
+            check = self.clock_check
+            print(f"clock check   {check.samples} samples across {check.wraps()} ticks_ms() wraps, "
+                  f"{len(check.failures)} failures", file=out)
+            for failure in check.failures:
+                print("  " + failure, file=out)
+        if self.error:
+            print("", file=out)
+            print(f"main.py raised at device time {format_duration(device_s)}:", file=out)
+            print(self.error, file=out)
+            print("last console lines:", file=out)
+            for line in self.console.tail:
+                print("  " + line, file=out)
+        if self.profiler:
+            print("", file=out)
+            pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(25)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run src/main.py against fake MicroPython modules on a virtual clock")
+    parser.add_argument("--days", type=float, default=0)
+    parser.add_argument("--hours", type=float, default=0)
+    parser.add_argument("--minutes", type=float, default=0)
+    parser.add_argument("--seconds", type=float, default=0)
+    parser.add_argument("--script", help="file of 'AT COMMAND' lines fed to stdin")
+    parser.add_argument("--cmd", action="append", default=[], help="one 'AT COMMAND' entry (repeatable)")
+    parser.add_argument("--dht", help="CSV of 'seconds,temp,hum' readings")
+    parser.add_argument("--dht-fail-rate", type=float, default=0.0, help="fraction of DHT reads that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--wifi", choices=("up", "down"), default="up")
+    parser.add_argument("--no-net", action="store_true", help="omit network (standard Pico behaviour)")
+    parser.add_argument("--ping-loss", type=float, default=0.0, help="fraction of ICMP echo replies lost")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a config.py value (repeatable)")
+    parser.add_argument("--ticks-start", type=int, default=0, help="initial ticks_ms() value, to test wraparound")
+    parser.add_argument("--check-clock", type=float, metavar="SECONDS",
+                        help="check main.py's monotonic clock and uptime against virtual time at this interval")
+    parser.add_argument("--speed", type=float, help="pace the run at this multiple of real time")
+    parser.add_argument("--fs", help="directory used as the device filesystem (default: fresh temp dir)")
+    parser.add_argument("--echo", action="store_true", help="print device output with virtual timestamps")
+    parser.add_argument("--serial-out", metavar="FILE",
+                        help="write the raw serial output (text and binary frames) to FILE")
+    parser.add_argument("--profile", action="store_true", help="profile the run and print the top functions")
+    parser.add_argument("--measure-alloc", action="store_true",
+                        help="after the run, measure temporary memory used per rendered frame")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sim = Simulation(args)
+    ok = sim.run()
+    sim.report()
+    if args.measure_alloc and sim.module is not None:
+        sim.measure_render_alloc()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())